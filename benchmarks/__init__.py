@@ -0,0 +1,8 @@
+"""Бенчмарки edsbot на синтетических данных.
+
+Запуск из корня репозитория:
+    python -m benchmarks.suite --entities 10000 --out bench.json
+    python -m benchmarks.suite --entities 10000 --compare bench.json
+
+Отдельные сценарии: bench_click, bench_import, bench_search.
+"""
@@ -0,0 +1,74 @@
+"""Задержка одного «клика» по дереву: соединение на запрос, пул, пул + кэш.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_click [--clicks 300] [--persons 50]
+"""
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import bot
+
+
+async def _seed(persons: int):
+    async with bot.db_write() as db:
+        async with db.execute("SELECT id FROM grp") as cur:
+            groups = [r[0] for r in await cur.fetchall()]
+        rows = [
+            (f"Сотрудник {gid}-{i}", "person", gid)
+            for gid in groups for i in range(persons)
+        ]
+        await db.executemany("INSERT INTO entity(name, kind, group_id) VALUES (?,?,?)", rows)
+    return groups
+
+
+async def _click(group_id: int):
+    # то же, что делает tree_handle_callback на «enter»: группа + две вьюхи
+    path = await bot._tree_path(group_id)
+    await bot._build_tree_view_browse(path, "groups")
+    await bot._build_tree_view_picker("sign_update", path)
+
+
+async def _measure(groups: list[int], clicks: int) -> list[float]:
+    samples = []
+    for i in range(clicks):
+        t0 = time.perf_counter()
+        await _click(groups[i % len(groups)])
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+def _report(label: str, samples: list[float]):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{label:<12} mean={statistics.mean(samples):7.2f} ms  "
+          f"p50={statistics.median(samples):7.2f} ms  p95={p95:7.2f} ms")
+
+
+async def main(clicks: int, persons: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        bot.DB_PATH = str(Path(tmp) / "bench.sqlite")
+        await bot.init_db()
+        groups = await _seed(persons)
+
+        _report("per-query", await _measure(groups, clicks))
+
+        await bot.open_pool()
+        try:
+            _report("pool", await _measure(groups, clicks))
+            await bot.ORG_CACHE.load()
+            _report("pool+cache", await _measure(groups, clicks))
+        finally:
+            bot.ORG_CACHE.clear()
+            await bot.close_pool()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clicks", type=int, default=300)
+    ap.add_argument("--persons", type=int, default=50)
+    args = ap.parse_args()
+    asyncio.run(main(args.clicks, args.persons))
@@ -0,0 +1,98 @@
+"""Импорт реестра из файла: разбор, проверка и запись N строк.
+
+Прогон дважды: на пустую базу (всё новое) и повторно (все строки — продление).
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_import [--rows 10000] [--format csv|xlsx]
+"""
+import argparse
+import asyncio
+import csv
+import io
+import tempfile
+import time
+import zipfile
+from datetime import date, timedelta
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+import bot
+
+HEADER = ["группа", "имя", "тип", "срок", "примечание"]
+
+
+async def _group_paths() -> list[str]:
+    async with bot.db_read() as db:
+        async with db.execute("SELECT id, name, parent_id FROM grp") as cur:
+            groups = {r["id"]: r for r in await cur.fetchall()}
+
+    def path(gid):
+        g = groups[gid]
+        return (path(g["parent_id"]) + " / " if g["parent_id"] else "") + g["name"]
+
+    return [path(gid) for gid in groups]
+
+
+def _rows(count: int, paths: list[str], shift: int) -> list[list[str]]:
+    start = date.today()
+    return [
+        [paths[i % len(paths)], f"Сотрудник {i:05}", "ФЛ",
+         (start + timedelta(days=(i + shift) % 365)).strftime("%d.%m.%Y"), f"партия {shift}"]
+        for i in range(count)
+    ]
+
+
+def _csv(rows: list[list[str]]) -> bytes:
+    buf = io.StringIO()
+    w = csv.writer(buf, delimiter=";")
+    w.writerow(HEADER)
+    w.writerows(rows)
+    return buf.getvalue().encode("utf-8-sig")
+
+
+def _xlsx(rows: list[list[str]]) -> bytes:
+    ns = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+    body = "".join(
+        f'<row r="{r}">' + "".join(
+            f'<c t="inlineStr"><is><t>{escape(v)}</t></is></c>' for v in row
+        ) + "</row>"
+        for r, row in enumerate([HEADER, *rows], start=1)
+    )
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("xl/worksheets/sheet1.xml", f"<worksheet {ns}><sheetData>{body}</sheetData></worksheet>")
+    return buf.getvalue()
+
+
+async def _run_once(label: str, filename: str, data: bytes):
+    t0 = time.perf_counter()
+    table = bot.read_import_table(filename, data)
+    t1 = time.perf_counter()
+    stats, errors = await bot.import_registry(table)
+    t2 = time.perf_counter()
+    assert not errors, errors[:5]
+    print(f"{label:<8} parse={(t1 - t0) * 1000:7.1f} ms  validate+write={(t2 - t1) * 1000:7.1f} ms  "
+          f"total={(t2 - t0):5.2f} s  {stats}")
+
+
+async def main(rows: int, fmt: str):
+    with tempfile.TemporaryDirectory() as tmp:
+        bot.DB_PATH = str(Path(tmp) / "bench.sqlite")
+        await bot.init_db()
+        await bot.open_pool()
+        try:
+            paths = await _group_paths()
+            encode = _xlsx if fmt == "xlsx" else _csv
+            filename = f"registry.{fmt}"
+            await _run_once("insert", filename, encode(_rows(rows, paths, 0)))
+            await _run_once("renew", filename, encode(_rows(rows, paths, 30)))
+        finally:
+            await bot.close_pool()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=10000)
+    ap.add_argument("--format", choices=("csv", "xlsx"), default="csv")
+    args = ap.parse_args()
+    asyncio.run(main(args.rows, args.format))
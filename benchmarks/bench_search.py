@@ -0,0 +1,70 @@
+"""Задержка поиска по имени (/find и шаг поиска в дереве) на большом реестре.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_search [--entities 100000] [--repeat 50]
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import bot
+
+SURNAMES = ["Иванов", "Петров", "Сидоров", "Смирнов", "Кузнецов", "Попов", "Васильев",
+            "Соколов", "Михайлов", "Новиков", "Фёдоров", "Морозов", "Волков", "Лебедев"]
+FIRST_NAMES = ["Иван", "Пётр", "Сергей", "Анна", "Мария", "Ольга", "Дмитрий", "Елена"]
+
+# запрос -> что он проверяет
+QUERIES = {
+    "ова": "широкая триграмма, десятки тысяч совпадений",
+    "кузнецова": "одно слово, тысячи совпадений",
+    "анна 1234": "два слова, единицы совпадений",
+    "ив": "короткий запрос, начало имени",
+    "несуществующий": "нет совпадений",
+}
+
+
+async def _seed(count: int):
+    rnd = random.Random(1)
+    names = set()
+    while len(names) < count:
+        names.add(f"{rnd.choice(SURNAMES)}{rnd.choice(['', 'а'])} "
+                  f"{rnd.choice(FIRST_NAMES)} {rnd.randint(1, 999999)}")
+    async with bot.db_write() as db:
+        await db.executemany(
+            "INSERT INTO entity(name, kind) VALUES (?, 'person')", [(n,) for n in names]
+        )
+
+
+async def main(entities: int, repeat: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        bot.DB_PATH = str(Path(tmp) / "bench.sqlite")
+        await bot.init_db()
+        await bot.open_pool()
+        try:
+            t0 = time.perf_counter()
+            await _seed(entities)
+            print(f"seed {entities} entities (with FTS triggers): {time.perf_counter() - t0:.2f} s")
+            for query, label in QUERIES.items():
+                samples = []
+                for _ in range(repeat):
+                    t0 = time.perf_counter()
+                    rows = await bot.search_entities(query)
+                    samples.append((time.perf_counter() - t0) * 1000)
+                samples.sort()
+                p95 = samples[int(len(samples) * 0.95) - 1]
+                print(f"{query!r:<18} mean={statistics.mean(samples):6.2f} ms  p95={p95:6.2f} ms  "
+                      f"hits={len(rows):<3} {label}")
+        finally:
+            await bot.close_pool()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--entities", type=int, default=100_000)
+    ap.add_argument("--repeat", type=int, default=50)
+    args = ap.parse_args()
+    asyncio.run(main(args.entities, args.repeat))
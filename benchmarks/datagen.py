@@ -0,0 +1,95 @@
+"""Генератор синтетического реестра с фиксированным seed.
+
+Строит глубокое дерево grp под базовой ORG_STRUCTURE, ЮЛ на каждую группу,
+сотрудников по группам, активные подписи с реалистичным распределением
+сроков и неактивные строки истории.
+"""
+import random
+from datetime import date, timedelta
+
+import bot
+
+SURNAMES = ["Иванов", "Петров", "Сидоров", "Смирнов", "Кузнецов", "Попов", "Васильев",
+            "Соколов", "Михайлов", "Новиков", "Фёдоров", "Морозов", "Волков", "Лебедев"]
+INITIALS = "АБВГДЕИКЛМНОПРСТ"
+
+
+def _expiry_offset(rnd: random.Random) -> int:
+    """Дней от сегодня до окончания подписи.
+
+    Сертификаты выдаются на год равномерно в течение года, часть давно
+    истекла и не продлена, немного «вечных» выпущено на 15 месяцев.
+    """
+    roll = rnd.random()
+    if roll < 0.04:
+        return -rnd.randint(31, 400)
+    if roll < 0.10:
+        return rnd.randint(366, 455)
+    return rnd.randint(-30, 365)
+
+
+async def _build_tree(db, rnd: random.Random, depth: int, fanout: int) -> list[tuple[int, int]]:
+    """Возвращает [(group_id, глубина)] для всех групп, включая базовые."""
+    async with db.execute("SELECT id FROM grp WHERE parent_id IS NULL") as cur:
+        roots = [r[0] for r in await cur.fetchall()]
+    groups = [(gid, 0) for gid in roots]
+    level = roots
+    for d in range(1, depth + 1):
+        nxt = []
+        for parent in level:
+            for i in range(fanout):
+                cur = await db.execute(
+                    "INSERT INTO grp(name, parent_id) VALUES (?, ?)", (f"Отдел {parent}.{d}.{i}", parent)
+                )
+                nxt.append(cur.lastrowid)
+        groups += [(gid, d) for gid in nxt]
+        level = nxt
+    return groups
+
+
+async def generate(entities: int, *, depth: int = 4, fanout: int = 3, history: float = 0.5,
+                   subscribers: int = 20, seed: int = 1) -> dict:
+    """Заполняет текущую базу bot.DB_PATH (после init_db) и возвращает сводку."""
+    rnd = random.Random(seed)
+    today = date.today()
+    async with bot.db_write() as db:
+        groups = await _build_tree(db, rnd, depth, fanout)
+        group_ids = [gid for gid, _ in groups]
+
+        rows = [(f"ООО «Учреждение {gid}»", "org", gid) for gid in group_ids]
+        n_persons = max(0, entities - len(rows))
+        rows += [
+            (f"{rnd.choice(SURNAMES)}{rnd.choice(['', 'а'])} {rnd.choice(INITIALS)}."
+             f"{rnd.choice(INITIALS)}. №{i}", "person", rnd.choice(group_ids))
+            for i in range(n_persons)
+        ]
+        await db.executemany("INSERT INTO entity(name, kind, group_id) VALUES (?,?,?)", rows)
+        async with db.execute("SELECT id FROM entity ORDER BY id") as cur:
+            entity_ids = [r[0] for r in await cur.fetchall()]
+
+        active, inactive = [], []
+        for eid in entity_ids:
+            if rnd.random() < 0.1:
+                continue  # в реестре, подпись ещё не заведена
+            expiry = today + timedelta(days=_expiry_offset(rnd))
+            active.append((eid, expiry.isoformat(), rnd.choice([None, None, "токен", "облако"]), 1))
+            if rnd.random() < history:
+                for k in range(1, rnd.randint(1, 3) + 1):
+                    inactive.append((eid, (expiry - timedelta(days=365 * k)).isoformat(), None, 0))
+        await db.executemany(
+            "INSERT INTO signature(entity_id, expiry, note, active) VALUES (?,?,?,?)", active + inactive
+        )
+        await db.executemany(
+            "INSERT INTO subscriber(chat_id) VALUES (?)", [(1000 + i,) for i in range(subscribers)]
+        )
+
+    deepest = max(groups, key=lambda g: g[1])[0]
+    return {
+        "groups": len(groups),
+        "entities": len(entity_ids),
+        "signatures": len(active),
+        "history": len(inactive),
+        "subscribers": subscribers,
+        "root_group": groups[0][0],
+        "deep_group": deepest,
+    }
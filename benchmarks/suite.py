@@ -0,0 +1,195 @@
+"""Набор замеров горячих путей бота на синтетическом реестре.
+
+Результат пишется в JSON (метаданные прогона + статистика по каждому
+замеру), чтобы сравнивать прогоны между коммитами:
+
+    python -m benchmarks.suite --entities 10000 --out before.json
+    python -m benchmarks.suite --entities 10000 --out after.json --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import bot
+from benchmarks.datagen import generate
+
+
+class DummyBot:
+    """Как в tests/test_reminders.py: ничего не отправляет, только считает."""
+
+    def __init__(self) -> None:
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, parse_mode=None, reply_markup=None):
+        self.sent += 1
+
+
+class DummyApplication:
+    def __init__(self) -> None:
+        self.bot = DummyBot()
+
+
+async def _timeit(fn, repeat: int, setup=None) -> list[float]:
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            await setup()
+        t0 = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+def _stats(samples: list[float]) -> dict:
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "mean_ms": round(statistics.mean(ordered), 3),
+        "p50_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(ordered[max(0, int(len(ordered) * 0.95) - 1)], 3),
+        "min_ms": round(ordered[0], 3),
+    }
+
+
+def _import_samples(repeat: int) -> list[float]:
+    """Время `import bot` в свежем интерпретаторе, мс."""
+    code = "import time; t0 = time.perf_counter(); import bot; print((time.perf_counter() - t0) * 1000)"
+    root = Path(__file__).resolve().parents[1]
+    return [
+        float(subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True,
+                             text=True, check=True).stdout)
+        for _ in range(repeat)
+    ]
+
+
+async def _startup():
+    """Путь _amain до приёма апдейтов: схема, пул, кэш иерархии."""
+    await bot.init_db()
+    await bot.open_pool()
+    try:
+        await bot.ORG_CACHE.load()
+    finally:
+        bot.ORG_CACHE.clear()
+        await bot.close_pool()
+
+
+async def _invalidate_screens():
+    bot.registry_changed()
+
+
+async def _reset_reminder_ledger():
+    async with bot.db_write() as db:
+        await db.execute("DELETE FROM reminder_log")
+        await db.execute("UPDATE subscriber SET reminded_until=NULL")
+
+
+async def run_suite(tmp: Path, entities: int, repeat: int, seed: int) -> tuple[dict, dict]:
+    bot.DB_PATH = str(tmp / "bench.sqlite")
+    results: dict[str, dict] = {}
+
+    # init_db: пустая база (все миграции) и повторный старт на заполненной
+    results["init_db.fresh"] = _stats(await _timeit(bot.init_db, 1))
+    dataset = await generate(entities, seed=seed)
+    results["init_db.existing"] = _stats(await _timeit(bot.init_db, max(3, repeat // 4)))
+    # старт процесса: импорт модуля и подготовка к работе на заполненной базе
+    results["startup.import"] = _stats(_import_samples(max(3, repeat // 4)))
+    results["startup.ready"] = _stats(await _timeit(_startup, max(3, repeat // 4)))
+
+    # дальше — как в проде: пул соединений и кэш иерархии
+    await bot.open_pool()
+    try:
+        await bot.ORG_CACHE.load()
+        root, deep = dataset["root_group"], dataset["deep_group"]
+
+        # экраны идут через RENDER_CACHE: .cold — сразу после записи в реестр
+        # (registry_changed перед каждым замером), .warm — повторный показ
+        cases = {
+            "build_all_text": lambda: bot.build_all_text(),
+            "build_lastN_text.10": lambda: bot.build_lastN_text(10),
+            "build_lastN_text.30": lambda: bot.build_lastN_text(30),
+            "tree_browse.root": lambda: bot.build_tree_view("browse", None),
+            "tree_browse.groups": lambda: bot.build_tree_view("browse", root),
+            "tree_browse.employees": lambda: bot.build_tree_view("browse", deep, "employees"),
+            "tree_picker.sign_update": lambda: bot.build_tree_view("sign_update", deep),
+            "tree_picker.reg_add_person": lambda: bot.build_tree_view("reg_add_person", root),
+        }
+        for name, fn in cases.items():
+            results[f"{name}.cold"] = _stats(await _timeit(fn, repeat, setup=_invalidate_screens))
+            await fn()
+            results[f"{name}.warm"] = _stats(await _timeit(fn, repeat))
+
+        app = DummyApplication()
+        results["send_reminders.daily"] = _stats(await _timeit(
+            lambda: bot.send_reminders(app), max(3, repeat // 4), setup=_reset_reminder_ledger
+        ))
+        # повторный запуск в тот же день: всё уже в журнале
+        results["send_reminders.repeat"] = _stats(await _timeit(
+            lambda: bot.send_reminders(app), repeat
+        ))
+        dataset["reminder_messages"] = app.bot.sent
+    finally:
+        bot.ORG_CACHE.clear()
+        await bot.close_pool()
+    return results, dataset
+
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                             text=True, check=True, cwd=Path(__file__).resolve().parents[1])
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print(results: dict, baseline: dict | None):
+    for name, st in results.items():
+        line = f"{name:<32} mean={st['mean_ms']:9.2f} ms  p95={st['p95_ms']:9.2f} ms"
+        old = (baseline or {}).get(name)
+        if old and old["mean_ms"]:
+            line += f"  x{st['mean_ms'] / old['mean_ms']:.2f} vs baseline"
+        print(line)
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        results, dataset = await run_suite(Path(tmp), args.entities, args.repeat, args.seed)
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "entities": args.entities,
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "dataset": dataset,
+        },
+        "results": results,
+    }
+    baseline = None
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text("utf-8"))["results"]
+    _print(results, baseline)
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, ensure_ascii=False, indent=2), "utf-8")
+        print(f"-> {args.out}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--entities", type=int, default=10_000)
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", help="куда записать JSON с результатами")
+    ap.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    asyncio.run(main(ap.parse_args()))
@@ -1,22 +1,48 @@
 import asyncio
+import bisect
+import functools
+import hashlib
+import heapq
+import io
+import json
 import os
+import re
+import secrets
+import socket
+import sqlite3
 import time
-from datetime import date, datetime, timedelta
-from dateutil import parser as dateparser
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager, suppress
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+from http import HTTPStatus
+from typing import TYPE_CHECKING, Awaitable, Callable, NamedTuple
+from urllib.parse import urlsplit
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 import aiosqlite
+from aiosqlite.context import contextmanager as aiosqlite_result
 from dotenv import load_dotenv
 
 from telegram import (
     Update, InlineKeyboardMarkup, InlineKeyboardButton,
-    ReplyKeyboardMarkup, KeyboardButton
+    ReplyKeyboardMarkup, KeyboardButton,
+    InlineQueryResultArticle, InputTextMessageContent
 )
 from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden, InvalidToken, RetryAfter
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, CallbackQueryHandler,
-    ContextTypes, filters
+    InlineQueryHandler, ContextTypes, filters, BasePersistence, PersistenceInput
 )
 
+# csv, gzip, zipfile, tempfile и hmac нужны только импорту, выгрузке и
+# вебхуку — они грузятся по требованию внутри этих путей. socket, secrets
+# и urlsplit читаются уже при загрузке модуля (INSTANCE_ID, WEBHOOK_PATH),
+# heapq нужен планировщику напоминаний — они остаются наверху
+if TYPE_CHECKING:
+    import zipfile
+
 import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("edsbot")
@@ -25,8 +51,85 @@ logger = logging.getLogger("edsbot")
 load_dotenv()
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 ADMIN_IDS = {int(x.strip()) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip().isdigit()}
+# Часовой пояс и время напоминаний по умолчанию; чат может задать свои (/settings)
 TZ = os.getenv("TZ", "Europe/Riga")
 REMIND_AT = os.getenv("REMIND_AT", "09:00")
+# За сколько дней до окончания напоминать (0 = в день окончания), по умолчанию
+REMIND_OFFSETS = tuple(sorted(
+    {int(x) for x in os.getenv("REMIND_OFFSETS", "25,20,15,10,5,0").split(",") if x.strip().isdigit()},
+    reverse=True
+)) or (0,)
+# На сколько дней вперёд планировщик держит события напоминаний в памяти
+REMIND_HORIZON_DAYS = max(1, int(os.getenv("REMIND_HORIZON_DAYS", "7")))
+# "item" — по сообщению на подпись, "digest" — одна сводка на подписчика
+REMIND_MODE = os.getenv("REMIND_MODE", "item")
+
+# Очередь исходящих: общий лимит, лимит на чат, параллельность, попытки
+OUTBOX_RATE = float(os.getenv("OUTBOX_RATE", "30"))
+OUTBOX_PER_CHAT_RATE = float(os.getenv("OUTBOX_PER_CHAT_RATE", "1"))
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "8"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+# Сколько секунд взятое в отправку сообщение принадлежит процессу; после —
+# считается брошенным (процесс упал) и возвращается в очередь при старте
+OUTBOX_CLAIM_TTL = float(os.getenv("OUTBOX_CLAIM_TTL", "300"))
+
+# Несколько процессов на одной базе: напоминания шлёт только держатель аренды.
+# Если он умер, другой процесс забирает аренду через LEADER_LEASE_TTL секунд
+LEADER_LEASE_TTL = float(os.getenv("LEADER_LEASE_TTL", "15"))
+INSTANCE_ID = os.getenv("INSTANCE_ID", "") or f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}"
+
+# Насколько далеко назад досылать напоминания после простоя
+REMIND_CATCHUP_DAYS = int(os.getenv("REMIND_CATCHUP_DAYS", "7"))
+
+# Сколько дней снятые подписи лежат в основной таблице, прежде чем уйти
+# в signature_archive, и как часто (в часах) архивировать и обслуживать базу
+SIGNATURE_RETENTION_DAYS = int(os.getenv("SIGNATURE_RETENTION_DAYS", "90"))
+MAINTENANCE_INTERVAL_HOURS = float(os.getenv("MAINTENANCE_INTERVAL_HOURS", "24"))
+# Сколько последних изменений показывать в /history
+HISTORY_LIMIT = int(os.getenv("HISTORY_LIMIT", "20"))
+
+# Строк на странице «Список всех»
+ALL_PAGE_SIZE = int(os.getenv("ALL_PAGE_SIZE", "25"))
+
+# Сколько результатов поиска показывать кнопками
+SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", "10"))
+
+# Инлайн-режим: сколько секунд ответ живёт в кэше бота и в кэше Telegram
+INLINE_CACHE_TTL = float(os.getenv("INLINE_CACHE_TTL", "60"))
+INLINE_CACHE_SIZE = int(os.getenv("INLINE_CACHE_SIZE", "512"))
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "10"))
+
+# Импорт реестра из файла: предел строк и сколько ошибок показывать в ответе
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "50000"))
+IMPORT_REPORT_ERRORS = int(os.getenv("IMPORT_REPORT_ERRORS", "50"))
+
+# Приём обновлений: "polling" (по умолчанию) или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Публичный HTTPS-адрес вебхука и где слушать локально (обычно за reverse proxy)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Путь на локальном сервере; по умолчанию — путь из WEBHOOK_URL
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "") or urlsplit(WEBHOOK_URL).path or "/"
+# Пусто — секрет генерируется при каждом запуске и передаётся в set_webhook
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_BODY = int(os.getenv("WEBHOOK_MAX_BODY", str(1024 * 1024)))
+# Сколько обновлений обрабатывать одновременно в режиме вебхука
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+
+# Состояние диалогов (user_data) пишется в БД пачкой раз в столько секунд
+PERSIST_INTERVAL = float(os.getenv("PERSIST_INTERVAL", "10"))
+# Выбрасывать ли накопившиеся за время простоя обновления при старте
+DROP_PENDING_UPDATES = os.getenv("DROP_PENDING_UPDATES", "0").lower() in {"1", "true", "yes"}
+
+# Эндпоинт /metrics в формате Prometheus; 0 — не поднимать
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Соединения к Bot API: outbox и обработчики обновлений шлют параллельно,
+# а голый HTTPXRequest держит одно соединение и ждёт его секунду
+BOT_API_POOL_SIZE = int(os.getenv("BOT_API_POOL_SIZE", "256"))
+BOT_API_POOL_TIMEOUT = float(os.getenv("BOT_API_POOL_TIMEOUT", "5"))
 
 os.environ["TZ"] = TZ
 try:
@@ -36,6 +139,20 @@ except Exception:
 
 DB_PATH = "data.db"
 
+# Пул соединений: несколько читателей и один писатель
+DB_READERS = max(1, int(os.getenv("DB_READERS", "4")))
+DB_CACHE_KB = int(os.getenv("DB_CACHE_KB", "8192"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024)))
+
+# Сколько списков сотрудников по группам держать в памяти (LRU)
+ORG_CACHE_PERSONS = int(os.getenv("ORG_CACHE_PERSONS", "256"))
+
+# Сколько отрисованных экранов (списки, дерево) держать в памяти
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "256"))
+# Как часто (сек) сверять его с meta.registry_generation: счётчики групп
+# меняют и другие процессы
+RENDER_SYNC_INTERVAL = float(os.getenv("RENDER_SYNC_INTERVAL", "5"))
+
 # --- Reply-кнопки и подменю ---
 BTN_BACK = "⬅️ Назад"
 
@@ -109,7 +226,24 @@ CB_DEL_CONFIRM = "del:confirm"
 # Удаление из реестра (второй пункт третьего блока)
 CB_REGDEL_CONFIRM = "regdel:confirm"
 
+# Настройки напоминаний чата: set:<offsets|time|tz|reset>
+CB_SETTINGS_PREFIX = "set:"
+
+# Прогноз окончаний: stats:<week|month>:<id раздела или пусто>
+CB_STATS_PREFIX = "stats:"
+
+# Дерево организаций: компактные токены (см. _tree_cb); «tree|…» — старый формат
+TREE_TOKEN_PREFIX = "t:"
 TREE_CB_PREFIX = "tree|"
+TREE_MODES = {"browse": "b", "find": "f", "sign_add_org": "o", "sign_add_person": "p",
+              "sign_update": "u", "sign_delete": "d", "reg_delete": "r", "reg_add_person": "a"}
+TREE_ACTIONS = {"enter": "e", "up": "u", "exit": "x", "show": "s", "add": "a",
+                "select": "l", "search": "q", "tree": "t"}
+_TREE_MODE_BY_CODE = {code: mode for mode, code in TREE_MODES.items()}
+_TREE_ACTION_BY_CODE = {code: action for action, code in TREE_ACTIONS.items()}
+PAGE_CB_PREFIX = "page|"
+
+TG_MESSAGE_LIMIT = 4096
 
 
 # безопасный «невидимый» символ, который Телеграм принимает как непустой текст
@@ -214,7 +348,325 @@ def fmt_signature_row(r) -> str:
         line += f"\n  Примечание: {safe_md(note)}"
     return line
 
+# ====== METRICS ======
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+
+# имя -> (тип, описание, границы корзин для гистограмм)
+METRIC_DEFS: dict[str, tuple[str, str, tuple[float, ...] | None]] = {
+    "edsbot_handler_seconds": ("histogram", "Время обработки апдейта хендлером", _LATENCY_BUCKETS),
+    "edsbot_handler_errors_total": ("counter", "Исключения в хендлерах", None),
+    "edsbot_tree_action_seconds": ("histogram", "Время действия в дереве организаций", _LATENCY_BUCKETS),
+    "edsbot_sql_seconds": ("histogram", "Время execute() по тексту SQL (без чтения строк)", _SQL_BUCKETS),
+    "edsbot_sql_errors_total": ("counter", "Ошибки SQL по тексту запроса", None),
+    "edsbot_bot_api_seconds": ("histogram", "Время запроса к Bot API по методу", _LATENCY_BUCKETS),
+    "edsbot_bot_api_errors_total": ("counter", "Ошибки Bot API по методу и коду", None),
+    "edsbot_reminder_runs_total": ("counter", "Запуски рассылки напоминаний", None),
+    "edsbot_reminder_messages_total": ("counter", "Сообщения-напоминания по способу доставки", None),
+    "edsbot_reminder_items_total": ("counter", "Напоминания о подписях (подпись x смещение x чат)", None),
+    "edsbot_reminder_dispatch_seconds": ("histogram", "Время раздачи одной рассылки", _LATENCY_BUCKETS),
+    "edsbot_outbox_messages_total": ("counter", "Исходы отправки из outbox", None),
+    "edsbot_render_cache_total": ("counter", "Обращения к кэшу экранов: hit|miss", None),
+    "edsbot_signatures_archived_total": ("counter", "Снятые подписи, перенесённые в архив", None),
+}
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metrics:
+    """Счётчики и гистограммы в памяти процесса.
+
+    Запись — словарь и bisect без блокировок: всё происходит в потоке
+    event loop, поэтому инструментацию можно не выключать в проде.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._hist: dict[str, dict[tuple, Histogram]] = {}
+        self._counters: dict[str, dict[tuple, float]] = {}
+
+    def observe(self, name: str, value: float, **labels):
+        series = self._hist.setdefault(name, {})
+        key = tuple(labels.items())
+        hist = series.get(key)
+        if hist is None:
+            hist = series[key] = Histogram(METRIC_DEFS[name][2])
+        hist.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        series = self._counters.setdefault(name, {})
+        key = tuple(labels.items())
+        series[key] = series.get(key, 0) + value
+
+    def histogram(self, name: str, **labels) -> Histogram | None:
+        return self._hist.get(name, {}).get(tuple(labels.items()))
+
+    def counter(self, name: str, **labels) -> float:
+        return self._counters.get(name, {}).get(tuple(labels.items()), 0)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus (exposition format 0.0.4)."""
+        out: list[str] = []
+
+        def fmt(labels: tuple, extra: str = "") -> str:
+            parts = [f'{k}="{_label_value(v)}"' for k, v in labels]
+            if extra:
+                parts.append(extra)
+            return "{" + ",".join(parts) + "}" if parts else ""
+
+        inf_le = 'le="+Inf"'
+        for name, (kind, help_text, _) in METRIC_DEFS.items():
+            series = self._hist.get(name) if kind == "histogram" else self._counters.get(name)
+            if not series:
+                continue
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            for labels, value in series.items():
+                if kind == "counter":
+                    out.append(f"{name}{fmt(labels)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(value.bounds, value.counts):
+                    cumulative += count
+                    le = 'le="%s"' % bound
+                    out.append(f"{name}_bucket{fmt(labels, le)} {cumulative}")
+                out.append(f"{name}_bucket{fmt(labels, inf_le)} {value.count}")
+                out.append(f"{name}_sum{fmt(labels)} {value.sum}")
+                out.append(f"{name}_count{fmt(labels)} {value.count}")
+        return "\n".join(out) + "\n"
+
+
+METRICS = Metrics()
+
+
+def metered_handler(fn):
+    """Оборачивает хендлер PTB: гистограмма времени и счётчик исключений."""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(update, context):
+        t0 = time.perf_counter()
+        try:
+            return await fn(update, context)
+        except Exception:
+            METRICS.inc("edsbot_handler_errors_total", handler=name)
+            raise
+        finally:
+            METRICS.observe("edsbot_handler_seconds", time.perf_counter() - t0, handler=name)
+
+    return wrapper
+
+
+@functools.lru_cache(maxsize=1024)
+def _sql_label(sql: str) -> str:
+    # списки плейсхолдеров разной длины (IN (?,?,…)) — один и тот же запрос
+    text = re.sub(r"\s+", " ", sql).strip()
+    return re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(?…)", text)[:200]
+
+
+class MeteredConnection(aiosqlite.Connection):
+    """aiosqlite.Connection, которое учитывает время execute по тексту запроса."""
+
+    @aiosqlite_result
+    async def execute(self, sql: str, parameters=None) -> aiosqlite.Cursor:
+        return await self._metered(super().execute(sql, parameters), sql)
+
+    @aiosqlite_result
+    async def executemany(self, sql: str, parameters) -> aiosqlite.Cursor:
+        return await self._metered(super().executemany(sql, parameters), sql)
+
+    async def _metered(self, pending, sql: str) -> aiosqlite.Cursor:
+        label = _sql_label(sql)
+        t0 = time.perf_counter()
+        try:
+            return await pending
+        except sqlite3.Error:
+            METRICS.inc("edsbot_sql_errors_total", statement=label)
+            raise
+        finally:
+            METRICS.observe("edsbot_sql_seconds", time.perf_counter() - t0, statement=label)
+
+
+class MeteredRequest(HTTPXRequest):
+    """HTTPXRequest с замером времени и ошибок каждого вызова Bot API."""
+
+    async def do_request(self, url: str, method: str, request_data=None, **kwargs):
+        # в URL есть токен — в метку идёт только имя метода
+        api_method = "getFile.download" if "/file/bot" in url else url.rsplit("/", 1)[-1]
+        t0 = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, request_data, **kwargs)
+        except Exception as e:
+            METRICS.inc("edsbot_bot_api_errors_total", method=api_method, code=type(e).__name__)
+            raise
+        finally:
+            METRICS.observe("edsbot_bot_api_seconds", time.perf_counter() - t0, method=api_method)
+        if code >= 400:
+            METRICS.inc("edsbot_bot_api_errors_total", method=api_method, code=str(code))
+        return code, payload
+
+
+# ====== DB ======
+
+def _db_pragmas() -> tuple[str, ...]:
+    return (
+        "PRAGMA foreign_keys = ON;",
+        "PRAGMA journal_mode = WAL;",
+        "PRAGMA synchronous = NORMAL;",
+        f"PRAGMA cache_size = -{DB_CACHE_KB};",
+        f"PRAGMA mmap_size = {DB_MMAP_SIZE};",
+    )
+
+async def _open_conn(path: str) -> aiosqlite.Connection:
+    """Открывает соединение и один раз применяет к нему PRAGMA."""
+    fresh = not os.path.exists(path) or os.path.getsize(path) == 0
+    db = await MeteredConnection(lambda: sqlite3.connect(path), 64)
+    db.row_factory = aiosqlite.Row
+    if fresh:
+        # режим задаётся до первой записи (и до WAL); старую базу переводит миграция 16
+        await db.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+    for pragma in _db_pragmas():
+        await db.execute(pragma)
+    return db
+
+async def _finish_write(db: aiosqlite.Connection, failed: bool):
+    if failed:
+        await db.rollback()
+    elif db.in_transaction:
+        await db.commit()
+
+
+class DbPool:
+    """Долгоживущие соединения: N читателей и один писатель.
+
+    Каждое соединение — это отдельный поток aiosqlite, поэтому держим их
+    открытыми всё время работы бота, а не создаём на каждый запрос.
+    """
+
+    def __init__(self, path: str, readers: int = DB_READERS):
+        self.path = path
+        self.size = max(1, readers)
+        self._readers: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self._all_readers: list[aiosqlite.Connection] = []
+        self._writer: aiosqlite.Connection | None = None
+        self._write_lock = asyncio.Lock()
+
+    async def open(self):
+        # писатель первым включает WAL, читатели подхватывают режим из файла
+        self._writer = await _open_conn(self.path)
+        for _ in range(self.size):
+            conn = await _open_conn(self.path)
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+
+    async def close(self):
+        async with self._write_lock:
+            for conn in self._all_readers:
+                await conn.close()
+            self._all_readers.clear()
+            if self._writer is not None:
+                await self._writer.close()
+                self._writer = None
+
+    @asynccontextmanager
+    async def read(self):
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self):
+        """Единственный писатель; коммит при выходе, откат при исключении."""
+        async with self._write_lock:
+            if self._writer is None:
+                raise RuntimeError("Пул соединений закрыт")
+            failed = False
+            try:
+                yield self._writer
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                await _finish_write(self._writer, failed)
+
+
+_pool: DbPool | None = None
+
+async def open_pool(readers: int = DB_READERS) -> DbPool:
+    global _pool
+    if _pool is None:
+        pool = DbPool(DB_PATH, readers)
+        await pool.open()
+        _pool = pool
+    return _pool
+
+async def close_pool():
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        await pool.close()
+
+@asynccontextmanager
+async def _transient_conn(write: bool):
+    # без пула (тесты, разовые скрипты) — одно соединение на вызов
+    db = await _open_conn(DB_PATH)
+    failed = False
+    try:
+        yield db
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        try:
+            if write:
+                await _finish_write(db, failed)
+        finally:
+            await db.close()
+
+def db_read():
+    """Соединение для чтения: из пула, если он открыт."""
+    if _pool is not None:
+        return _pool.read()
+    return _transient_conn(write=False)
+
+def db_write():
+    """Соединение писателя: из пула, если он открыт."""
+    if _pool is not None:
+        return _pool.write()
+    return _transient_conn(write=True)
+
 async def ensure_group(db, name: str, parent_id: int | None) -> int:
+    """Группа name под parent_id; транзакцией и кэшами управляет вызывающий."""
     async with db.execute("SELECT id, parent_id FROM grp WHERE name=?", (name,)) as cur:
         row = await cur.fetchone()
     if row:
@@ -260,23 +712,165 @@ async def ensure_org_structure(db, structure: dict[str, dict], parent_id: int |
         if children:
             await ensure_org_structure(db, children, gid)
 
-async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        await db.execute("PRAGMA foreign_keys = ON;")
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS subscriber (
+def _org_structure_hash(structure: dict[str, dict]) -> str:
+    return hashlib.sha256(json.dumps(structure, ensure_ascii=False, sort_keys=True).encode()).hexdigest()
+
+async def sync_org_structure(db, structure: dict[str, dict]) -> bool:
+    """ensure_org_structure, только если structure изменилась с прошлой сверки."""
+    digest = _org_structure_hash(structure)
+    async with db.execute("SELECT value FROM meta WHERE key='org_structure_hash'") as cur:
+        row = await cur.fetchone()
+    if row and row[0] == digest:
+        return False
+    await ensure_org_structure(db, structure)
+    await db.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('org_structure_hash', ?)", (digest,))
+    return True
+
+# ---- GROUP STATS ----
+# Счётчики по поддеревьям grp: просрочено, истекает в ближайшие
+# GRP_STATS_EXPIRING_DAYS дней, без подписи. entity_status — статус каждой
+# сущности на день meta.grp_stats_day, grp_stats — суммы статусов по всем
+# потомкам группы (через grp_closure). Триггеры пересчитывают статус
+# затронутой сущности и переносят её вклад у всех предков; смену дня
+# делает refresh_grp_stats.
+
+GRP_STATS_EXPIRING_DAYS = 30
+_GRP_STATS_DAY_SQL = "(SELECT value FROM meta WHERE key='grp_stats_day')"
+
+def _entity_status_select(where: str) -> str:
+    return f"""
+    SELECT id, group_id, CASE
+        WHEN expiry IS NULL THEN 'none'
+        WHEN expiry < {_GRP_STATS_DAY_SQL} THEN 'expired'
+        WHEN expiry < date({_GRP_STATS_DAY_SQL}, '+{GRP_STATS_EXPIRING_DAYS} days') THEN 'expiring'
+        ELSE 'ok' END
+    FROM (
+        SELECT e.id, e.group_id,
+               (SELECT min(s.expiry) FROM signature s WHERE s.entity_id=e.id AND s.active=1) AS expiry
+        FROM entity e WHERE {where}
+    )"""
+
+def _grp_stats_shift(sign: str, where: str) -> str:
+    """Добавляет (+) или снимает (-) вклад сущностей where у всех их групп-предков."""
+    return f"""
+    UPDATE grp_stats SET
+        expired=grp_stats.expired {sign} x.expired, expiring=grp_stats.expiring {sign} x.expiring,
+        unsigned=grp_stats.unsigned {sign} x.unsigned
+    FROM (
+        SELECT c.ancestor_id, sum(es.status='expired') AS expired,
+               sum(es.status='expiring') AS expiring, sum(es.status='none') AS unsigned
+        FROM entity_status es JOIN grp_closure c ON c.descendant_id=es.group_id
+        WHERE {where}
+        GROUP BY c.ancestor_id
+    ) x
+    WHERE grp_stats.group_id=x.ancestor_id"""
+
+def _entity_status_refresh(eid: str) -> str:
+    """Тело триггера: пересчитать статус сущности eid и её вклад в grp_stats."""
+    return f"""
+    {_grp_stats_shift('-', f'es.entity_id={eid}')};
+    DELETE FROM entity_status WHERE entity_id={eid};
+    INSERT INTO entity_status(entity_id, group_id, status) {_entity_status_select(f'e.id={eid}')};
+    {_grp_stats_shift('+', f'es.entity_id={eid}')};"""
+
+_GRP_STATS_FILL = """
+    INSERT INTO grp_stats(group_id, expired, expiring, unsigned)
+    SELECT g.id, coalesce(sum(es.status='expired'), 0), coalesce(sum(es.status='expiring'), 0),
+           coalesce(sum(es.status='none'), 0)
+    FROM grp g
+    LEFT JOIN grp_closure c ON c.ancestor_id=g.id
+    LEFT JOIN entity_status es ON es.group_id=c.descendant_id
+    GROUP BY g.id"""
+_GRP_STATS_REBUILD = f"DELETE FROM grp_stats; {_GRP_STATS_FILL};"
+
+# Массовая запись (импорт) ставит этот ключ в meta на время своей транзакции:
+# построчные триггеры молчат, а счётчики потом пересчитываются разом
+_GRP_STATS_LIVE = "NOT EXISTS (SELECT 1 FROM meta WHERE key='grp_stats_bulk')"
+
+def _entity_status_triggers() -> list[tuple[str, str]]:
+    """(имя, CREATE TRIGGER) построчного пересчёта entity_status и grp_stats."""
+    return [
+        ("entity_status_ai", f"""CREATE TRIGGER entity_status_ai AFTER INSERT ON entity
+           WHEN {_GRP_STATS_LIVE} BEGIN
+            {_entity_status_refresh('new.id')}
+        END"""),
+        ("entity_status_au", f"""CREATE TRIGGER entity_status_au AFTER UPDATE OF group_id ON entity
+           WHEN {_GRP_STATS_LIVE} BEGIN
+            {_entity_status_refresh('new.id')}
+        END"""),
+        ("entity_status_ad", f"""CREATE TRIGGER entity_status_ad AFTER DELETE ON entity
+           WHEN {_GRP_STATS_LIVE} BEGIN
+            {_entity_status_refresh('old.id')}
+        END"""),
+        ("signature_status_ai", f"""CREATE TRIGGER signature_status_ai AFTER INSERT ON signature
+           WHEN {_GRP_STATS_LIVE} BEGIN
+            {_entity_status_refresh('new.entity_id')}
+        END"""),
+        ("signature_status_au", f"""CREATE TRIGGER signature_status_au
+           AFTER UPDATE OF expiry, active, entity_id ON signature WHEN {_GRP_STATS_LIVE} BEGIN
+            {_entity_status_refresh('old.entity_id')}
+            {_entity_status_refresh('new.entity_id')}
+        END"""),
+        ("signature_status_ad", f"""CREATE TRIGGER signature_status_ad AFTER DELETE ON signature
+           WHEN {_GRP_STATS_LIVE} BEGIN
+            {_entity_status_refresh('old.entity_id')}
+        END"""),
+    ]
+
+# Счётчик записей, меняющих события напоминаний: подписи и слоты доставки.
+# Лидер сверяет его на каждом продлении аренды и так узнаёт о записях
+# других процессов (ReminderScheduler.sync)
+_REMINDERS_BUMP = "UPDATE meta SET value = value + 1 WHERE key='reminders_generation';"
+
+def _reminders_generation_triggers() -> list[tuple[str, str]]:
+    """(имя, CREATE TRIGGER) увеличения reminders_generation."""
+    triggers = [
+        ("signature_reminders_ai", f"""CREATE TRIGGER signature_reminders_ai AFTER INSERT ON signature
+           WHEN new.active=1 AND {_GRP_STATS_LIVE} BEGIN {_REMINDERS_BUMP} END"""),
+        ("signature_reminders_au", f"""CREATE TRIGGER signature_reminders_au AFTER UPDATE OF expiry, active ON signature
+           WHEN (new.expiry IS NOT old.expiry OR new.active IS NOT old.active) AND {_GRP_STATS_LIVE}
+           BEGIN {_REMINDERS_BUMP} END"""),
+        ("signature_reminders_ad", f"""CREATE TRIGGER signature_reminders_ad AFTER DELETE ON signature
+           WHEN old.active=1 AND {_GRP_STATS_LIVE} BEGIN {_REMINDERS_BUMP} END"""),
+    ]
+    for table in ("subscriber_settings", "subscriber_offset"):
+        for suffix, event in (("ai", "INSERT"), ("au", "UPDATE"), ("ad", "DELETE")):
+            name = f"{table}_reminders_{suffix}"
+            triggers.append((name, f"CREATE TRIGGER {name} AFTER {event} ON {table} BEGIN {_REMINDERS_BUMP} END"))
+    return triggers
+
+# Счётчик изменений grp_stats: по нему каждый процесс сбрасывает свои
+# кэши экранов (sync_render_cache), даже если записывал другой процесс
+_REGISTRY_BUMP = "UPDATE meta SET value = value + 1 WHERE key='registry_generation';"
+
+_GRP_STATS_GENERATION_TRIGGER = f"""CREATE TRIGGER grp_stats_generation_au AFTER UPDATE ON grp_stats
+   WHEN new.expired IS NOT old.expired OR new.expiring IS NOT old.expiring
+        OR new.unsigned IS NOT old.unsigned
+   BEGIN {_REGISTRY_BUMP} END"""
+
+async def rebuild_grp_stats(db):
+    """Полный пересчёт entity_status и grp_stats; транзакцией управляет вызывающий."""
+    await db.execute("DELETE FROM entity_status")
+    await db.execute(f"INSERT INTO entity_status(entity_id, group_id, status) {_entity_status_select('true')}")
+    await db.execute("DELETE FROM grp_stats")
+    await db.execute(_GRP_STATS_FILL)
+    await db.execute(_REGISTRY_BUMP)
+
+# Версионированные миграции схемы. Номер последней применённой хранится
+# в PRAGMA user_version; новые миграции только дописываются в конец.
+MIGRATIONS: list[tuple[int, tuple[str, ...]]] = [
+    (1, (
+        # Базовые таблицы; IF NOT EXISTS — для баз, созданных до миграций
+        """CREATE TABLE IF NOT EXISTS subscriber (
             chat_id INTEGER PRIMARY KEY
-        );""")
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS entity (
+        )""",
+        """CREATE TABLE IF NOT EXISTS entity (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL UNIQUE,
             kind TEXT NOT NULL CHECK(kind IN ('org','person')),
             group_id INTEGER NULL
-        );""")
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS signature (
+        )""",
+        """CREATE TABLE IF NOT EXISTS signature (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             entity_id INTEGER NOT NULL,
             expiry TEXT NOT NULL,      -- YYYY-MM-DD
@@ -285,16 +879,341 @@ async def init_db():
             created_at TEXT NOT NULL DEFAULT (datetime('now')),
             updated_at TEXT NOT NULL DEFAULT (datetime('now')),
             FOREIGN KEY(entity_id) REFERENCES entity(id) ON DELETE CASCADE
-        );""")
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS grp (
+        )""",
+        """CREATE TABLE IF NOT EXISTS grp (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL UNIQUE,
             parent_id INTEGER NULL,
             FOREIGN KEY(parent_id) REFERENCES grp(id) ON DELETE SET NULL
-        );""")
-        await ensure_org_structure(db, ORG_STRUCTURE)
+        )""",
+        # Частичный покрывающий индекс под выборки активных подписей по сроку
+        """CREATE INDEX IF NOT EXISTS idx_signature_active_expiry
+           ON signature(expiry, entity_id, note) WHERE active=1""",
+        # LEFT JOIN signature s ON s.entity_id=e.id AND s.active=1
+        """CREATE INDEX IF NOT EXISTS idx_signature_entity_active
+           ON signature(entity_id) WHERE active=1""",
+        "CREATE INDEX IF NOT EXISTS idx_entity_group_kind ON entity(group_id, kind)",
+        "CREATE INDEX IF NOT EXISTS idx_grp_parent ON grp(parent_id, name)",
+    )),
+    (2, (
+        # Очередь исходящих сообщений; отправленные строки удаляются
+        """CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            parse_mode TEXT,
+            reply_markup TEXT,            -- JSON разметки клавиатуры
+            status TEXT NOT NULL DEFAULT 'pending',  -- pending|sending|failed
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_at REAL NOT NULL,        -- unix time следующей попытки
+            last_error TEXT,
+            created_at TEXT NOT NULL DEFAULT (datetime('now'))
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(next_at) WHERE status='pending'",
+    )),
+    (3, (
+        # Журнал доставленных напоминаний: (подпись, за сколько дней, чат)
+        """CREATE TABLE IF NOT EXISTS reminder_log (
+            signature_id INTEGER NOT NULL,
+            offset_days INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            sent_at TEXT NOT NULL DEFAULT (datetime('now')),
+            PRIMARY KEY (signature_id, offset_days, chat_id),
+            FOREIGN KEY(signature_id) REFERENCES signature(id) ON DELETE CASCADE
+        ) WITHOUT ROWID""",
+        """CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )""",
+    )),
+    (4, (
+        # Ключ сортировки «Списка всех» как колонки: по выражениям SQLite
+        # не умеет искать сравнением кортежей, по колонкам — умеет
+        """ALTER TABLE entity ADD COLUMN kind_order INTEGER
+           GENERATED ALWAYS AS (CASE WHEN kind='org' THEN 0 ELSE 1 END) VIRTUAL""",
+        "ALTER TABLE entity ADD COLUMN name_key TEXT GENERATED ALWAYS AS (lower(name)) VIRTUAL",
+        "CREATE INDEX IF NOT EXISTS idx_entity_listing ON entity(kind_order, name_key, id)",
+    )),
+    (5, (
+        # Поиск по подстроке имени: триграммы, регистр сворачивается и для кириллицы
+        """CREATE VIRTUAL TABLE IF NOT EXISTS entity_fts USING fts5(
+            name, content='entity', content_rowid='id', tokenize='trigram'
+        )""",
+        """CREATE TRIGGER IF NOT EXISTS entity_fts_ai AFTER INSERT ON entity BEGIN
+            INSERT INTO entity_fts(rowid, name) VALUES (new.id, new.name);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS entity_fts_ad AFTER DELETE ON entity BEGIN
+            INSERT INTO entity_fts(entity_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS entity_fts_au AFTER UPDATE OF name ON entity BEGIN
+            INSERT INTO entity_fts(entity_fts, rowid, name) VALUES ('delete', old.id, old.name);
+            INSERT INTO entity_fts(rowid, name) VALUES (new.id, new.name);
+        END""",
+        "INSERT INTO entity_fts(entity_fts) VALUES ('rebuild')",
+    )),
+    (6, (
+        # user_data незавершённых сценариев, JSON (см. SqlitePersistence)
+        """CREATE TABLE IF NOT EXISTS user_state (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at TEXT NOT NULL DEFAULT (datetime('now'))
+        )""",
+    )),
+    (7, (
+        # Аренды «один процесс на базу» (см. LeaderLease)
+        """CREATE TABLE IF NOT EXISTS lease (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL      -- unix time
+        )""",
+        # Чей токен отправляет сообщение: процессы с другим ботом его не берут.
+        # Ожидающих строк единицы, поэтому bot_id проверяется поверх idx_outbox_due
+        "ALTER TABLE outbox ADD COLUMN bot_id INTEGER",
+    )),
+    (8, (
+        # Свои настройки напоминаний чата; NULL — значение по умолчанию из env
+        """CREATE TABLE IF NOT EXISTS subscriber_settings (
+            chat_id INTEGER PRIMARY KEY REFERENCES subscriber(chat_id) ON DELETE CASCADE,
+            remind_at TEXT,               -- HH:MM местного времени
+            tz TEXT                       -- IANA, например Asia/Almaty
+        )""",
+        # Свой набор смещений; нет строк — REMIND_OFFSETS
+        """CREATE TABLE IF NOT EXISTS subscriber_offset (
+            chat_id INTEGER NOT NULL REFERENCES subscriber(chat_id) ON DELETE CASCADE,
+            offset_days INTEGER NOT NULL CHECK(offset_days >= 0),
+            PRIMARY KEY (chat_id, offset_days)
+        ) WITHOUT ROWID""",
+        # До какого дня (по местному времени чата) напоминания разосланы —
+        # вместо общей отметки reminders_last_run
+        "ALTER TABLE subscriber ADD COLUMN reminded_until TEXT",
+        "UPDATE subscriber SET reminded_until=(SELECT value FROM meta WHERE key='reminders_last_run')",
+        "DELETE FROM meta WHERE key='reminders_last_run'",
+    )),
+    (9, (
+        # Замыкание иерархии grp: все пары (предок, потомок), включая (g, g).
+        # Поддерживается триггерами, так что его держат в порядке и
+        # ensure_group, и любая другая запись в grp
+        """CREATE TABLE IF NOT EXISTS grp_closure (
+            ancestor_id INTEGER NOT NULL,
+            descendant_id INTEGER NOT NULL,
+            depth INTEGER NOT NULL,
+            PRIMARY KEY (ancestor_id, descendant_id)
+        ) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS idx_grp_closure_descendant ON grp_closure(descendant_id, depth)",
+        """CREATE TRIGGER IF NOT EXISTS grp_closure_ai AFTER INSERT ON grp BEGIN
+            INSERT INTO grp_closure(ancestor_id, descendant_id, depth)
+            SELECT new.id, new.id, 0
+            UNION ALL
+            SELECT ancestor_id, new.id, depth + 1 FROM grp_closure WHERE descendant_id=new.parent_id;
+        END""",
+        # перенос поддерева: отрезаем его от прежних предков и подвешиваем к новым
+        """CREATE TRIGGER IF NOT EXISTS grp_closure_au AFTER UPDATE OF parent_id ON grp
+           WHEN new.parent_id IS NOT old.parent_id BEGIN
+            DELETE FROM grp_closure
+            WHERE descendant_id IN (SELECT descendant_id FROM grp_closure WHERE ancestor_id=new.id)
+              AND ancestor_id NOT IN (SELECT descendant_id FROM grp_closure WHERE ancestor_id=new.id);
+            INSERT INTO grp_closure(ancestor_id, descendant_id, depth)
+            SELECT a.ancestor_id, d.descendant_id, a.depth + d.depth + 1
+            FROM grp_closure a, grp_closure d
+            WHERE a.descendant_id=new.parent_id AND d.ancestor_id=new.id;
+        END""",
+        # дочерние группы FK переводит в корень (UPDATE выше), здесь — сам узел
+        """CREATE TRIGGER IF NOT EXISTS grp_closure_ad AFTER DELETE ON grp BEGIN
+            DELETE FROM grp_closure WHERE ancestor_id=old.id;
+            DELETE FROM grp_closure WHERE descendant_id=old.id;
+        END""",
+        """INSERT INTO grp_closure(ancestor_id, descendant_id, depth)
+           WITH RECURSIVE t(ancestor_id, descendant_id, depth) AS (
+               SELECT id, id, 0 FROM grp
+               UNION ALL
+               SELECT t.ancestor_id, g.id, t.depth + 1 FROM t JOIN grp g ON g.parent_id=t.descendant_id
+           )
+           SELECT ancestor_id, descendant_id, depth FROM t""",
+        # Подписка чата только на свою ветку реестра; NULL — весь реестр
+        "ALTER TABLE subscriber_settings ADD COLUMN scope_group_id INTEGER REFERENCES grp(id) ON DELETE SET NULL",
+    )),
+    (10, (
+        # Счётчики для кнопок дерева (см. GROUP STATS)
+        """CREATE TABLE IF NOT EXISTS entity_status (
+            entity_id INTEGER PRIMARY KEY,
+            group_id INTEGER,
+            status TEXT NOT NULL          -- ok|expiring|expired|none
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_entity_status_group ON entity_status(group_id, status)",
+        """CREATE TABLE IF NOT EXISTS grp_stats (
+            group_id INTEGER PRIMARY KEY,
+            expired INTEGER NOT NULL DEFAULT 0,
+            expiring INTEGER NOT NULL DEFAULT 0,
+            unsigned INTEGER NOT NULL DEFAULT 0
+        )""",
+        "INSERT OR REPLACE INTO meta(key, value) VALUES ('grp_stats_day', date('now', 'localtime'))",
+        f"INSERT INTO entity_status(entity_id, group_id, status) {_entity_status_select('true')}",
+        _GRP_STATS_FILL,
+        f"""CREATE TRIGGER IF NOT EXISTS entity_status_ai AFTER INSERT ON entity BEGIN
+            {_entity_status_refresh('new.id')}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS entity_status_au AFTER UPDATE OF group_id ON entity BEGIN
+            {_entity_status_refresh('new.id')}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS entity_status_ad AFTER DELETE ON entity BEGIN
+            {_entity_status_refresh('old.id')}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS signature_status_ai AFTER INSERT ON signature BEGIN
+            {_entity_status_refresh('new.entity_id')}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS signature_status_au
+           AFTER UPDATE OF expiry, active, entity_id ON signature BEGIN
+            {_entity_status_refresh('old.entity_id')}
+            {_entity_status_refresh('new.entity_id')}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS signature_status_ad AFTER DELETE ON signature BEGIN
+            {_entity_status_refresh('old.entity_id')}
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS grp_stats_ai AFTER INSERT ON grp BEGIN
+            INSERT INTO grp_stats(group_id) VALUES (new.id);
+        END""",
+        # перенос и удаление групп редки: после правки замыкания суммы
+        # пересчитываются целиком, в том же триггере — порядок важен
+        "DROP TRIGGER grp_closure_au",
+        f"""CREATE TRIGGER grp_closure_au AFTER UPDATE OF parent_id ON grp
+           WHEN new.parent_id IS NOT old.parent_id BEGIN
+            DELETE FROM grp_closure
+            WHERE descendant_id IN (SELECT descendant_id FROM grp_closure WHERE ancestor_id=new.id)
+              AND ancestor_id NOT IN (SELECT descendant_id FROM grp_closure WHERE ancestor_id=new.id);
+            INSERT INTO grp_closure(ancestor_id, descendant_id, depth)
+            SELECT a.ancestor_id, d.descendant_id, a.depth + d.depth + 1
+            FROM grp_closure a, grp_closure d
+            WHERE a.descendant_id=new.parent_id AND d.ancestor_id=new.id;
+            {_GRP_STATS_REBUILD}
+        END""",
+        "DROP TRIGGER grp_closure_ad",
+        f"""CREATE TRIGGER grp_closure_ad AFTER DELETE ON grp BEGIN
+            DELETE FROM grp_closure WHERE ancestor_id=old.id;
+            DELETE FROM grp_closure WHERE descendant_id=old.id;
+            {_GRP_STATS_REBUILD}
+        END""",
+    )),
+    (11, (
+        # Номер дня окончания (julianday) для гистограмм /stats: диапазон
+        # «год вперёд» — поиск по индексу, корзины — целочисленное деление
+        "ALTER TABLE signature ADD COLUMN expiry_day INTEGER "
+        "GENERATED ALWAYS AS (CAST(julianday(expiry) AS INTEGER)) VIRTUAL",
+        "CREATE INDEX IF NOT EXISTS idx_signature_active_expiry_day ON signature(expiry_day) WHERE active=1",
+    )),
+    (12, (
+        # Журнал изменений подписей: пишется триггерами, строки не меняются
+        """CREATE TABLE IF NOT EXISTS signature_history (
+            id INTEGER PRIMARY KEY,
+            entity_id INTEGER NOT NULL REFERENCES entity(id) ON DELETE CASCADE,
+            signature_id INTEGER NOT NULL,
+            event TEXT NOT NULL CHECK(event IN ('created','renewed','deleted')),
+            expiry TEXT NOT NULL,
+            note TEXT,
+            recorded_at TEXT NOT NULL DEFAULT (datetime('now'))
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_signature_history_entity ON signature_history(entity_id, id)",
+        """CREATE TRIGGER IF NOT EXISTS signature_history_readonly BEFORE UPDATE ON signature_history BEGIN
+            SELECT RAISE(ABORT, 'signature_history is append-only');
+        END""",
+        """INSERT INTO signature_history(entity_id, signature_id, event, expiry, note, recorded_at)
+           SELECT entity_id, id, 'created', expiry, note, created_at FROM signature ORDER BY id""",
+        """INSERT INTO signature_history(entity_id, signature_id, event, expiry, note, recorded_at)
+           SELECT entity_id, id, 'deleted', expiry, note, updated_at FROM signature WHERE active=0 ORDER BY id""",
+        """CREATE TRIGGER IF NOT EXISTS signature_history_ai AFTER INSERT ON signature WHEN new.active=1 BEGIN
+            INSERT INTO signature_history(entity_id, signature_id, event, expiry, note)
+            VALUES (new.entity_id, new.id, 'created', new.expiry, new.note);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS signature_history_au AFTER UPDATE OF expiry, note ON signature
+           WHEN new.active=1 AND (new.expiry IS NOT old.expiry OR new.note IS NOT old.note) BEGIN
+            INSERT INTO signature_history(entity_id, signature_id, event, expiry, note)
+            VALUES (new.entity_id, new.id, 'renewed', new.expiry, new.note);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS signature_history_off AFTER UPDATE OF active ON signature
+           WHEN old.active=1 AND new.active=0 BEGIN
+            INSERT INTO signature_history(entity_id, signature_id, event, expiry, note)
+            VALUES (old.entity_id, old.id, 'deleted', old.expiry, old.note);
+        END""",
+        # Снятые подписи старше SIGNATURE_RETENTION_DAYS — см. archive_signatures
+        """CREATE TABLE IF NOT EXISTS signature_archive (
+            id INTEGER PRIMARY KEY,
+            entity_id INTEGER NOT NULL REFERENCES entity(id) ON DELETE CASCADE,
+            expiry TEXT NOT NULL,
+            note TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            archived_at TEXT NOT NULL DEFAULT (datetime('now'))
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_signature_archive_entity ON signature_archive(entity_id)",
+        "CREATE INDEX IF NOT EXISTS idx_signature_inactive ON signature(updated_at) WHERE active=0",
+    )),
+    (13, (
+        # триггеры счётчиков групп пропускают массовую запись (см. _GRP_STATS_LIVE)
+        *(f"DROP TRIGGER IF EXISTS {name}" for name, _ in _entity_status_triggers()),
+        *(sql for _, sql in _entity_status_triggers()),
+    )),
+    (14, (
+        # записи других процессов доходят до планировщика лидера (см. _REMINDERS_BUMP)
+        "INSERT OR IGNORE INTO meta(key, value) VALUES ('reminders_generation', '0')",
+        *(f"DROP TRIGGER IF EXISTS {name}" for name, _ in _reminders_generation_triggers()),
+        *(sql for _, sql in _reminders_generation_triggers()),
+    )),
+    (15, (
+        # кэши экранов других процессов узнают о смене счётчиков групп (см. _REGISTRY_BUMP)
+        "INSERT OR IGNORE INTO meta(key, value) VALUES ('registry_generation', '0')",
+        "DROP TRIGGER IF EXISTS grp_stats_generation_au",
+        _GRP_STATS_GENERATION_TRIGGER,
+    )),
+    (16, (
+        # база создана до INCREMENTAL: режим меняется только полным VACUUM —
+        # один раз при старте, пока пул не открыт и писать больше некому
+        "PRAGMA auto_vacuum = INCREMENTAL",
+        "VACUUM",
+    )),
+]
+
+# VACUUM не выполняется внутри транзакции: эти миграции идут без BEGIN
+_MIGRATIONS_OUTSIDE_TRANSACTION = {16}
+
+async def get_schema_version(db) -> int:
+    async with db.execute("PRAGMA user_version") as cur:
+        return (await cur.fetchone())[0]
+
+async def apply_migrations(db):
+    """Применяет недостающие миграции, каждую в своей транзакции."""
+    version = await get_schema_version(db)
+    for target, statements in MIGRATIONS:
+        if target <= version:
+            continue
+        if db.in_transaction:
+            await db.commit()
+        if target in _MIGRATIONS_OUTSIDE_TRANSACTION:
+            for sql in statements:
+                await db.execute(sql)
+            await db.execute(f"PRAGMA user_version = {int(target)}")
+            logger.info("Схема БД обновлена до версии %s", target)
+            version = target
+            continue
+        await db.execute("BEGIN")
+        try:
+            for sql in statements:
+                await db.execute(sql)
+            await db.execute(f"PRAGMA user_version = {int(target)}")
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        logger.info("Схема БД обновлена до версии %s", target)
+        version = target
+
+async def init_db():
+    """Схема и ORG_STRUCTURE; на актуальной базе — два чтения без записи."""
+    async with db_write() as db:
+        await apply_migrations(db)
+        synced = await sync_org_structure(db, ORG_STRUCTURE)
         await db.commit()
+    registry_changed()
+    if synced and ORG_CACHE.loaded:
+        await ORG_CACHE.load()
 
 async def is_allowed(user_id: int) -> bool:
     return (not ADMIN_IDS) or (user_id in ADMIN_IDS)
@@ -305,15 +1224,17 @@ def parse_date(s: str) -> date:
     try:
         if "." in s and len(s) >= 8:
             d = datetime.strptime(s, "%d.%m.%Y").date()
+        elif len(s) == 10 and s[4] == "-":
+            d = date.fromisoformat(s)
         else:
-            # доверим dateutil любым нормальным строкам
+            # доверим dateutil любым нормальным строкам; нужен редко — грузим по требованию
+            from dateutil import parser as dateparser
             d = dateparser.parse(s, dayfirst=True).date()
         return d
     except Exception:
         raise ValueError("Неверный формат даты. Введите в виде 31.12.2025 или 2025-12-31")
 
 async def upsert_signature(db, entity_id: int, expiry: date, note: str | None):
-    await db.execute("PRAGMA foreign_keys = ON;")
     async with db.execute("SELECT id FROM signature WHERE entity_id=? AND active=1", (entity_id,)) as cur:
         row = await cur.fetchone()
     if row:
@@ -322,32 +1243,401 @@ async def upsert_signature(db, entity_id: int, expiry: date, note: str | None):
             "UPDATE signature SET expiry=?, note=?, updated_at=datetime('now') WHERE id=?",
             (expiry.isoformat(), note, sig_id)
         )
+        # новый срок — новые напоминания
+        await db.execute("DELETE FROM reminder_log WHERE signature_id=?", (sig_id,))
     else:
-        await db.execute(
+        cur = await db.execute(
             "INSERT INTO signature(entity_id, expiry, note, active) VALUES (?,?,?,1)",
             (entity_id, expiry.isoformat(), note)
         )
+        sig_id = cur.lastrowid
     await db.commit()
-
-async def get_subscribers() -> list[int]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT chat_id FROM subscriber") as cur:
+    registry_changed()
+    if REMINDERS is not None:
+        REMINDERS.signature_changed(sig_id, expiry)
+
+async def get_subscribers(slot: tuple[str, str] | None = None) -> list[int]:
+    """Все подписчики или только те, чьё (время, пояс) доставки равно slot."""
+    if slot is None:
+        sql, args = "SELECT chat_id FROM subscriber", ()
+    else:
+        sql = """
+        SELECT sub.chat_id FROM subscriber sub
+        LEFT JOIN subscriber_settings st ON st.chat_id=sub.chat_id
+        WHERE coalesce(st.remind_at, ?)=? AND coalesce(st.tz, ?)=?
+        """
+        args = (REMIND_AT, slot[0], TZ, slot[1])
+    async with db_read() as db:
+        async with db.execute(sql, args) as cur:
             return [r[0] for r in await cur.fetchall()]
 
 async def ensure_subscriber(chat_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_write() as db:
+        await db.execute("INSERT OR IGNORE INTO subscriber(chat_id) VALUES (?)", (chat_id,))
+        await db.commit()
+
+def parse_offsets(text: str) -> tuple[int, ...]:
+    parts = [p for p in re.split(r"[\s,;]+", text.strip()) if p]
+    if not parts or not all(p.isdigit() and int(p) <= 366 for p in parts):
+        raise ValueError("Введите числа дней от 0 до 366 через запятую, например 30, 14, 7, 0")
+    if len(set(parts)) > 10:
+        raise ValueError("Не больше 10 напоминаний на подпись.")
+    return tuple(sorted({int(p) for p in parts}, reverse=True))
+
+def parse_remind_time(text: str) -> str:
+    m = re.fullmatch(r"([01]?\d|2[0-3])[:.]([0-5]\d)", text.strip())
+    if not m:
+        raise ValueError("Введите время в виде ЧЧ:ММ, например 08:30")
+    return f"{int(m.group(1)):02d}:{m.group(2)}"
+
+def parse_timezone(text: str) -> str:
+    name = text.strip()
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError("Неизвестный часовой пояс. Пример: Europe/Riga, Asia/Almaty")
+    return name
+
+async def get_subscriber_settings(chat_id: int) -> dict:
+    """Настройки напоминаний чата; не заданное своё — из REMIND_OFFSETS/REMIND_AT/TZ.
+
+    scope — раздел реестра (id, имя), на который подписан чат, или None.
+    """
+    async with db_read() as db:
+        async with db.execute(
+            """
+            SELECT st.remind_at, st.tz, g.id AS scope_id, g.name AS scope_name
+            FROM subscriber_settings st LEFT JOIN grp g ON g.id=st.scope_group_id
+            WHERE st.chat_id=?
+            """,
+            (chat_id,)
+        ) as cur:
+            row = await cur.fetchone()
+        async with db.execute(
+            "SELECT offset_days FROM subscriber_offset WHERE chat_id=? ORDER BY offset_days DESC", (chat_id,)
+        ) as cur:
+            offsets = tuple(r[0] for r in await cur.fetchall())
+    own = {"offsets": bool(offsets), "remind_at": bool(row and row["remind_at"]), "tz": bool(row and row["tz"])}
+    return {
+        "offsets": offsets or REMIND_OFFSETS,
+        "remind_at": row["remind_at"] if own["remind_at"] else REMIND_AT,
+        "tz": row["tz"] if own["tz"] else TZ,
+        "scope": (row["scope_id"], row["scope_name"]) if row and row["scope_id"] else None,
+        "own": own,
+    }
+
+async def save_subscriber_settings(chat_id: int, *, offsets: tuple[int, ...] | None = None,
+                                   remind_at: str | None = None, tz: str | None = None,
+                                   scope_group_id: int | None = None, whole_registry: bool = False,
+                                   reset: bool = False):
+    """Меняет только переданное; reset — вернуть всё к значениям по умолчанию.
+
+    scope_group_id — подписать чат на ветку реестра, whole_registry — снова на весь.
+    """
+    async with db_write() as db:
         await db.execute("INSERT OR IGNORE INTO subscriber(chat_id) VALUES (?)", (chat_id,))
+        if reset:
+            await db.execute("DELETE FROM subscriber_settings WHERE chat_id=?", (chat_id,))
+            await db.execute("DELETE FROM subscriber_offset WHERE chat_id=?", (chat_id,))
+        if remind_at is not None or tz is not None or scope_group_id is not None or whole_registry:
+            await db.execute(
+                """
+                INSERT INTO subscriber_settings(chat_id, remind_at, tz, scope_group_id) VALUES (?,?,?,?)
+                ON CONFLICT(chat_id) DO UPDATE SET
+                    remind_at=coalesce(excluded.remind_at, remind_at),
+                    tz=coalesce(excluded.tz, tz),
+                    scope_group_id=CASE WHEN ? THEN NULL
+                                        ELSE coalesce(excluded.scope_group_id, scope_group_id) END
+                """,
+                (chat_id, remind_at, tz, scope_group_id, whole_registry)
+            )
+        if offsets is not None:
+            await db.execute("DELETE FROM subscriber_offset WHERE chat_id=?", (chat_id,))
+            await db.executemany(
+                "INSERT INTO subscriber_offset(chat_id, offset_days) VALUES (?,?)",
+                [(chat_id, o) for o in offsets]
+            )
         await db.commit()
+    # слоты доставки поменялись — планировщик перечитывает окно
+    if REMINDERS is not None:
+        await REMINDERS.reload(catch_up=False)
+
+# ---- ORG CACHE ----
+
+def _sql_lower(text: str) -> str:
+    # встроенный lower() SQLite понижает только ASCII — повторяем его порядок
+    return "".join(ch.lower() if "A" <= ch <= "Z" else ch for ch in text)
+
+
+class OrgCache:
+    """Процессный кэш иерархии grp и сущностей по группам.
+
+    Группы и ЮЛ загружаются целиком при старте, списки сотрудников —
+    лениво и живут в LRU. Записи сущностей обновляют кэш на месте после
+    commit; группы меняет только сверка ORG_STRUCTURE в init_db, после
+    неё кэш перечитывается целиком.
+    """
+
+    def __init__(self, max_person_lists: int = ORG_CACHE_PERSONS):
+        self.max_person_lists = max(1, max_person_lists)
+        self.clear()
+
+    def clear(self):
+        self.loaded = False
+        self._groups: dict[int, dict] = {}
+        self._children: dict[int | None, list[int]] = {}
+        self._legal: dict[int, dict] = {}
+        self._persons: OrderedDict[int, list[dict]] = OrderedDict()
+
+    async def load(self):
+        self.clear()
+        async with db_read() as db:
+            async with db.execute("SELECT id, name, parent_id FROM grp") as cur:
+                for r in await cur.fetchall():
+                    self._put_group(r["id"], r["name"], r["parent_id"])
+            async with db.execute(
+                "SELECT id, name, kind, group_id FROM entity WHERE kind='org' ORDER BY id"
+            ) as cur:
+                for r in await cur.fetchall():
+                    if r["group_id"] is not None:
+                        self._legal.setdefault(
+                            r["group_id"], {"id": r["id"], "name": r["name"], "kind": "org"}
+                        )
+        self.loaded = True
+
+    # --- чтение ---
+
+    def group(self, group_id: int) -> dict | None:
+        return self._groups.get(group_id)
+
+    def child_groups(self, parent_id: int | None) -> list[dict]:
+        return [self._groups[gid] for gid in self._children.get(parent_id, [])]
+
+    def legal_entity(self, group_id: int) -> dict | None:
+        return self._legal.get(group_id)
+
+    def persons(self, group_id: int) -> list[dict] | None:
+        rows = self._persons.get(group_id)
+        if rows is not None:
+            self._persons.move_to_end(group_id)
+        return rows
+
+    def put_persons(self, group_id: int, rows) -> list[dict]:
+        cached = [{"id": r["id"], "name": r["name"], "kind": r["kind"]} for r in rows]
+        self._persons[group_id] = cached
+        self._persons.move_to_end(group_id)
+        while len(self._persons) > self.max_person_lists:
+            self._persons.popitem(last=False)
+        return cached
+
+    # --- запись ---
+
+    def _put_group(self, group_id: int, name: str, parent_id: int | None):
+        old = self._groups.get(group_id)
+        if old is not None:
+            siblings = self._children.get(old["parent_id"], [])
+            if group_id in siblings:
+                siblings.remove(group_id)
+        self._groups[group_id] = {"id": group_id, "name": name, "parent_id": parent_id}
+        siblings = self._children.setdefault(parent_id, [])
+        siblings.append(group_id)
+        siblings.sort(key=lambda gid: self._groups[gid]["name"])
+
+    def entity_added(self, entity_id: int, name: str, kind: str, group_id: int | None):
+        if not self.loaded or group_id is None:
+            return
+        row = {"id": entity_id, "name": name, "kind": kind}
+        if kind == "org":
+            legal = self._legal.get(group_id)
+            if legal is None or legal["id"] > entity_id:
+                self._legal[group_id] = row
+            return
+        persons = self._persons.get(group_id)
+        if persons is not None:
+            keys = [_sql_lower(p["name"]) for p in persons]
+            persons.insert(bisect.bisect_right(keys, _sql_lower(name)), row)
+
+    def entity_removed(self, entity_id: int, kind: str, group_id: int | None,
+                       next_legal=None):
+        """next_legal — следующее ЮЛ группы (если было), его выбирает вызывающий."""
+        if not self.loaded or group_id is None:
+            return
+        if kind == "org":
+            legal = self._legal.get(group_id)
+            if legal is not None and legal["id"] == entity_id:
+                if next_legal is not None:
+                    self._legal[group_id] = {
+                        "id": next_legal["id"], "name": next_legal["name"], "kind": "org"
+                    }
+                else:
+                    del self._legal[group_id]
+            return
+        persons = self._persons.get(group_id)
+        if persons is not None:
+            persons[:] = [p for p in persons if p["id"] != entity_id]
+
+
+ORG_CACHE = OrgCache()
+
+
+class RenderCache:
+    """Готовые экраны (текст и клавиатура) по ключу (экран, параметры, дата, поколение).
+
+    Поколение растёт при каждой записи в реестр (registry_changed), а
+    записи других процессов в счётчики групп замечает sync_render_cache.
+    Ключ берётся до отрисовки: экран, начатый до записи, ляжет под старым
+    поколением и после неё выдан не будет. Дата в ключе — из-за «осталось N дн.».
+    """
+
+    def __init__(self, maxsize: int = RENDER_CACHE_SIZE):
+        self.maxsize = max(1, maxsize)
+        self.generation = 0
+        self._items: OrderedDict[tuple, object] = OrderedDict()
+
+    def bump(self):
+        self.generation += 1
+        self._items.clear()
+
+    def get(self, key: tuple):
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key: tuple, value):
+        self._items[key] = value
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+
+RENDER_CACHE = RenderCache()
+
+
+def render_cached(view: str):
+    """Кэширует async-функцию отрисовки экрана в RENDER_CACHE."""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            await sync_render_cache()
+            key = (view, args, tuple(sorted(kwargs.items())), date.today(), RENDER_CACHE.generation)
+            value = RENDER_CACHE.get(key)
+            if value is not None:
+                METRICS.inc("edsbot_render_cache_total", view=view, result="hit")
+                return value
+            METRICS.inc("edsbot_render_cache_total", view=view, result="miss")
+            value = await fn(*args, **kwargs)
+            RENDER_CACHE.put(key, value)
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+def registry_changed():
+    """Вызывать после любой записи в реестр: сбрасывает кэши экранов и inline."""
+    RENDER_CACHE.bump()
+    INLINE_CACHE.clear()
+
+
+# meta.registry_generation при последней сверке и когда она была
+_registry_generation: str | None = None
+_registry_checked_at = float("-inf")
 
-async def get_group(group_id: int) -> aiosqlite.Row | None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+async def sync_render_cache():
+    """Сбрасывает кэши экранов, если с прошлой сверки grp_stats менялись.
+
+    Читает meta не чаще раза в RENDER_SYNC_INTERVAL секунд, так что
+    попадания в кэш между сверками обходятся без SQLite.
+    """
+    global _registry_generation, _registry_checked_at
+    now = time.monotonic()
+    if now - _registry_checked_at < RENDER_SYNC_INTERVAL:
+        return
+    _registry_checked_at = now
+    async with db_read() as db:
+        async with db.execute("SELECT value FROM meta WHERE key='registry_generation'") as cur:
+            row = await cur.fetchone()
+    generation = row[0] if row else None
+    if _registry_generation is not None and generation != _registry_generation:
+        registry_changed()
+    _registry_generation = generation
+
+
+# День, на который в этом процессе уже пересчитаны grp_stats
+_grp_stats_day: str | None = None
+
+async def refresh_grp_stats(today: date | None = None) -> None:
+    """Переводит счётчики групп на новый день; вызывает держатель аренды.
+
+    Статус меняется только у сущностей, чья подпись пересекла границу
+    «истекла» или «осталось GRP_STATS_EXPIRING_DAYS дней» между прошлым
+    и текущим днём, — пересчитываются только они.
+    """
+    global _grp_stats_day
+    day = (today or date.today()).isoformat()
+    if _grp_stats_day == day:
+        return
+    async with db_write() as db:
+        async with db.execute("SELECT value FROM meta WHERE key='grp_stats_day'") as cur:
+            row = await cur.fetchone()
+        old = row[0] if row else None
+        if old != day:
+            await db.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('grp_stats_day', ?)", (day,))
+            if old is None:
+                await rebuild_grp_stats(db)
+            else:
+                lo, hi = sorted((old, day))
+                shift = f"+{GRP_STATS_EXPIRING_DAYS} days"
+                await db.execute("CREATE TEMP TABLE IF NOT EXISTS grp_stats_dirty(entity_id INTEGER PRIMARY KEY)")
+                await db.execute("DELETE FROM temp.grp_stats_dirty")
+                await db.execute(
+                    """
+                    INSERT OR IGNORE INTO temp.grp_stats_dirty(entity_id)
+                    SELECT entity_id FROM signature
+                    WHERE active=1 AND (expiry >= ? AND expiry < ?
+                                        OR expiry >= date(?, ?) AND expiry < date(?, ?))
+                    """,
+                    (lo, hi, lo, shift, hi, shift),
+                )
+                dirty = "es.entity_id IN (SELECT entity_id FROM temp.grp_stats_dirty)"
+                await db.execute(_grp_stats_shift("-", dirty))
+                await db.execute("DELETE FROM entity_status WHERE entity_id IN (SELECT entity_id FROM temp.grp_stats_dirty)")
+                await db.execute(
+                    "INSERT INTO entity_status(entity_id, group_id, status) "
+                    + _entity_status_select("e.id IN (SELECT entity_id FROM temp.grp_stats_dirty)")
+                )
+                await db.execute(_grp_stats_shift("+", dirty))
+            await db.commit()
+            # экраны нового дня могли отрисоваться до перевода; другие процессы
+            # узнают о нём по registry_generation
+            registry_changed()
+    _grp_stats_day = day
+
+async def get_grp_stats(group_ids: list[int]) -> dict[int, aiosqlite.Row]:
+    if not group_ids:
+        return {}
+    async with db_read() as db:
+        async with db.execute(
+            f"SELECT group_id, expired, expiring, unsigned FROM grp_stats "
+            f"WHERE group_id IN ({','.join('?' * len(group_ids))})",
+            group_ids,
+        ) as cur:
+            return {row["group_id"]: row for row in await cur.fetchall()}
+
+
+async def get_group(group_id: int) -> aiosqlite.Row | dict | None:
+    if ORG_CACHE.loaded:
+        return ORG_CACHE.group(group_id)
+    async with db_read() as db:
         async with db.execute("SELECT id, name, parent_id FROM grp WHERE id=?", (group_id,)) as cur:
             return await cur.fetchone()
 
-async def list_groups(parent_id: int | None) -> list[aiosqlite.Row]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+async def list_groups(parent_id: int | None) -> list[aiosqlite.Row] | list[dict]:
+    if ORG_CACHE.loaded:
+        return ORG_CACHE.child_groups(parent_id)
+    async with db_read() as db:
         if parent_id is None:
             sql = "SELECT id, name FROM grp WHERE parent_id IS NULL ORDER BY name"
             args = ()
@@ -357,30 +1647,36 @@ async def list_groups(parent_id: int | None) -> list[aiosqlite.Row]:
         async with db.execute(sql, args) as cur:
             return await cur.fetchall()
 
-async def get_group_legal_entity(group_id: int) -> aiosqlite.Row | None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+async def get_group_legal_entity(group_id: int) -> aiosqlite.Row | dict | None:
+    if ORG_CACHE.loaded:
+        return ORG_CACHE.legal_entity(group_id)
+    async with db_read() as db:
         async with db.execute(
-            "SELECT id, name, kind FROM entity WHERE group_id=? AND kind='org'",
+            "SELECT id, name, kind FROM entity WHERE group_id=? AND kind='org' ORDER BY id",
             (group_id,)
         ) as cur:
             return await cur.fetchone()
 
-async def list_group_persons(group_id: int) -> list[aiosqlite.Row]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+async def list_group_persons(group_id: int) -> list[aiosqlite.Row] | list[dict]:
+    if ORG_CACHE.loaded:
+        cached = ORG_CACHE.persons(group_id)
+        if cached is not None:
+            return cached
+    async with db_read() as db:
         async with db.execute(
             "SELECT id, name, kind FROM entity WHERE group_id=? AND kind='person' ORDER BY lower(name)",
             (group_id,)
         ) as cur:
-            return await cur.fetchall()
+            rows = await cur.fetchall()
+    if ORG_CACHE.loaded:
+        return ORG_CACHE.put_persons(group_id, rows)
+    return rows
 
 async def get_entity_with_signature(entity_id: int) -> aiosqlite.Row | None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with db_read() as db:
         async with db.execute(
             """
-            SELECT e.id, e.name, e.kind, s.expiry, s.note
+            SELECT e.id, e.name, e.kind, e.group_id, s.expiry, s.note
             FROM entity e
             LEFT JOIN signature s ON s.entity_id=e.id AND s.active=1
             WHERE e.id=?
@@ -390,8 +1686,7 @@ async def get_entity_with_signature(entity_id: int) -> aiosqlite.Row | None:
             return await cur.fetchone()
 
 async def list_persons_with_signatures(group_id: int) -> list[aiosqlite.Row]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with db_read() as db:
         async with db.execute(
             """
             SELECT e.id, e.name, e.kind, s.expiry, s.note
@@ -405,56 +1700,313 @@ async def list_persons_with_signatures(group_id: int) -> list[aiosqlite.Row]:
             return await cur.fetchall()
 
 
+# ---- PERSISTENCE ----
+
+def _state_default(o):
+    if isinstance(o, datetime):
+        return {"$dt": o.isoformat()}
+    if isinstance(o, date):
+        return {"$date": o.isoformat()}
+    raise TypeError(f"{type(o).__name__} нельзя сохранить в user_data")
+
+
+def _state_hook(d: dict):
+    if len(d) == 1:
+        if "$date" in d:
+            return date.fromisoformat(d["$date"])
+        if "$dt" in d:
+            return datetime.fromisoformat(d["$dt"])
+    return d
+
+
+def dump_state(data: dict) -> str:
+    """Компактный JSON для user_data; даты — как {"$date": "..."}.
+
+    Кортежи превращаются в списки — код сценариев их только распаковывает.
+    """
+    return json.dumps(data, default=_state_default, ensure_ascii=False, separators=(",", ":"))
+
+
+def load_state(text: str) -> dict:
+    return json.loads(text, object_hook=_state_hook)
+
+
+class SqlitePersistence(BasePersistence):
+    """user_data в таблице user_state, чтобы сценарии переживали перезапуск.
+
+    PTB отдаёт изменившихся пользователей раз в update_interval. Записи
+    копятся в self._pending и уходят одной транзакцией; состояние, текст
+    которого совпадает с уже сохранённым, не пишется вовсе.
+    """
+
+    def __init__(self, update_interval: float = PERSIST_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False,
+                                        user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._saved: dict[int, str] = {}
+        self._pending: dict[int, str | None] = {}  # None — удалить строку
+        self._writer: asyncio.Task | None = None
+
+    async def get_user_data(self) -> dict[int, dict]:
+        async with db_read() as db:
+            async with db.execute("SELECT user_id, data FROM user_state") as cur:
+                rows = await cur.fetchall()
+        result: dict[int, dict] = {}
+        for user_id, text in rows:
+            try:
+                result[user_id] = load_state(text)
+            except ValueError:
+                logger.warning("Состояние пользователя %s не читается, пропускаю", user_id)
+                continue
+            self._saved[user_id] = text
+        return result
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._stage(user_id, dump_state(data) if data else None)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._stage(user_id, None)
+
+    def _stage(self, user_id: int, text: str | None):
+        if self._saved.get(user_id) == text:
+            self._pending.pop(user_id, None)
+            return
+        self._pending[user_id] = text
+        if self._writer is None or self._writer.done():
+            # Application вызывает update_user_data пачкой через gather —
+            # задача запустится, когда все пользователи уже в _pending
+            self._writer = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self):
+        while self._pending:
+            batch, self._pending = self._pending, {}
+            try:
+                async with db_write() as db:
+                    await db.executemany(
+                        "INSERT INTO user_state(user_id, data) VALUES (?, ?) "
+                        "ON CONFLICT(user_id) DO UPDATE "
+                        "SET data=excluded.data, updated_at=datetime('now')",
+                        [(uid, text) for uid, text in batch.items() if text is not None],
+                    )
+                    await db.executemany(
+                        "DELETE FROM user_state WHERE user_id=?",
+                        [(uid,) for uid, text in batch.items() if text is None],
+                    )
+            except Exception:
+                logger.exception("Не удалось сохранить состояние %s пользователей", len(batch))
+                # вернём в очередь всё, что не успели перезаписать новым
+                self._pending = {**batch, **self._pending}
+                return
+            for uid, text in batch.items():
+                if text is None:
+                    self._saved.pop(uid, None)
+                else:
+                    self._saved[uid] = text
+
+    async def flush(self) -> None:
+        if self._writer is not None:
+            await self._writer
+        await self._write_pending()
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    # chat_data, bot_data, callback_data и ConversationHandler бот не использует
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key: tuple, new_state: object | None) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+
+# ---- SEARCH ----
+
+# Ранжируем не больше стольких совпадений: у запросов вроде «ова» их десятки
+# тысяч, а bm25 считается на каждую строку
+SEARCH_CANDIDATES = 200
+
+
+def _fts_phrase(token: str) -> str:
+    return '"' + token.replace('"', '""') + '"'
+
+
+async def search_entities(text: str, kinds: tuple[str, ...] | None = None,
+                          limit: int = SEARCH_LIMIT) -> list[dict]:
+    """Поиск по части имени без учёта регистра (в том числе кириллицы).
+
+    Имена, начинающиеся с запроса, ищутся всегда — по уникальному индексу
+    entity.name — и стоят выше. Слова от трёх букв дополнительно ищутся по
+    триграммному индексу entity_fts, остальное упорядочено по bm25.
+    """
+    text = " ".join(text.split())
+    if not text:
+        return []
+    tokens = text.split()
+    long_tokens = [t for t in tokens if len(t) >= 3]
+    kind_sql, kind_args = "", ()
+    if kinds:
+        kind_sql = f" AND e.kind IN ({','.join('?' * len(kinds))})"
+        kind_args = tuple(kinds)
+    select = (
+        "SELECT e.id, e.name, e.kind, e.group_id, g.name AS grp, s.expiry, s.note, {rank} AS rank "
+        "FROM {source} LEFT JOIN grp g ON g.id = e.group_id "
+        "LEFT JOIN signature s ON s.entity_id = e.id AND s.active = 1 "
+    )
+    # LIKE в SQLite не сворачивает регистр кириллицы — перебираем написания
+    variants = sorted({text, text.lower(), text.upper(), text.capitalize()})
+    ranges = " OR ".join("(e.name >= ? AND e.name < ?)" for _ in variants)
+    # отбор в подзапросе, чтобы соединения не сбивали план с поиска по диапазонам
+    prefix = f"(SELECT * FROM entity e WHERE ({ranges}){kind_sql} ORDER BY e.name LIMIT ?) e"
+    bounds = [x for v in variants for x in (v, v[:-1] + chr(ord(v[-1]) + 1))]
+    queries = [(select.format(rank="0", source=prefix), (*bounds, *kind_args, limit))]
+    if long_tokens:
+        # SEARCH_CANDIDATES отсекает совпадения в порядке rowid, поэтому имена,
+        # начинающиеся с запроса, берём отдельным запросом выше — их не потерять
+        sql = select.format(rank="f.rank", source="entity_fts f JOIN entity e ON e.id = f.rowid") + (
+            f"WHERE entity_fts MATCH ?{kind_sql} LIMIT ?"
+        )
+        queries.append((sql, (" ".join(_fts_phrase(t) for t in long_tokens), *kind_args, SEARCH_CANDIDATES)))
+    found: dict[int, dict] = {}
+    async with db_read() as db:
+        for sql, args in queries:
+            async with db.execute(sql, args) as cur:
+                for r in await cur.fetchall():
+                    found[r["id"]] = dict(r)
+    rows = list(found.values())
+    folded = text.casefold()
+    short = [t.casefold() for t in tokens if len(t) < 3]
+    rows = [r for r in rows if all(t in r["name"].casefold() for t in short)]
+    rows.sort(key=lambda r: (not r["name"].casefold().startswith(folded), r["rank"], r["name"]))
+    return rows[:limit]
+
+
 # ---- TREE NAVIGATION ----
 
-def _tree_cb(mode: str, action: str, payload: str = "_") -> str:
-    return f"{TREE_CB_PREFIX}{mode}|{action}|{payload}"
+def _b36(n: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    out = ""
+    while True:
+        n, r = divmod(n, 36)
+        out = digits[r] + out
+        if not n:
+            return out
 
 
-def _tree_state(context: ContextTypes.DEFAULT_TYPE) -> dict | None:
-    return context.user_data.get("tree")
+def _tree_cb(mode: str, action: str, group_id: int | None = None, arg: str = "") -> str:
+    """Компактный токен «t:<режим><действие>:<организация>:<аргумент>».
 
+    Организация, на которой стоит экран, едет в каждой кнопке, поэтому
+    навигация не зависит от user_data: старые клавиатуры работают после
+    перезапуска и с другого устройства. id — в base36, до 64 байт далеко.
+    """
+    group = _b36(group_id) if group_id is not None else ""
+    return f"{TREE_TOKEN_PREFIX}{TREE_MODES[mode]}{TREE_ACTIONS[action]}:{group}:{arg}"
 
-def _tree_current(state: dict) -> tuple[int, str] | None:
-    path: list[tuple[int, str]] = state.get("path", [])
-    if not path:
+
+def parse_tree_callback(data: str, user_data: dict) -> tuple[str, str, int | None, str] | None:
+    """(режим, действие, организация, аргумент) из токена или из старого «tree|…»."""
+    if data.startswith(TREE_TOKEN_PREFIX):
+        try:
+            _, codes, group, arg = data.split(":", 3)
+            mode, action = _TREE_MODE_BY_CODE[codes[0]], _TREE_ACTION_BY_CODE[codes[1:]]
+            return mode, action, int(group, 36) if group else None, arg
+        except (ValueError, KeyError, IndexError):
+            return None
+    parts = data.split("|", 3)
+    while len(parts) < 4:
+        parts.append("_")
+    _, mode, action, payload = parts
+    if mode not in TREE_MODES or action not in TREE_ACTIONS:
         return None
-    return path[-1]
+    if action in {"enter", "add"}:
+        return (mode, action, int(payload), "") if payload.isdigit() else None
+    if action == "select":
+        return (mode, action, None, _b36(int(payload))) if payload.isdigit() else None
+    # в старом формате текущая организация жила в user_data["tree"]["path"]
+    state = user_data.get("tree") or {}
+    path = (state.get("path") or []) if state.get("mode") == mode else []
+    if action == "up":
+        path = path[:-1]
+    group_id = path[-1][0] if path else None
+    return mode, action, group_id, payload if action == "show" else ""
 
 
-def _tree_path_text(state: dict) -> str:
-    path: list[tuple[int, str]] = state.get("path", [])
-    if not path:
-        return ""
-    return " / ".join(safe_md(name) for _, name in path)
+async def _tree_path(group_id: int | None) -> list[dict]:
+    """Цепочка организаций от корня до group_id по карте родителей (ORG_CACHE)."""
+    path = []
+    while group_id is not None and len(path) < 32:
+        row = await get_group(group_id)
+        if not row:
+            break
+        path.append(row)
+        group_id = row["parent_id"]
+    path.reverse()
+    return path
+
+
+def _tree_path_text(path: list) -> str:
+    return " / ".join(safe_md(g["name"]) for g in path)
 
 
 async def tree_start(update: Update, context: ContextTypes.DEFAULT_TYPE, mode: str):
-    state = {"mode": mode, "path": []}
-    if mode == "browse":
-        state["view"] = "groups"
-    context.user_data["tree"] = state
-    text, markup = await build_tree_view(state)
-    msg = await update.message.reply_text(text, reply_markup=markup, parse_mode=ParseMode.MARKDOWN)
-    state["message_id"] = msg.message_id
-    state["chat_id"] = msg.chat.id
+    text, markup = await build_tree_view(mode, None)
+    await update.message.reply_text(text, reply_markup=markup, parse_mode=ParseMode.MARKDOWN)
 
 
-async def build_tree_view(state: dict) -> tuple[str, InlineKeyboardMarkup]:
-    mode = state.get("mode")
+@render_cached("tree")
+async def build_tree_view(mode: str, group_id: int | None, view: str = "groups") -> tuple[str, InlineKeyboardMarkup]:
+    path = await _tree_path(group_id)
     if mode == "browse":
-        return await _build_tree_view_browse(state)
-    return await _build_tree_view_picker(state)
+        return await _build_tree_view_browse(path, view)
+    return await _build_tree_view_picker(mode, path)
+
 
+GRP_STATS_LEGEND = f"🔴 просрочено · 🟡 истекает в {GRP_STATS_EXPIRING_DAYS} дней · ⚪ без подписи"
 
-async def _build_tree_view_browse(state: dict) -> tuple[str, InlineKeyboardMarkup]:
-    path = state.get("path", [])
-    current = _tree_current(state)
-    group_id = current[0] if current else None
-    view = state.get("view", "groups")
+def _grp_stats_badge(row) -> str:
+    """Ненулевые счётчики поддерева для подписи кнопки группы."""
+    if row is None:
+        return ""
+    return " ".join(f"{icon}{n}" for icon, n in
+                    (("🔴", row["expired"]), ("🟡", row["expiring"]), ("⚪", row["unsigned"])) if n)
+
+
+async def _build_tree_view_browse(path: list, view: str) -> tuple[str, InlineKeyboardMarkup]:
+    current = path[-1] if path else None
+    group_id = current["id"] if current else None
+    parent_id = current["parent_id"] if current else None
     if view not in {"groups", "employees", "legal"}:
         view = "groups"
-        state["view"] = "groups"
 
     buttons: list[list[InlineKeyboardButton]] = []
     lines: list[str] = []
@@ -462,7 +2014,7 @@ async def _build_tree_view_browse(state: dict) -> tuple[str, InlineKeyboardMarku
     if not path:
         lines.append("*База подписей*")
     else:
-        lines.append(f"*{safe_md(current[1])}*")
+        lines.append(f"*{_tree_path_text(path)}*")
 
     if view == "groups":
         if not path:
@@ -471,28 +2023,33 @@ async def _build_tree_view_browse(state: dict) -> tuple[str, InlineKeyboardMarku
             lines.append("Выберите действие или подразделение.")
 
         children = await list_groups(group_id)
+        stats = await get_grp_stats([child["id"] for child in children])
         if group_id is not None:
             legal = await get_group_legal_entity(group_id)
             if legal:
                 buttons.append([
-                    InlineKeyboardButton("📄 Подпись юридического лица", _tree_cb("browse", "show", "legal"))
+                    InlineKeyboardButton("📄 Подпись юридического лица",
+                                         callback_data=_tree_cb("browse", "show", group_id, "legal"))
                 ])
             buttons.append([
-                InlineKeyboardButton("👥 Сотрудники", _tree_cb("browse", "show", "employees"))
+                InlineKeyboardButton("👥 Сотрудники", callback_data=_tree_cb("browse", "show", group_id, "employees"))
             ])
         for child in children:
+            counters = _grp_stats_badge(stats.get(child["id"]))
+            label = f"🏢 {child['name']} · {counters}" if counters else f"🏢 {child['name']}"
             buttons.append([
-                InlineKeyboardButton(f"🏢 {child['name']}", _tree_cb("browse", "enter", str(child["id"])))
+                InlineKeyboardButton(label, callback_data=_tree_cb("browse", "enter", child["id"]))
             ])
+        if any(_grp_stats_badge(row) for row in stats.values()):
+            lines.append(GRP_STATS_LEGEND)
         if path:
-            buttons.append([InlineKeyboardButton("⬅️ Назад", _tree_cb("browse", "up"))])
+            buttons.append([InlineKeyboardButton("⬅️ Назад", callback_data=_tree_cb("browse", "up", parent_id))])
         else:
-            buttons.append([InlineKeyboardButton("🏠 Главное меню", _tree_cb("browse", "exit"))])
+            buttons.append([InlineKeyboardButton("🏠 Главное меню", callback_data=_tree_cb("browse", "exit"))])
         return "\n".join(lines), InlineKeyboardMarkup(buttons)
 
     if group_id is None:
-        state["view"] = "groups"
-        return await _build_tree_view_browse(state)
+        return await _build_tree_view_browse(path, "groups")
 
     if view == "employees":
         rows = await list_persons_with_signatures(group_id)
@@ -516,17 +2073,13 @@ async def _build_tree_view_browse(state: dict) -> tuple[str, InlineKeyboardMarku
         else:
             lines.append("Для этой организации не заведено юридическое лицо.")
 
-    buttons.append([InlineKeyboardButton("⬅️ Назад", _tree_cb("browse", "show", "groups"))])
-    if not path:
-        buttons.append([InlineKeyboardButton("🏠 Главное меню", _tree_cb("browse", "exit"))])
+    buttons.append([InlineKeyboardButton("⬅️ Назад", callback_data=_tree_cb("browse", "show", group_id, "groups"))])
     return "\n".join(lines), InlineKeyboardMarkup(buttons)
 
 
-async def _build_tree_view_picker(state: dict) -> tuple[str, InlineKeyboardMarkup]:
-    mode = state.get("mode")
-    path = state.get("path", [])
-    current = _tree_current(state)
-    group_id = current[0] if current else None
+async def _build_tree_view_picker(mode: str, path: list) -> tuple[str, InlineKeyboardMarkup]:
+    current = path[-1] if path else None
+    group_id = current["id"] if current else None
     buttons: list[list[InlineKeyboardButton]] = []
 
     headers = {
@@ -541,23 +2094,26 @@ async def _build_tree_view_picker(state: dict) -> tuple[str, InlineKeyboardMarku
 
     lines = [f"*{safe_md(header)}*"]
     if path:
-        lines.append(f"Текущая организация: {safe_md(current[1])}")
+        lines.append(f"Текущая организация: {_tree_path_text(path)}")
     else:
         lines.append("Выберите организацию.")
 
     children = await list_groups(group_id)
 
+    if mode in SEARCH_MODES:
+        buttons.append([InlineKeyboardButton("🔎 Поиск по имени", callback_data=_tree_cb(mode, "search", group_id))])
+
     if mode == "reg_add_person":
         if current:
             buttons.append([
                 InlineKeyboardButton(
                     "➕ Добавить сотрудника сюда",
-                    _tree_cb(mode, "add", str(group_id))
+                    callback_data=_tree_cb(mode, "add", group_id)
                 )
             ])
         for child in children:
             buttons.append([
-                InlineKeyboardButton(f"🏢 {child['name']}", _tree_cb(mode, "enter", str(child["id"])))
+                InlineKeyboardButton(f"🏢 {child['name']}", callback_data=_tree_cb(mode, "enter", child["id"]))
             ])
     else:
         show_legal = mode in {"sign_add_org", "sign_update", "sign_delete", "reg_delete"}
@@ -568,97 +2124,147 @@ async def _build_tree_view_picker(state: dict) -> tuple[str, InlineKeyboardMarku
             if legal:
                 label = f"🏢 {legal['name']} (ЮЛ)"
                 buttons.append([
-                    InlineKeyboardButton(label, _tree_cb(mode, "select", str(legal["id"])))
+                    InlineKeyboardButton(label, callback_data=_tree_cb(mode, "select", group_id, _b36(legal["id"])))
                 ])
         if current and show_persons:
             persons = await list_group_persons(group_id)
             for person in persons:
                 label = f"👤 {person['name']}"
                 buttons.append([
-                    InlineKeyboardButton(label, _tree_cb(mode, "select", str(person["id"])))
+                    InlineKeyboardButton(label, callback_data=_tree_cb(mode, "select", group_id, _b36(person["id"])))
                 ])
         for child in children:
             buttons.append([
-                InlineKeyboardButton(f"🏢 {child['name']}", _tree_cb(mode, "enter", str(child["id"])))
+                InlineKeyboardButton(f"🏢 {child['name']}", callback_data=_tree_cb(mode, "enter", child["id"]))
             ])
 
     if path:
-        buttons.append([InlineKeyboardButton("⬅️ Назад", _tree_cb(mode, "up"))])
-    buttons.append([InlineKeyboardButton("🏠 Главное меню", _tree_cb(mode, "exit"))])
+        buttons.append([InlineKeyboardButton("⬅️ Назад", callback_data=_tree_cb(mode, "up", current["parent_id"]))])
+    buttons.append([InlineKeyboardButton("🏠 Главное меню", callback_data=_tree_cb(mode, "exit"))])
 
     return "\n".join(lines), InlineKeyboardMarkup(buttons)
 
 
-async def tree_handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, mode: str, action: str, payload: str):
+# Режимы, где вместо обхода дерева можно найти запись по имени
+SEARCH_MODES = {"find", "sign_add_org", "sign_add_person", "sign_update", "sign_delete", "reg_delete"}
+SEARCH_KINDS = {"sign_add_org": ("org",), "sign_add_person": ("person",)}
+
+
+async def build_search_results(mode: str, text: str,
+                               group_id: int | None = None) -> tuple[str, InlineKeyboardMarkup]:
+    rows = await search_entities(text, SEARCH_KINDS.get(mode))
+    buttons: list[list[InlineKeyboardButton]] = []
+    for r in rows:
+        label = f"{'🏢' if r['kind'] == 'org' else '👤'} {r['name']}"
+        if r["grp"] and r["grp"] != r["name"]:
+            label += f" — {r['grp']}"
+        buttons.append([InlineKeyboardButton(label, callback_data=_tree_cb(mode, "select", arg=_b36(r["id"])))])
+    if mode != "find":
+        buttons.append([InlineKeyboardButton("⬅️ К списку организаций", callback_data=_tree_cb(mode, "tree", group_id))])
+    buttons.append([InlineKeyboardButton("🏠 Главное меню", callback_data=_tree_cb(mode, "exit"))])
+    if rows:
+        txt = f"Найдено по «{safe_md(text)}». Выберите запись или отправьте другой запрос."
+    else:
+        txt = f"По «{safe_md(text)}» ничего не найдено. Отправьте другой запрос."
+    return txt, InlineKeyboardMarkup(buttons)
+
+
+async def show_entity_card(cbq, row):
+    """Карточка найденной записи с переходами в существующие сценарии."""
+    eid = _b36(row["id"])
+    kind = "ЮЛ" if row["kind"] == "org" else "ФЛ"
+    if row["expiry"]:
+        lines = [fmt_signature_row(row)]
+    else:
+        lines = [f"[{kind}] {safe_md(row['name'])} — подпись не заведена"]
+    path = await _tree_path(row["group_id"])
+    if path:
+        lines.append(f"Организация: {_tree_path_text(path)}")
+    if row["expiry"]:
+        buttons = [
+            [InlineKeyboardButton("✏️ Изменить подпись", callback_data=_tree_cb("sign_update", "select", arg=eid))],
+            [InlineKeyboardButton("🧾 Удалить подпись", callback_data=_tree_cb("sign_delete", "select", arg=eid))],
+        ]
+    else:
+        add_mode = "sign_add_org" if row["kind"] == "org" else "sign_add_person"
+        buttons = [[InlineKeyboardButton("🖊️ Добавить подпись", callback_data=_tree_cb(add_mode, "select", arg=eid))]]
+    buttons.append([InlineKeyboardButton("🚮 Удалить из реестра", callback_data=_tree_cb("reg_delete", "select", arg=eid))])
+    buttons.append([InlineKeyboardButton("🏠 Главное меню", callback_data=_tree_cb("find", "exit"))])
+    await cbq.edit_message_text("\n".join(lines), parse_mode=ParseMode.MARKDOWN,
+                                reply_markup=InlineKeyboardMarkup(buttons))
+
+
+async def tree_handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, mode: str, action: str,
+                               group_id: int | None, arg: str):
     q = update.callback_query
     await q.answer()
-    state = _tree_state(context)
-    if not state or state.get("mode") != mode:
-        state = {"mode": mode, "path": []}
-        if mode == "browse":
-            state["view"] = "groups"
-        context.user_data["tree"] = state
+    if context.user_data.get("awaiting") == "tree_search" and action != "search":
+        context.user_data.pop("awaiting", None)
+        context.user_data.pop("tree", None)
 
     if action == "exit":
-        context.user_data.pop("tree", None)
         await q.edit_message_text("Возврат в главное меню…")
         await _go_main(context, q.message.chat.id)
         return
 
-    if action == "up":
-        path: list[tuple[int, str]] = state.get("path", [])
-        if path:
-            path.pop()
-        if mode == "browse":
-            state["view"] = "groups"
-        text, markup = await build_tree_view(state)
-        await q.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+    group = await get_group(group_id) if group_id is not None else None
+    if action == "add" and not group:
+        # организацию удалили, пока кнопка висела в чате, или кнопка без неё вовсе
+        await q.answer("Организация не найдена")
         return
-
-    if action == "enter":
-        group_id = int(payload)
-        row = await get_group(group_id)
-        if not row:
+    if group_id is not None and not group:
+        if action == "enter":
             await q.answer("Организация не найдена")
             return
-        path: list[tuple[int, str]] = state.setdefault("path", [])
-        path.append((group_id, row["name"]))
-        if mode == "browse":
-            state["view"] = "groups"
-        text, markup = await build_tree_view(state)
+        group_id = None
+
+    if action in {"enter", "up", "tree"}:
+        text, markup = await build_tree_view(mode, group_id)
         await q.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
         return
 
+    if action == "search" and mode in SEARCH_MODES:
+        # ввод запроса — единственное место, где дереву нужна память о пользователе
+        context.user_data["awaiting"] = "tree_search"
+        context.user_data["tree"] = {"mode": mode, "group_id": group_id}
+        await q.edit_message_text(
+            "🔎 Отправьте часть имени. От трёх букв ищется любая часть, короче — начало имени.",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
+                "⬅️ Назад", callback_data=_tree_cb(mode, "exit") if mode == "find" else _tree_cb(mode, "tree", group_id)
+            )]])
+        )
+        return
+
     if mode == "browse" and action == "show":
-        state["view"] = payload
-        text, markup = await build_tree_view(state)
+        text, markup = await build_tree_view(mode, group_id, arg)
         await q.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
         return
 
     if mode == "reg_add_person" and action == "add":
-        group_id = int(payload)
-        row = await get_group(group_id)
-        if not row:
-            await q.answer("Организация не найдена")
-            return
         context.user_data["awaiting"] = "new_entity_name"
         context.user_data["kind"] = "person"
         context.user_data["add_action"] = "reg"
         context.user_data["group_id"] = group_id
         context.user_data.pop("tree", None)
         await q.edit_message_text(
-            f"Введите полное имя сотрудника для организации «{safe_md(row['name'])}».",
+            f"Введите полное имя сотрудника для организации «{safe_md(group['name'])}».",
             parse_mode=ParseMode.MARKDOWN
         )
         return
 
     if action == "select":
-        entity_id = int(payload)
+        try:
+            entity_id = int(arg, 36)
+        except ValueError:
+            entity_id = 0
         row = await get_entity_with_signature(entity_id)
         if not row:
             await q.answer("Запись не найдена")
             return
         context.user_data.pop("tree", None)
+        if mode == "find":
+            await show_entity_card(q, row)
+            return
         if mode == "sign_add_org":
             context.user_data["entity_id"] = entity_id
             context.user_data["entity_kind"] = "org"
@@ -710,7 +2316,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "• Веду реестр организаций и физлиц\n"
         "• Храню срок действия подписи + примечание\n"
         "• Показываю ближайшие истечения\n"
-        "• Напоминаю за 25/20/15/10/5 дней\n\n"
+        "• Напоминаю о скором окончании (когда и за сколько дней — /settings)\n\n"
         "Выберите действие кнопками ниже."
     )
     await update.message.reply_text(txt, reply_markup=main_menu_kbd())
@@ -724,20 +2330,20 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/update — изменить запись\n"
         "/delete — удалить запись подписи\n"
         "/registry_delete — удалить из реестра (и связанные записи)\n"
+        "/import — загрузить реестр и сроки из CSV/XLSX\n"
+        "/export — выгрузить реестр файлом (csv|jsonl, gz — сжать)\n"
+        "/find — найти запись по части имени\n"
+        "/history — история подписи: продления, прежние и архивные записи\n"
         "/all — список всех\n"
         "/next — ближайшие 10\n"
+        "/stats [неделя|месяц] [организация] — сколько подписей истекает по месяцам или неделям\n"
+        "/settings — напоминания в этом чате: за сколько дней, время, пояс, раздел реестра\n"
         "Подсказки работают кнопками после ввода первых букв.",
         reply_markup=main_menu_kbd()
     )
 
 # ---- INFO BLOCK ----
 
-def info_inline_kbd():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("Ближайшие 10", callback_data=CB_INFO_LAST10)],
-        [InlineKeyboardButton("Список всех", callback_data=CB_INFO_ALL)],
-    ])
-
 async def info_block(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_allowed(update.effective_user.id):
         return
@@ -751,82 +2357,347 @@ async def cb_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     if q.data == CB_INFO_LAST10:
-        txt = await build_last10_text()
+        txt, markup = await build_upcoming_page(10)
     else:
-        txt = await build_all_text()
-    await q.edit_message_text(txt, parse_mode=ParseMode.MARKDOWN)
+        txt, markup = await build_all_page()
+    await q.edit_message_text(txt, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+
+# ---- PAGINATION ----
+
+# Keyset-пагинация: курсор — id последней/первой строки на странице, по нему
+# читается ключ сортировки, и следующая страница ищется сравнением кортежей
+# по индексу. Сдвиг OFFSET не используется, память и время — на одну страницу.
+# Срок хранится строкой YYYY-MM-DD, поэтому сравниваем колонку напрямую:
+# обёртка date(s.expiry) не даёт планировщику использовать индекс.
+_PAGE_VIEWS = {
+    "all": {
+        "select": """
+            SELECT e.id AS cursor_id, e.id, e.name, e.kind, s.expiry, s.note
+            FROM entity e
+            LEFT JOIN signature s ON s.entity_id=e.id AND s.active=1
+        """,
+        "where": (),
+        "key": "(e.kind_order, e.name_key, e.id)",
+        "order": ("e.kind_order, e.name_key, e.id",
+                  "e.kind_order DESC, e.name_key DESC, e.id DESC"),
+        "cursor_sql": "SELECT kind_order, name_key, id FROM entity WHERE id=?",
+    },
+    "up": {
+        "select": """
+            SELECT s.entity_id AS cursor_id, e.id, e.name, e.kind, s.expiry, s.note
+            FROM signature s
+            JOIN entity e ON e.id = s.entity_id
+        """,
+        "where": ("s.active=1", "s.expiry >= ?"),
+        # у сущности не больше одной активной подписи — entity_id уникален
+        "key": "(s.expiry, s.entity_id)",
+        "order": ("s.expiry ASC, s.entity_id ASC", "s.expiry DESC, s.entity_id DESC"),
+        "cursor_sql": "SELECT expiry, entity_id FROM signature WHERE entity_id=? AND active=1",
+    },
+}
 
-async def build_last10_text() -> str:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        today = date.today().isoformat()
-        sql = """
-        SELECT e.id, e.name, e.kind, s.expiry, s.note
-        FROM signature s
-        JOIN entity e ON e.id = s.entity_id
-        WHERE s.active=1 AND date(s.expiry) >= date(?)
-        ORDER BY date(s.expiry) ASC
-        LIMIT 10;
-        """
-        async with db.execute(sql, (today,)) as cur:
-            rows = await cur.fetchall()
+def _page_sql(view: str, direction: str | None) -> str:
+    spec = _PAGE_VIEWS[view]
+    conds = list(spec["where"])
+    n_key = spec["key"].count(",") + 1
+    if direction == "n":
+        conds.append(f"{spec['key']} > ({','.join('?' * n_key)})")
+    elif direction == "p":
+        conds.append(f"{spec['key']} < ({','.join('?' * n_key)})")
+    where = f"WHERE {' AND '.join(conds)}" if conds else ""
+    order = spec["order"][1 if direction == "p" else 0]
+    return f"{spec['select']} {where} ORDER BY {order} LIMIT ?"
+
+SQL_UPCOMING = _page_sql("up", None)
+
+async def fetch_page(view: str, args: tuple, size: int, direction: str | None = None,
+                     cursor: int | None = None) -> tuple[list, bool, bool]:
+    """Одна страница: (строки, есть ли предыдущая, есть ли следующая)."""
+    async with db_read() as db:
+        key: tuple = ()
+        if direction and cursor is not None:
+            async with db.execute(_PAGE_VIEWS[view]["cursor_sql"], (cursor,)) as cur:
+                row = await cur.fetchone()
+            if row is None:  # курсор исчез (запись удалили) — с начала
+                direction = None
+            else:
+                key = tuple(row)
+        async with db.execute(_page_sql(view, direction), (*args, *key, size + 1)) as cur:
+            rows = list(await cur.fetchall())
+    more = len(rows) > size
+    rows = rows[:size]
+    if direction == "p":
+        rows.reverse()
+        return rows, more, True
+    return rows, direction == "n", more
+
+def _page_markup(view: str, size: int, rows, has_prev: bool, has_next: bool) -> InlineKeyboardMarkup | None:
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton(
+            "⬅️ Предыдущие", callback_data=f"{PAGE_CB_PREFIX}{view}|{size}|p|{rows[0]['cursor_id']}"
+        ))
+    if has_next:
+        buttons.append(InlineKeyboardButton(
+            "Следующие ➡️", callback_data=f"{PAGE_CB_PREFIX}{view}|{size}|n|{rows[-1]['cursor_id']}"
+        ))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+def _fit_page(title: str, rows, lines: list[str], direction: str | None,
+              has_prev: bool, has_next: bool):
+    """Обрезает страницу под лимит сообщения, сдвигая соответствующую границу."""
+    budget = TG_MESSAGE_LIMIT - len(title) - 1
+    order = range(len(lines) - 1, -1, -1) if direction == "p" else range(len(lines))
+    keep: list[int] = []
+    for i in order:
+        if len(lines[i]) + 1 > budget and keep:
+            if direction == "p":
+                has_prev = True
+            else:
+                has_next = True
+            break
+        budget -= len(lines[i]) + 1
+        keep.append(i)
+    keep.sort()
+    return [rows[i] for i in keep], [lines[i] for i in keep], has_prev, has_next
+
+def _fmt_registry_row(r) -> str:
+    if r["expiry"]:
+        return fmt_signature_row(r)
+    kind = "ЮЛ" if r["kind"] == "org" else "ФЛ"
+    return f"[{kind}] {r['name']} — подпись не заведена"
+
+@render_cached("all")
+async def build_all_page(direction: str | None = None, cursor: int | None = None,
+                         size: int = ALL_PAGE_SIZE) -> tuple[str, InlineKeyboardMarkup | None]:
+    rows, has_prev, has_next = await fetch_page("all", (), size, direction, cursor)
     if not rows:
-        return "Нет предстоящих окончаний."
-    lines = ["*Ближайшие 10:*"]
-    for r in rows:
-        lines.append(fmt_signature_row(r))
-    return "\n".join(lines)
+        return "Реестр пуст.", None
+    title = "*Список всех:* (сначала ЮЛ, потом ФЛ)"
+    rows, lines, has_prev, has_next = _fit_page(
+        title, rows, [_fmt_registry_row(r) for r in rows], direction, has_prev, has_next
+    )
+    return "\n".join([title] + lines), _page_markup("all", size, rows, has_prev, has_next)
 
-async def build_lastN_text(limit: int) -> str:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        today = date.today().isoformat()
-        sql = f"""
-        SELECT e.id, e.name, e.kind, s.expiry, s.note
-        FROM signature s
-        JOIN entity e ON e.id = s.entity_id
-        WHERE s.active=1 AND date(s.expiry) >= date(?)
-        ORDER BY date(s.expiry) ASC
-        LIMIT {limit};
-        """
-        async with db.execute(sql, (today,)) as cur:
-            rows = await cur.fetchall()
+@render_cached("up")
+async def build_upcoming_page(size: int, direction: str | None = None,
+                              cursor: int | None = None) -> tuple[str, InlineKeyboardMarkup | None]:
+    today = date.today().isoformat()
+    rows, has_prev, has_next = await fetch_page("up", (today,), size, direction, cursor)
     if not rows:
-        return "Нет предстоящих окончаний."
-    title = f"*Ближайшие {limit}:*"
-    lines = [title] + [fmt_signature_row(r) for r in rows]
-    return "\n".join(lines)
+        return "Нет предстоящих окончаний.", None
+    title = f"*Ближайшие {size}:*" if not has_prev else "*Ближайшие окончания (продолжение):*"
+    rows, lines, has_prev, has_next = _fit_page(
+        title, rows, [fmt_signature_row(r) for r in rows], direction, has_prev, has_next
+    )
+    return "\n".join([title] + lines), _page_markup("up", size, rows, has_prev, has_next)
+
+# ---- FORECAST ----
+
+FORECAST_WEEKS = 52
+FORECAST_MONTHS = 12
+FORECAST_BAR_WIDTH = 20
+FORECAST_STEPS = {"неделя": "week", "недели": "week", "нед": "week", "week": "week",
+                  "месяц": "month", "месяцы": "month", "мес": "month", "month": "month"}
+
+def _day_number(d: date) -> int:
+    """То же, что signature.expiry_day: целая часть julianday()."""
+    return d.toordinal() + 1721424
+
+def _forecast_sql(step: str, scoped: bool) -> str:
+    bucket = "(s.expiry_day - :today) / 7" if step == "week" else "strftime('%Y-%m', s.expiry)"
+    scope = """
+    JOIN entity e ON e.id=s.entity_id
+    JOIN grp_closure c ON c.descendant_id=e.group_id AND c.ancestor_id=:scope""" if scoped else ""
+    return f"""
+    SELECT {bucket} AS bucket, count(*) AS n
+    FROM signature s{scope}
+    WHERE s.active=1 AND s.expiry_day >= :today AND s.expiry_day < :until
+    GROUP BY bucket
+    """
+
+def _forecast_buckets(step: str, today: date) -> tuple[list[tuple[str, str]], date]:
+    """Корзины гистограммы [(ключ, подпись)] и первый день после последней."""
+    if step == "week":
+        buckets = [(str(i), (today + timedelta(weeks=i)).strftime("%d.%m")) for i in range(FORECAST_WEEKS)]
+        return buckets, today + timedelta(weeks=FORECAST_WEEKS)
+    buckets = []
+    year, month = today.year, today.month
+    for _ in range(FORECAST_MONTHS):
+        buckets.append((f"{year:04d}-{month:02d}", f"{month:02d}.{year:04d}"))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return buckets, date(year, month, 1)
+
+@render_cached("stats")
+async def build_forecast_view(step: str = "month", scope_group_id: int | None = None
+                              ) -> tuple[str, InlineKeyboardMarkup]:
+    today = date.today()
+    buckets, until = _forecast_buckets(step, today)
+    async with db_read() as db:
+        async with db.execute(
+            _forecast_sql(step, scope_group_id is not None),
+            {"today": _day_number(today), "until": _day_number(until), "scope": scope_group_id},
+        ) as cur:
+            counts = {str(r["bucket"]): r["n"] for r in await cur.fetchall()}
+        scope_name = None
+        if scope_group_id is not None:
+            async with db.execute("SELECT name FROM grp WHERE id=?", (scope_group_id,)) as cur:
+                row = await cur.fetchone()
+            scope_name = row["name"] if row else "?"
+
+    title = "*Прогноз окончаний подписей*"
+    if scope_name:
+        title += f" — {safe_md(scope_name)}"
+    period = f"по неделям, {FORECAST_WEEKS} нед." if step == "week" else f"по месяцам, {FORECAST_MONTHS} мес."
+    lines = [title, f"_{period} вперёд, всего {sum(counts.values())}_"]
+    peak = max(counts.values(), default=0)
+    if not peak:
+        lines.append("За этот период подписи не истекают.")
+    else:
+        width = max(len(label) for _, label in buckets)
+        bars = []
+        for key, label in buckets:
+            n = counts.get(key, 0)
+            bar = "█" * max(1, round(n * FORECAST_BAR_WIDTH / peak)) if n else ""
+            bars.append(f"{label:<{width}} {bar} {n}" if n else f"{label:<{width}} ·")
+        lines.append("```\n" + "\n".join(bars) + "\n```")
+
+    other = "month" if step == "week" else "week"
+    toggle = "📆 По месяцам" if other == "month" else "🗓 По неделям"
+    scope_arg = "" if scope_group_id is None else str(scope_group_id)
+    markup = InlineKeyboardMarkup([[
+        InlineKeyboardButton(toggle, callback_data=f"{CB_STATS_PREFIX}{other}:{scope_arg}")
+    ]])
+    return "\n".join(lines), markup
+
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await is_allowed(update.effective_user.id): return
+    args = list(context.args or [])
+    step = "month"
+    if args and args[0].casefold() in FORECAST_STEPS:
+        step = FORECAST_STEPS[args.pop(0).casefold()]
+    scope_group_id = None
+    if args:
+        try:
+            scope_group_id = (await resolve_scope_group(" ".join(args)))["id"]
+        except ValueError as e:
+            await update.message.reply_text(str(e))
+            return
+    txt, markup = await build_forecast_view(step, scope_group_id)
+    await update.message.reply_text(txt, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+
+async def cb_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+    step, _, scope_raw = q.data[len(CB_STATS_PREFIX):].partition(":")
+    if step not in ("week", "month"):
+        return
+    try:
+        scope_group_id = int(scope_raw) if scope_raw else None
+    except ValueError:
+        return
+    txt, markup = await build_forecast_view(step, scope_group_id)
+    await q.edit_message_text(txt, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+
+async def cb_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    try:
+        _, view, size_raw, direction, cursor_raw = q.data.split("|")
+        size = max(1, min(int(size_raw), 50))
+        cursor = int(cursor_raw)
+    except ValueError:
+        direction = None
+    if direction not in ("n", "p"):
+        # иначе _page_sql строит запрос без ключа курсора, и лишние параметры его роняют
+        await q.answer("Кнопка устарела, откройте раздел заново")
+        return
+    await q.answer()
+    if view == "up":
+        txt, markup = await build_upcoming_page(size, direction, cursor)
+    else:
+        txt, markup = await build_all_page(direction, cursor, size)
+    await q.edit_message_text(txt, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+
+def _reminders_sql(n_dates: int) -> str:
+    placeholders = ",".join("?" * n_dates)
+    return f"""
+    SELECT s.id, e.name, e.kind, s.expiry, s.note, g.name AS org
+    FROM signature s
+    JOIN entity e ON e.id=s.entity_id
+    LEFT JOIN grp g ON g.id=e.group_id
+    WHERE s.active=1 AND s.expiry IN ({placeholders})
+    ORDER BY s.expiry ASC, lower(e.name);
+    """
+
+# Недоставленные напоминания для пар (чат, до какого дня) одним запросом:
+# окно чата — от его reminded_until (не дальше REMIND_CATCHUP_DAYS назад) до
+# «до какого дня», смещения — свои из subscriber_offset или общие, а чат с
+# разделом видит только подписи его поддерева (по grp_closure)
+SQL_DUE_REMINDERS = """
+WITH due(chat_id, until_day) AS (
+    SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?)
+),
+win AS (
+    SELECT d.chat_id, d.until_day, st.scope_group_id AS scope_id,
+           min(d.until_day, max(date(d.until_day, ?),
+                                coalesce(date(sub.reminded_until, '+1 day'), d.until_day))) AS start_day
+    FROM due d JOIN subscriber sub ON sub.chat_id=d.chat_id
+    LEFT JOIN subscriber_settings st ON st.chat_id=d.chat_id
+),
+offs(chat_id, scope_id, offset_days, lo, hi) AS (
+    SELECT w.chat_id, w.scope_id, o.offset_days,
+           date(w.start_day, '+' || o.offset_days || ' days'), date(w.until_day, '+' || o.offset_days || ' days')
+    FROM win w JOIN subscriber_offset o ON o.chat_id=w.chat_id
+    UNION ALL
+    SELECT w.chat_id, w.scope_id, f.value,
+           date(w.start_day, '+' || f.value || ' days'), date(w.until_day, '+' || f.value || ' days')
+    FROM win w, json_each(?) f
+    WHERE NOT EXISTS (SELECT 1 FROM subscriber_offset o WHERE o.chat_id=w.chat_id)
+)
+SELECT offs.chat_id, offs.offset_days, s.id, e.name, e.kind, s.expiry, s.note, g.name AS org
+FROM offs
+-- без подсказки планировщик строит автоматический индекс по всем активным подписям
+JOIN signature s INDEXED BY idx_signature_active_expiry
+    ON s.active=1 AND s.expiry BETWEEN offs.lo AND offs.hi
+JOIN entity e ON e.id=s.entity_id
+LEFT JOIN grp g ON g.id=e.group_id
+WHERE (offs.scope_id IS NULL OR EXISTS (
+    SELECT 1 FROM grp_closure c WHERE c.ancestor_id=offs.scope_id AND c.descendant_id=e.group_id
+))
+AND NOT EXISTS (
+    SELECT 1 FROM reminder_log l
+    WHERE l.signature_id=s.id AND l.offset_days=offs.offset_days AND l.chat_id=offs.chat_id
+)
+ORDER BY s.expiry ASC, lower(e.name), s.id;
+"""
+
+def _reminder_dates(first: date, last: date, offsets: tuple[int, ...] | None = None) -> list[str]:
+    """Сроки подписей, у которых есть напоминание с датой в [first, last]."""
+    days = (last - first).days + 1
+    return sorted({(first + timedelta(days=d + o)).isoformat()
+                   for d in range(days) for o in offsets or REMIND_OFFSETS})
+
+def _reminder_events_sql(n_dates: int) -> str:
+    # только id и срок: для кучи событий больше ничего не нужно
+    return f"SELECT id, expiry FROM signature WHERE active=1 AND expiry IN ({','.join('?' * n_dates)})"
+
+async def build_lastN_text(limit: int) -> str:
+    return (await build_upcoming_page(limit))[0]
 
 async def build_all_text() -> str:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        sql = """
-        SELECT e.id, e.name, e.kind, s.expiry, s.note
-        FROM entity e
-        LEFT JOIN signature s ON s.entity_id=e.id AND s.active=1
-        ORDER BY CASE WHEN e.kind='org' THEN 0 ELSE 1 END, lower(e.name);
-        """
-        async with db.execute(sql) as cur:
-            rows = await cur.fetchall()
-    if not rows:
-        return "Реестр пуст."
-    lines = ["*Список всех:* (сначала ЮЛ, потом ФЛ)"]
-    for r in rows:
-        if r["expiry"]:
-            lines.append(fmt_signature_row(r))
-        else:
-            kind = "ЮЛ" if r["kind"] == "org" else "ФЛ"
-            lines.append(f"[{kind}] {r['name']} — подпись не заведена")
-    return "\n".join(lines)
+    """Первая страница списка всех (остальные — кнопками, см. build_all_page)."""
+    return (await build_all_page())[0]
 
 # Команды-ярлыки
 async def cmd_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_allowed(update.effective_user.id): return
-    await update.message.reply_text(await build_all_text(), parse_mode=ParseMode.MARKDOWN)
+    txt, markup = await build_all_page()
+    await update.message.reply_text(txt, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
 
 async def cmd_next(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_allowed(update.effective_user.id): return
-    await update.message.reply_text(await build_last10_text(), parse_mode=ParseMode.MARKDOWN)
+    txt, markup = await build_upcoming_page(10)
+    await update.message.reply_text(txt, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
 
 # ---- ADD / UPDATE / DELETE FLOWS ----
 
@@ -857,6 +2728,19 @@ async def regdel_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.clear()
     await tree_start(update, context, "reg_delete")
 
+async def find_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/find <часть имени> — найти запись в реестре."""
+    if not await is_allowed(update.effective_user.id): return
+    context.user_data.clear()
+    context.user_data["tree"] = {"mode": "find"}
+    context.user_data["awaiting"] = "tree_search"
+    query = " ".join(context.args or [])
+    if not query:
+        await update.message.reply_text("🔎 Отправьте часть имени для поиска.")
+        return
+    text, markup = await build_search_results("find", query)
+    await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+
 async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.user_data.get("awaiting"):
         return
@@ -876,14 +2760,12 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context.user_data.pop("menu", None)
             await _go_main(context, update.effective_chat.id)
             return
-        if text == BTN_INFO_LAST10:
-            await update.message.reply_text(await build_lastN_text(10), parse_mode=ParseMode.MARKDOWN)
-            return
-        if text == BTN_INFO_LAST30:
-            await update.message.reply_text(await build_lastN_text(30), parse_mode=ParseMode.MARKDOWN)
-            return
-        if text == BTN_INFO_ALL:
-            await update.message.reply_text(await build_all_text(), parse_mode=ParseMode.MARKDOWN)
+        if text in (BTN_INFO_LAST10, BTN_INFO_LAST30, BTN_INFO_ALL):
+            if text == BTN_INFO_ALL:
+                txt, markup = await build_all_page()
+            else:
+                txt, markup = await build_upcoming_page(10 if text == BTN_INFO_LAST10 else 30)
+            await update.message.reply_text(txt, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
             return
         return
 
@@ -986,6 +2868,11 @@ async def on_text_flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if msg == BTN_BACK:
         await _go_main(context, update.effective_chat.id)
         return
+    if ud.get("awaiting") == "tree_search" and msg in MENU_BTNS:
+        # кнопка меню вместо запроса — выходим из поиска, её обработает on_text
+        ud.pop("awaiting", None)
+        ud.pop("tree", None)
+        return
     if ud.get("awaiting") == "note" and msg in MENU_BTNS:
         await update.message.reply_text(
             "Сначала введите примечание текстом или нажмите «Пропустить».",
@@ -996,27 +2883,43 @@ async def on_text_flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not awaiting:
         return  # обычный текст ловит on_text
 
+    # --- Поиск по имени (из /find или из выбора в дереве) ---
+    if awaiting == "tree_search":
+        state = ud.get("tree") or {}
+        text, markup = await build_search_results(state.get("mode", "find"), msg, state.get("group_id"))
+        await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+        return
+
+    # --- Настройки напоминаний ---
+    if awaiting in SETTINGS_PROMPTS:
+        await settings_input(update, context, awaiting, msg)
+        return
+
     # --- Создание новой сущности в реестре ---
     if awaiting == "new_entity_name":
         name = msg
         kind = ud.get("kind", "org")
         group_id = ud.get("group_id")
-        async with aiosqlite.connect(DB_PATH) as db:
+        duplicate = False
+        async with db_write() as db:
             try:
                 if group_id is not None:
-                    await db.execute(
+                    cur = await db.execute(
                         "INSERT INTO entity(name, kind, group_id) VALUES (?,?,?)",
                         (name, kind, group_id)
                     )
                 else:
-                    await db.execute("INSERT INTO entity(name, kind) VALUES (?,?)", (name, kind))
+                    cur = await db.execute("INSERT INTO entity(name, kind) VALUES (?,?)", (name, kind))
                 await db.commit()
+                ud["entity_id"] = int(cur.lastrowid)
             except aiosqlite.IntegrityError:
-                await update.message.reply_text("Такая сущность уже есть в реестре.")
-                return
-            async with db.execute("SELECT id FROM entity WHERE name=?", (name,)) as cur:
-                row = await cur.fetchone()
-                ud["entity_id"] = int(row[0])
+                await db.rollback()
+                duplicate = True
+        if duplicate:
+            await update.message.reply_text("Такая сущность уже есть в реестре.")
+            return
+        ORG_CACHE.entity_added(ud["entity_id"], name, kind, group_id)
+        registry_changed()
 
         if ud.get("add_action") == "reg":
             ent_kind = "ЮЛ" if kind == "org" else "ФЛ"
@@ -1097,9 +3000,8 @@ async def finalize_save(update_or_cb, context: ContextTypes.DEFAULT_TYPE, note:
             await update_or_cb.edit_message_text("Не хватает данных для сохранения. Попробуйте заново /add.")
         return
 
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_write() as db:
         await upsert_signature(db, entity_id, expiry, note)
-        db.row_factory = aiosqlite.Row
         async with db.execute("SELECT name, kind FROM entity WHERE id=?", (entity_id,)) as cur:
             ent = await cur.fetchone()
 
@@ -1129,8 +3031,7 @@ async def finalize_save(update_or_cb, context: ContextTypes.DEFAULT_TYPE, note:
 # ---- DELETE SIGNATURE ----
 
 async def show_and_confirm_delete(cbq, entity_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with db_read() as db:
         async with db.execute("""
             SELECT e.id, e.name, e.kind, s.expiry, s.note
             FROM entity e LEFT JOIN signature s ON s.entity_id=e.id AND s.active=1
@@ -1152,18 +3053,119 @@ async def cb_del_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await q.answer()
     _, entity_id_str = q.data.split(":")
     eid = int(entity_id_str)
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE signature SET active=0, updated_at=datetime('now') WHERE entity_id=? AND active=1", (eid,))
+    async with db_write() as db:
+        async with db.execute(
+            "UPDATE signature SET active=0, updated_at=datetime('now') WHERE entity_id=? AND active=1 RETURNING id",
+            (eid,)
+        ) as cur:
+            removed = [r[0] for r in await cur.fetchall()]
         await db.commit()
+    registry_changed()
+    if REMINDERS is not None:
+        for sig_id in removed:
+            REMINDERS.signature_changed(sig_id, None)
     await q.edit_message_text("🗑️ Подпись удалена.", reply_markup=None)
     await _go_main(context, q.message.chat.id)
 
 
+# ---- REMINDER SETTINGS ----
+
+SETTINGS_PROMPTS = {
+    "settings_offsets": "За сколько дней до окончания напоминать? Числа через запятую, например 30, 14, 7, 0",
+    "settings_time": "Во сколько присылать напоминания? Время в виде ЧЧ:ММ, например 08:30",
+    "settings_tz": "Часовой пояс чата (IANA), например Europe/Riga или Asia/Almaty",
+    "settings_scope": "О какой ветке реестра напоминать? Название организации (можно часть) "
+                      "или «все» — весь реестр",
+}
+SCOPE_WHOLE_REGISTRY = {"все", "весь", "-"}
+
+async def resolve_scope_group(text: str) -> dict:
+    """Группа по названию или его части; неоднозначность — ValueError с вариантами."""
+    needle = text.strip().casefold()
+    async with db_read() as db:
+        async with db.execute("SELECT id, name FROM grp ORDER BY name") as cur:
+            groups = [dict(r) for r in await cur.fetchall()]
+    found = [g for g in groups if g["name"].casefold() == needle] or \
+        [g for g in groups if needle in g["name"].casefold()]
+    if not found:
+        raise ValueError("Такой организации нет. Введите название ещё раз или «все».")
+    if len(found) > 1:
+        names = "\n".join(f"• {g['name']}" for g in found[:10])
+        raise ValueError(f"Подходит несколько, уточните:\n{names}")
+    return found[0]
+
+async def build_settings_view(chat_id: int) -> tuple[str, InlineKeyboardMarkup]:
+    st = await get_subscriber_settings(chat_id)
+    mark = {k: "" if own else " _(по умолчанию)_" for k, own in st["own"].items()}
+    txt = (
+        "*Напоминания в этом чате*\n"
+        f"За сколько дней: {', '.join(map(str, st['offsets']))}{mark['offsets']}\n"
+        f"Время: {st['remind_at']}{mark['remind_at']}\n"
+        f"Часовой пояс: {safe_md(st['tz'])}{mark['tz']}\n"
+        f"Раздел: {safe_md(st['scope'][1]) + ' и вложенные' if st['scope'] else 'весь реестр'}"
+    )
+    kb = InlineKeyboardMarkup([
+        [InlineKeyboardButton("Дни", callback_data=f"{CB_SETTINGS_PREFIX}offsets"),
+         InlineKeyboardButton("Время", callback_data=f"{CB_SETTINGS_PREFIX}time"),
+         InlineKeyboardButton("Пояс", callback_data=f"{CB_SETTINGS_PREFIX}tz"),
+         InlineKeyboardButton("Раздел", callback_data=f"{CB_SETTINGS_PREFIX}scope")],
+        [InlineKeyboardButton("Сбросить", callback_data=f"{CB_SETTINGS_PREFIX}reset")],
+    ])
+    return txt, kb
+
+async def settings_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await is_allowed(update.effective_user.id): return
+    context.user_data.pop("awaiting", None)
+    txt, kb = await build_settings_view(update.effective_chat.id)
+    await update.message.reply_text(txt, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+
+async def cb_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+    field = q.data[len(CB_SETTINGS_PREFIX):]
+    chat_id = q.message.chat.id
+    if field == "reset":
+        await save_subscriber_settings(chat_id, reset=True)
+        txt, kb = await build_settings_view(chat_id)
+        await q.edit_message_text(txt, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+        return
+    awaiting = f"settings_{field}"
+    if awaiting not in SETTINGS_PROMPTS:
+        return
+    context.user_data["awaiting"] = awaiting
+    await context.bot.send_message(
+        chat_id, SETTINGS_PROMPTS[awaiting],
+        reply_markup=ReplyKeyboardMarkup([[KeyboardButton(BTN_BACK)]], resize_keyboard=True)
+    )
+
+async def settings_input(update: Update, context: ContextTypes.DEFAULT_TYPE, awaiting: str, msg: str):
+    chat_id = update.effective_chat.id
+    try:
+        if awaiting == "settings_offsets":
+            await save_subscriber_settings(chat_id, offsets=parse_offsets(msg))
+        elif awaiting == "settings_time":
+            await save_subscriber_settings(chat_id, remind_at=parse_remind_time(msg))
+        elif awaiting == "settings_scope":
+            if msg.casefold() in SCOPE_WHOLE_REGISTRY:
+                await save_subscriber_settings(chat_id, whole_registry=True)
+            else:
+                group = await resolve_scope_group(msg)
+                await save_subscriber_settings(chat_id, scope_group_id=group["id"])
+        else:
+            await save_subscriber_settings(chat_id, tz=parse_timezone(msg))
+    except ValueError as e:
+        await update.message.reply_text(str(e))
+        return
+    context.user_data.pop("awaiting", None)
+    txt, kb = await build_settings_view(chat_id)
+    await update.message.reply_text("✅ Сохранено.", reply_markup=main_menu_kbd())
+    await update.message.reply_text(txt, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+
+
 # ---- DELETE FROM REGISTRY ----
 
 async def show_and_confirm_regdelete(cbq, entity_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with db_read() as db:
         async with db.execute("SELECT id, name, kind FROM entity WHERE id=?", (entity_id,)) as cur:
             e = await cur.fetchone()
     if not e:
@@ -1182,14 +3184,656 @@ async def cb_regdel_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await q.answer()
     _, entity_id_str = q.data.split(":")
     eid = int(entity_id_str)
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("PRAGMA foreign_keys = ON;")
-        await db.execute("DELETE FROM entity WHERE id=?", (eid,))
+    async with db_write() as db:
+        async with db.execute(
+            "DELETE FROM entity WHERE id=? RETURNING kind, group_id", (eid,)
+        ) as cur:
+            removed = await cur.fetchone()
+        next_legal = None
+        if removed and removed["kind"] == "org" and removed["group_id"] is not None:
+            async with db.execute(
+                "SELECT id, name FROM entity WHERE group_id=? AND kind='org' ORDER BY id",
+                (removed["group_id"],)
+            ) as cur:
+                next_legal = await cur.fetchone()
         await db.commit()
+    if removed:
+        ORG_CACHE.entity_removed(eid, removed["kind"], removed["group_id"], next_legal)
+        registry_changed()
+        # события удалённых каскадом подписей остаются в куче планировщика,
+        # но send_due_reminders читает только живые подписи
     await q.edit_message_text("🗑️ Удалено из реестра вместе со связанными записями.")
     await _go_main(context, q.message.chat.id)
 
 
+# ---- IMPORT ----
+
+# Колонки файла импорта и допустимые заголовки (регистр не важен)
+IMPORT_COLUMNS = {
+    "section": ("section", "раздел"),
+    "group": ("group", "группа", "организация"),
+    "name": ("name", "имя", "фио", "наименование"),
+    "kind": ("kind", "тип"),
+    "expiry": ("expiry", "срок", "дата окончания"),
+    "note": ("note", "примечание"),
+}
+
+IMPORT_KINDS = {
+    "org": "org", "юл": "org", "юр. лицо": "org",
+    "person": "person", "фл": "person", "физ. лицо": "person",
+}
+
+_XLSX_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_XLSX_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_EXCEL_EPOCH = date(1899, 12, 30)
+# серийные номера больше — уже не даты (100000 — это 2173 год)
+_EXCEL_SERIAL_MAX = 100_000
+
+
+def _read_csv(data: bytes) -> list[tuple[int, list[str]]]:
+    import csv
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        # Excel под Windows по умолчанию сохраняет CSV в cp1251
+        text = data.decode("cp1251")
+    first = text.split("\n", 1)[0]
+    delimiter = max(";,\t", key=first.count)
+    reader = csv.reader(io.StringIO(text, newline=""), delimiter=delimiter)
+    return [(line, cells) for line, cells in enumerate(reader, start=1)]
+
+
+def _xlsx_column(ref: str) -> int:
+    idx = 0
+    for ch in ref:
+        if not ch.isalpha():
+            break
+        idx = idx * 26 + ord(ch.upper()) - ord("A") + 1
+    return idx - 1
+
+
+def _xlsx_first_sheet(zf: "zipfile.ZipFile") -> str:
+    from xml.etree import ElementTree as ET
+    try:
+        wb = ET.fromstring(zf.read("xl/workbook.xml"))
+        rid = next(wb.iter(f"{_XLSX_NS}sheet")).get(f"{_XLSX_REL_NS}id")
+        rels = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+        for rel in rels:
+            if rel.get("Id") == rid:
+                target = rel.get("Target").lstrip("/")
+                return target if target.startswith("xl/") else f"xl/{target}"
+    except (KeyError, StopIteration):
+        pass
+    return "xl/worksheets/sheet1.xml"
+
+
+class _XlsxNumber(str):
+    """Значение числовой ячейки XLSX: срок в ней — серийный номер Excel."""
+    __slots__ = ()
+
+
+def _read_xlsx(data: bytes) -> list[tuple[int, list[str]]]:
+    """Первый лист книги без сторонних библиотек: zip + потоковый разбор XML."""
+    # XML-парсер и zip нужны только импорту — не грузим их при старте бота
+    import zipfile
+    from xml.etree import ElementTree as ET
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        shared: list[str] = []
+        if "xl/sharedStrings.xml" in zf.namelist():
+            root = ET.fromstring(zf.read("xl/sharedStrings.xml"))
+            for si in root.iter(f"{_XLSX_NS}si"):
+                shared.append("".join(t.text or "" for t in si.iter(f"{_XLSX_NS}t")))
+        rows = []
+        with zf.open(_xlsx_first_sheet(zf)) as sheet:
+            for _, el in ET.iterparse(sheet):
+                if el.tag != f"{_XLSX_NS}row":
+                    continue
+                cells: list[str] = []
+                for c in el.iter(f"{_XLSX_NS}c"):
+                    ref = c.get("r")
+                    idx = _xlsx_column(ref) if ref else len(cells)
+                    if c.get("t") == "inlineStr":
+                        value = "".join(t.text or "" for t in c.iter(f"{_XLSX_NS}t"))
+                    else:
+                        v = c.find(f"{_XLSX_NS}v")
+                        value = (v.text or "") if v is not None else ""
+                        if c.get("t") == "s" and value:
+                            value = shared[int(value)]
+                        elif c.get("t") in (None, "n") and value:
+                            value = _XlsxNumber(value)
+                    cells.extend([""] * (idx - len(cells)))
+                    cells.append(value)
+                rows.append((int(el.get("r") or len(rows) + 1), cells))
+                el.clear()
+        return rows
+
+
+def read_import_table(filename: str, data: bytes) -> list[tuple[int, list[str]]]:
+    """Строки файла с номерами (как их видит пользователь), включая заголовок."""
+    import csv
+    import zipfile
+    try:
+        if filename.lower().endswith(".xlsx"):
+            return _read_xlsx(data)
+        return _read_csv(data)
+    # ElementTree.ParseError — подкласс SyntaxError
+    except (zipfile.BadZipFile, SyntaxError, csv.Error, UnicodeDecodeError) as e:
+        raise ValueError(f"Не удалось прочитать файл: {e}")
+
+
+def _import_header(cells: list[str]) -> dict[str, int]:
+    header = [c.strip().lower() for c in cells]
+    columns = {}
+    for key, aliases in IMPORT_COLUMNS.items():
+        for i, title in enumerate(header):
+            if title in aliases:
+                columns[key] = i
+                break
+    if "name" not in columns:
+        raise ValueError(
+            "В первой строке нет колонки с именем. Ожидаются заголовки: "
+            "группа, имя, тип, срок, примечание."
+        )
+    return columns
+
+
+def _import_date(value: str) -> date:
+    # даты из XLSX приходят серийными номерами Excel — только в числовых ячейках;
+    # цифры в CSV (20260115) разбирает parse_date
+    if isinstance(value, _XlsxNumber):
+        serial = float(value)
+        if not 0 < serial < _EXCEL_SERIAL_MAX:
+            raise ValueError(value)
+        return _EXCEL_EPOCH + timedelta(days=int(serial))
+    return parse_date(value)
+
+
+def _resolve_group_path(path: str, groups: dict[str, dict], by_id: dict[int, dict]) -> int:
+    parts = [p.strip() for p in path.split("/") if p.strip()]
+    leaf = groups.get(parts[-1])
+    if leaf is None:
+        raise ValueError(f"неизвестная группа «{parts[-1]}»")
+    # имена групп уникальны, остальная часть пути только проверяется
+    node = leaf
+    for name in reversed(parts[:-1]):
+        node = by_id.get(node["parent_id"])
+        if node is None or node["name"] != name:
+            raise ValueError(f"группа «{parts[-1]}» не входит в «{name}»")
+    return leaf["id"]
+
+
+def validate_import_rows(table: list[tuple[int, list[str]]], groups) -> tuple[list[tuple], list[tuple[int, str]]]:
+    """Проверяет все строки сразу.
+
+    Возвращает строки для записи (name, kind, group_id, expiry, note) и
+    ошибки в виде (номер строки, текст). Пустой тип — None: у новой
+    сущности он станет ФЛ, у существующей останется прежним.
+    """
+    if not table:
+        raise ValueError("Файл пуст.")
+    columns = _import_header(table[0][1])
+    if len(table) - 1 > IMPORT_MAX_ROWS:
+        raise ValueError(f"Слишком много строк: {len(table) - 1}, допустимо {IMPORT_MAX_ROWS}.")
+    by_name = {g["name"]: g for g in groups}
+    by_id = {g["id"]: g for g in groups}
+
+    def cell(cells: list[str], key: str) -> str:
+        i = columns.get(key)
+        if i is None or i >= len(cells):
+            return ""
+        # strip() вернул бы str и потерял пометку _XlsxNumber
+        return cells[i] if isinstance(cells[i], _XlsxNumber) else cells[i].strip()
+
+    valid: list[tuple] = []
+    errors: list[tuple[int, str]] = []
+    seen: dict[str, int] = {}
+    for line, cells in table[1:]:
+        if not any(c.strip() for c in cells):
+            continue
+        # в файле выгрузки (/export) группы и история идут отдельными разделами
+        if cell(cells, "section") not in ("", "entity"):
+            continue
+        name = cell(cells, "name")
+        if not name:
+            errors.append((line, "не указано имя"))
+            continue
+        if name in seen:
+            errors.append((line, f"«{name}» уже встречалось в строке {seen[name]}"))
+            continue
+        seen[name] = line
+        try:
+            raw_kind = cell(cells, "kind").lower()
+            kind = IMPORT_KINDS.get(raw_kind) if raw_kind else None
+            if raw_kind and kind is None:
+                raise ValueError(f"неизвестный тип «{raw_kind}» (ожидается ЮЛ или ФЛ)")
+            path = cell(cells, "group")
+            group_id = _resolve_group_path(path, by_name, by_id) if path else None
+            raw_expiry = cell(cells, "expiry")
+            try:
+                expiry = _import_date(raw_expiry).isoformat() if raw_expiry else None
+            except (ValueError, OverflowError):
+                raise ValueError(f"неверная дата «{raw_expiry}»")
+        except ValueError as e:
+            errors.append((line, str(e)))
+            continue
+        valid.append((name, kind, group_id, expiry, cell(cells, "note") or None))
+    return valid, errors
+
+
+async def apply_import(db, rows: list[tuple]) -> dict[str, int]:
+    """Записывает проверенные строки: реестр и активные подписи.
+
+    Строки заливаются одной executemany во временную таблицу, дальше всё
+    делается set-based запросами. Транзакцией управляет вызывающий.
+    """
+    await db.execute("""
+    CREATE TEMP TABLE IF NOT EXISTS import_row (
+        name TEXT PRIMARY KEY,
+        kind TEXT,
+        group_id INTEGER,
+        expiry TEXT,
+        note TEXT
+    )""")
+    await db.execute("DELETE FROM temp.import_row")
+    await db.executemany("INSERT INTO temp.import_row VALUES (?,?,?,?,?)", rows)
+    # построчные триггеры счётчиков групп и reminders_generation молчат до конца транзакции
+    await db.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('grp_stats_bulk', '1')")
+    async with db.execute(
+        "SELECT count(*) FROM temp.import_row i JOIN entity e ON e.name = i.name"
+    ) as cur:
+        existing = (await cur.fetchone())[0]
+    await db.execute("""
+        INSERT INTO entity(name, kind, group_id)
+        SELECT name, coalesce(kind, 'person'), group_id FROM temp.import_row WHERE true
+        ON CONFLICT(name) DO UPDATE SET
+            -- excluded.kind уже с подставленным ФЛ: пустой тип берём из исходной строки
+            kind = coalesce((SELECT i.kind FROM temp.import_row i WHERE i.name = excluded.name), entity.kind),
+            group_id = coalesce(excluded.group_id, entity.group_id)
+    """)
+    # как и upsert_signature: новый срок — новые напоминания
+    await db.execute("""
+        DELETE FROM reminder_log WHERE signature_id IN (
+            SELECT s.id FROM temp.import_row i
+            JOIN entity e ON e.name = i.name
+            JOIN signature s ON s.entity_id = e.id AND s.active = 1
+            WHERE i.expiry IS NOT NULL
+        )
+    """)
+    cur = await db.execute("""
+        UPDATE signature SET expiry = i.expiry, note = i.note, updated_at = datetime('now')
+        FROM temp.import_row i JOIN entity e ON e.name = i.name
+        WHERE signature.entity_id = e.id AND signature.active = 1 AND i.expiry IS NOT NULL
+    """)
+    updated = cur.rowcount
+    cur = await db.execute("""
+        INSERT INTO signature(entity_id, expiry, note, active)
+        SELECT e.id, i.expiry, i.note, 1 FROM temp.import_row i
+        JOIN entity e ON e.name = i.name
+        WHERE i.expiry IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM signature s WHERE s.entity_id = e.id AND s.active = 1
+        )
+    """)
+    added = cur.rowcount
+    await db.execute("DELETE FROM meta WHERE key='grp_stats_bulk'")
+    await rebuild_grp_stats(db)
+    await db.execute(_REMINDERS_BUMP)
+    await db.execute("DELETE FROM temp.import_row")
+    return {
+        "rows": len(rows),
+        "created": len(rows) - existing,
+        "updated": existing,
+        "signatures_added": added,
+        "signatures_updated": updated,
+    }
+
+
+async def import_registry(table: list[tuple[int, list[str]]]) -> tuple[dict[str, int] | None, list[tuple[int, str]]]:
+    """Всё или ничего: при любой ошибке в файле база не меняется."""
+    async with db_read() as db:
+        async with db.execute("SELECT id, name, parent_id FROM grp") as cur:
+            groups = [dict(r) for r in await cur.fetchall()]
+    valid, errors = validate_import_rows(table, groups)
+    if errors:
+        return None, errors
+    async with db_write() as db:
+        stats = await apply_import(db, valid)
+    registry_changed()
+    if ORG_CACHE.loaded:
+        # массовая запись — проще перечитать иерархию, чем патчить кэш построчно
+        await ORG_CACHE.load()
+    if REMINDERS is not None:
+        await REMINDERS.reload(catch_up=False)
+    return stats, []
+
+
+def build_import_report(stats: dict[str, int] | None, errors: list[tuple[int, str]]) -> list[str]:
+    if errors:
+        lines = [f"❌ Импорт не выполнен, ошибок: {len(errors)}. Исправьте файл и пришлите его снова."]
+        lines += [f"Строка {line}: {msg}" for line, msg in errors[:IMPORT_REPORT_ERRORS]]
+        if len(errors) > IMPORT_REPORT_ERRORS:
+            lines.append(f"… и ещё {len(errors) - IMPORT_REPORT_ERRORS}")
+        return _split_message(lines)
+    return [
+        f"✅ Импортировано строк: {stats['rows']}\n"
+        f"Новых в реестре: {stats['created']}, обновлено: {stats['updated']}\n"
+        f"Подписей добавлено: {stats['signatures_added']}, изменено: {stats['signatures_updated']}"
+    ]
+
+
+async def import_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await is_allowed(update.effective_user.id): return
+    context.user_data.clear()
+    context.user_data["awaiting"] = "import_file"
+    await update.message.reply_text(
+        "Пришлите файл CSV или XLSX. Первая строка — заголовки:\n"
+        "группа; имя; тип; срок; примечание\n\n"
+        "• группа — путь через «/», например «Управление культуры / РЦНТ»\n"
+        "• тип — ЮЛ или ФЛ (по умолчанию ФЛ)\n"
+        "• срок — 31.12.2025 или 2025-12-31; пусто — только реестр\n"
+        "Ошибки проверяются до записи: если они есть, база не меняется.",
+        reply_markup=ReplyKeyboardMarkup([[KeyboardButton(BTN_BACK)]], resize_keyboard=True)
+    )
+
+
+async def on_import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await is_allowed(update.effective_user.id): return
+    caption = (update.message.caption or "").strip()
+    if context.user_data.get("awaiting") != "import_file" and not caption.startswith("/import"):
+        return
+    doc = update.message.document
+    tg_file = await context.bot.get_file(doc.file_id)
+    data = bytes(await tg_file.download_as_bytearray())
+    await update.message.reply_text("⏳ Проверяю файл…")
+    try:
+        table = await asyncio.to_thread(read_import_table, doc.file_name or "", data)
+        stats, errors = await import_registry(table)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+    for chunk in build_import_report(stats, errors):
+        await update.message.reply_text(chunk)
+    if not errors:
+        await _go_main(context, update.effective_chat.id)
+
+
+# ---- HISTORY ----
+
+HISTORY_EVENTS = {"created": "заведена", "renewed": "изменена", "deleted": "снята"}
+
+def _fmt_day(iso: str) -> str:
+    return date.fromisoformat(iso[:10]).strftime("%d.%m.%Y")
+
+@render_cached("history")
+async def build_history_text(entity_id: int) -> str:
+    """Журнал изменений подписи сущности и её прежние подписи, включая архив."""
+    async with db_read() as db:
+        async with db.execute("SELECT name, kind FROM entity WHERE id=?", (entity_id,)) as cur:
+            entity = await cur.fetchone()
+        if entity is None:
+            return "Запись не найдена."
+        async with db.execute(
+            """
+            SELECT event, expiry, note, recorded_at FROM signature_history
+            WHERE entity_id=? ORDER BY id DESC LIMIT ?
+            """,
+            (entity_id, HISTORY_LIMIT)
+        ) as cur:
+            events = await cur.fetchall()
+        # архив читается только здесь — по индексу на entity_id
+        async with db.execute(
+            """
+            SELECT expiry, note, updated_at FROM signature WHERE entity_id=? AND active=0
+            UNION ALL
+            SELECT expiry, note, updated_at FROM signature_archive WHERE entity_id=?
+            ORDER BY updated_at DESC
+            """,
+            (entity_id, entity_id)
+        ) as cur:
+            past = await cur.fetchall()
+
+    kind = "ЮЛ" if entity["kind"] == "org" else "ФЛ"
+    lines = [f"*История подписи:* [{kind}] {safe_md(entity['name'])}"]
+    if not events and not past:
+        lines.append("Изменений не было.")
+    if events:
+        lines.append("")
+        lines.append(f"*Изменения* (последние {HISTORY_LIMIT}):" if len(events) == HISTORY_LIMIT else "*Изменения:*")
+        for r in events:
+            line = f"{_fmt_day(r['recorded_at'])} — {HISTORY_EVENTS[r['event']]}, срок до {_fmt_day(r['expiry'])}"
+            if r["note"]:
+                line += f" ({safe_md(r['note'])})"
+            lines.append(line)
+    if past:
+        lines.append("")
+        lines.append("*Прежние подписи:*")
+        for r in past:
+            line = f"до {_fmt_day(r['expiry'])}, снята {_fmt_day(r['updated_at'])}"
+            if r["note"]:
+                line += f" ({safe_md(r['note'])})"
+            lines.append(line)
+    return "\n".join(lines)
+
+async def history_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/history <имя> — журнал подписи и архив прежних подписей."""
+    if not await is_allowed(update.effective_user.id): return
+    query = " ".join(context.args or [])
+    if not query:
+        await update.message.reply_text("Укажите имя: /history <часть имени>")
+        return
+    rows = await search_entities(query)
+    exact = [r for r in rows if r["name"].casefold() == query.casefold()]
+    if exact:
+        rows = exact
+    if not rows:
+        await update.message.reply_text("Ничего не найдено.")
+        return
+    if len(rows) > 1:
+        names = "\n".join(f"• {r['name']}" for r in rows)
+        await update.message.reply_text(f"Подходит несколько записей, уточните имя:\n{names}")
+        return
+    await update.message.reply_text(await build_history_text(rows[0]["id"]), parse_mode=ParseMode.MARKDOWN)
+
+
+# ---- EXPORT ----
+
+EXPORT_FIELDS = ("section", "group", "name", "kind", "expiry", "note", "active", "created_at", "updated_at")
+# заголовки CSV совпадают с IMPORT_COLUMNS — выгрузку можно загрузить обратно
+EXPORT_CSV_HEADER = ("раздел", "группа", "имя", "тип", "срок", "примечание", "активна", "создана", "изменена")
+# строк за один проход в поток aiosqlite
+EXPORT_CHUNK = 500
+
+
+def _group_paths(groups) -> dict[int, str]:
+    by_id = {g["id"]: g for g in groups}
+    paths: dict[int, str] = {}
+
+    def path(gid: int) -> str:
+        if gid not in paths:
+            g = by_id[gid]
+            parent = g["parent_id"]
+            prefix = path(parent) + " / " if parent in by_id else ""
+            paths[gid] = prefix + g["name"]
+        return paths[gid]
+
+    for gid in by_id:
+        path(gid)
+    return paths
+
+
+async def iter_export_records(db):
+    """Построчно отдаёт группы, реестр с активными подписями и историю (с архивом).
+
+    Читается курсором порциями по EXPORT_CHUNK, в памяти — только пути групп.
+    """
+    async with db.execute("SELECT id, name, parent_id FROM grp") as cur:
+        paths = _group_paths(await cur.fetchall())
+    for path in sorted(paths.values()):
+        yield {"section": "group", "group": path}
+
+    async with db.execute("""
+        SELECT e.name, e.kind, e.group_id, s.expiry, s.note, s.active, s.created_at, s.updated_at
+        FROM entity e
+        LEFT JOIN signature s ON s.entity_id = e.id AND s.active = 1
+        ORDER BY e.id
+    """) as cur:
+        cur.iter_chunk_size = EXPORT_CHUNK
+        async for r in cur:
+            yield {"section": "entity", "group": paths.get(r["group_id"]), **_export_tail(r)}
+
+    # снятые подписи: ещё в основной таблице и уже в архиве
+    async with db.execute("""
+        SELECT e.name, e.kind, e.group_id, h.expiry, h.note, 0 AS active, h.created_at, h.updated_at
+        FROM (
+            SELECT id, entity_id, expiry, note, created_at, updated_at FROM signature WHERE active = 0
+            UNION ALL
+            SELECT id, entity_id, expiry, note, created_at, updated_at FROM signature_archive
+        ) h
+        JOIN entity e ON e.id = h.entity_id
+        ORDER BY h.id
+    """) as cur:
+        cur.iter_chunk_size = EXPORT_CHUNK
+        async for r in cur:
+            yield {"section": "history", "group": paths.get(r["group_id"]), **_export_tail(r)}
+
+
+def _export_tail(r) -> dict:
+    return {
+        "name": r["name"], "kind": r["kind"], "expiry": r["expiry"], "note": r["note"],
+        "active": r["active"], "created_at": r["created_at"], "updated_at": r["updated_at"],
+    }
+
+
+async def export_registry(path: str, fmt: str = "csv", compress: bool = False) -> dict[str, int]:
+    """Пишет выгрузку в файл path и возвращает число записей по разделам.
+
+    Все запросы идут в одной читающей транзакции — снимок согласован,
+    даже если параллельно кто-то пишет.
+    """
+    import csv
+    import gzip
+    opener = gzip.open if compress else open
+    counts = {"group": 0, "entity": 0, "history": 0}
+    with opener(path, "wt", encoding="utf-8", newline="") as out:
+        writer = None
+        if fmt == "csv":
+            writer = csv.writer(out, delimiter=";")
+            writer.writerow(EXPORT_CSV_HEADER)
+        async with db_read() as db:
+            await db.execute("BEGIN")
+            try:
+                async for rec in iter_export_records(db):
+                    counts[rec["section"]] += 1
+                    if writer is not None:
+                        writer.writerow(["" if rec.get(f) is None else rec.get(f) for f in EXPORT_FIELDS])
+                    else:
+                        out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            finally:
+                await db.rollback()
+    return counts
+
+
+async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/export [csv|jsonl] [gz] — выгрузка всего реестра файлом."""
+    if not await is_allowed(update.effective_user.id): return
+    args = [a.lower() for a in (context.args or [])]
+    fmt = "jsonl" if "jsonl" in args else "csv"
+    compress = "gz" in args or "gzip" in args
+    filename = f"edsbot-{date.today().isoformat()}.{fmt}" + (".gz" if compress else "")
+    await update.message.reply_text("⏳ Готовлю выгрузку…")
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, filename)
+        counts = await export_registry(path, fmt, compress)
+        with open(path, "rb") as fh:
+            await context.bot.send_document(
+                update.effective_chat.id, document=fh, filename=filename,
+                caption=(f"Групп: {counts['group']}, в реестре: {counts['entity']}, "
+                         f"в истории: {counts['history']}")
+            )
+
+
+# ---- INLINE MODE ----
+
+class TtlCache:
+    """Небольшой LRU с временем жизни записей; clear() — при любой записи в реестр."""
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = max(1, maxsize)
+        self._items: OrderedDict[str, tuple[float, object]] = OrderedDict()
+
+    def get(self, key: str):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires < time.monotonic():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def put(self, key: str, value):
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
+
+
+INLINE_CACHE = TtlCache(INLINE_CACHE_TTL, INLINE_CACHE_SIZE)
+
+
+def _inline_key(text: str) -> str:
+    return " ".join(text.casefold().split())
+
+
+def _inline_result(r) -> InlineQueryResultArticle:
+    kind = "ЮЛ" if r["kind"] == "org" else "ФЛ"
+    if r["expiry"]:
+        exp_d = date.fromisoformat(r["expiry"])
+        days = (exp_d - date.today()).days
+        status = "истекла" if days < 0 else ("сегодня" if days == 0 else f"через {days} дн.")
+        description = f"до {exp_d.strftime('%d.%m.%Y')} — {status}"
+        text = fmt_signature_row(r)
+    else:
+        description = "подпись не заведена"
+        text = f"[{kind}] {safe_md(r['name'])} — подпись не заведена"
+    return InlineQueryResultArticle(
+        id=str(r["id"]),
+        title=f"[{kind}] {r['name']}",
+        description=description,
+        input_message_content=InputTextMessageContent(text, parse_mode=ParseMode.MARKDOWN),
+    )
+
+
+async def inline_results(text: str) -> list[InlineQueryResultArticle]:
+    """Результаты для запроса (пустой — ближайшие истечения), через INLINE_CACHE."""
+    key = _inline_key(text)
+    cached = INLINE_CACHE.get(key)
+    if cached is not None:
+        return cached
+    if key:
+        rows = await search_entities(key)
+    else:
+        rows, _, _ = await fetch_page("up", (date.today().isoformat(),), SEARCH_LIMIT)
+    results = [_inline_result(r) for r in rows]
+    INLINE_CACHE.put(key, results)
+    return results
+
+
+async def on_inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    iq = update.inline_query
+    # строго по списку: без ADMIN_IDS инлайн-режим никому не отвечает
+    if iq.from_user.id not in ADMIN_IDS:
+        await iq.answer([], cache_time=INLINE_CACHE_TIME, is_personal=True)
+        return
+    results = await inline_results(iq.query)
+    await iq.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True)
+
+
 # ---- CALLBACK ROUTER ----
 
 async def cb_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1198,12 +3842,16 @@ async def cb_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
     data = q.data or ""
     if data.startswith("info:"):
         await cb_info(update, context); return
-    if data.startswith(TREE_CB_PREFIX):
-        parts = data.split("|", 3)
-        while len(parts) < 4:
-            parts.append("_")
-        _, mode, action, payload = parts
-        await tree_handle_callback(update, context, mode, action, payload)
+    if data.startswith(PAGE_CB_PREFIX):
+        await cb_page(update, context); return
+    if data.startswith((TREE_TOKEN_PREFIX, TREE_CB_PREFIX)):
+        parsed = parse_tree_callback(data, context.user_data)
+        if parsed is None:
+            await q.answer("Кнопка устарела, откройте раздел заново")
+            return
+        mode, action, group_id, arg = parsed
+        with METRICS.timer("edsbot_tree_action_seconds", mode=mode, action=action):
+            await tree_handle_callback(update, context, mode, action, group_id, arg)
         return
     if data.startswith(CB_DEL_CONFIRM):
         await cb_del_confirm(update, context); return
@@ -1211,66 +3859,992 @@ async def cb_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await cb_regdel_confirm(update, context); return
     if data in (CB_ADD_SKIP_NOTE, CB_UPD_SKIP_NOTE):
         await cb_skip_note(update, context); return
+    if data.startswith(CB_SETTINGS_PREFIX):
+        await cb_settings(update, context); return
+    if data.startswith(CB_STATS_PREFIX):
+        await cb_stats(update, context); return
     if data == "noop":
         await q.answer("Отменено")
         return
 
+# ---- OUTBOX ----
+
+_MARKUP_TYPES = {
+    "reply": (ReplyKeyboardMarkup, "keyboard", KeyboardButton),
+    "inline": (InlineKeyboardMarkup, "inline_keyboard", InlineKeyboardButton),
+}
+
+def _markup_to_json(markup) -> str | None:
+    if markup is None:
+        return None
+    kind = "inline" if isinstance(markup, InlineKeyboardMarkup) else "reply"
+    return json.dumps({"type": kind, "data": markup.to_dict()}, ensure_ascii=False)
+
+def _markup_from_json(raw: str | None, bot=None):
+    if not raw:
+        return None
+    payload = json.loads(raw)
+    cls, field, button_cls = _MARKUP_TYPES[payload["type"]]
+    data = payload["data"]
+    rows = [[button_cls.de_json(b, bot) for b in row] for row in data.pop(field)]
+    return cls(rows, **data)
+
+async def outbox_enqueue(db, chat_id: int, text: str, parse_mode: str | None = None,
+                         reply_markup=None):
+    """Кладёт сообщение в outbox в рамках транзакции вызывающего."""
+    await db.execute(
+        "INSERT INTO outbox(chat_id, text, parse_mode, reply_markup, next_at, bot_id) VALUES (?,?,?,?,?,?)",
+        (chat_id, text, parse_mode, _markup_to_json(reply_markup), time.time(), _outbox_bot_id())
+    )
+
+async def outbox_enqueue_many(db, messages: list[tuple[int, str, str | None]]):
+    now, bot_id = time.time(), _outbox_bot_id()
+    await db.executemany(
+        "INSERT INTO outbox(chat_id, text, parse_mode, next_at, bot_id) VALUES (?,?,?,?,?)",
+        [(chat_id, text, parse_mode, now, bot_id) for chat_id, text, parse_mode in messages]
+    )
+
+def _outbox_bot_id() -> int | None:
+    # без запущенного отправителя строку подберёт первый стартовавший (см. start)
+    return OUTBOX.bot_id if OUTBOX is not None else None
+
+def _token_bot_id(bot) -> int | None:
+    """id бота из токена «<id>:<secret>» — без запроса getMe."""
+    head = str(getattr(bot, "token", "") or "").partition(":")[0]
+    return int(head) if head.isdigit() else None
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, запас capacity."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._stamp: float | None = None
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            if self._stamp is not None:
+                self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class OutboxSender:
+    """Фоновая отправка сообщений из таблицы outbox.
+
+    Общий лимит — token bucket (~30 сообщений/с), на каждый чат — не чаще
+    per_chat_rate в секунду, одновременно — не больше concurrency запросов.
+    RetryAfter переносит сообщение на указанное время, сетевые ошибки —
+    на экспоненциальную паузу; после max_attempts попыток строка
+    остаётся в outbox со статусом failed.
+
+    Строки помечены bot_id: процессы с одной базой, но разными токенами
+    отправляют только своё. Взятая строка «арендована» до next_at
+    (OUTBOX_CLAIM_TTL), поэтому старт второго процесса с тем же токеном
+    не возвращает в очередь то, что сейчас отправляет первый.
+    """
+
+    def __init__(self, bot, *, rate: float = OUTBOX_RATE, per_chat_rate: float = OUTBOX_PER_CHAT_RATE,
+                 concurrency: int = OUTBOX_CONCURRENCY, max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+                 base_backoff: float = 1.0, max_backoff: float = 300.0, poll_interval: float = 1.0):
+        self.bot = bot
+        self.bot_id = _token_bot_id(bot)
+        self.per_chat_interval = 1.0 / per_chat_rate
+        self.concurrency = max(1, concurrency)
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self._bucket = TokenBucket(rate)
+        self._sem = asyncio.Semaphore(self.concurrency)
+        self._chat_next: dict[int, float] = {}
+        self._wake = asyncio.Event()
+        self._inflight: dict[int, asyncio.Task] = {}
+        self._task: asyncio.Task | None = None
+        self._claiming = False
+        self._stopping = False
+
+    async def start(self):
+        now = time.time()
+        async with db_write() as db:
+            # строки, зависшие в 'sending' после падения процесса, снова в очередь
+            await db.execute(
+                "UPDATE outbox SET status='pending' WHERE status='sending' AND bot_id IS ? AND next_at<=?",
+                (self.bot_id, now)
+            )
+            if self.bot_id is not None:
+                # поставленное без запущенного отправителя (и до миграции 7)
+                await db.execute("UPDATE outbox SET bot_id=? WHERE bot_id IS NULL", (self.bot_id,))
+        self._task = asyncio.create_task(self._run(), name="outbox-sender")
+
+    def wake(self):
+        self._wake.set()
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """Досылает очередь (включая повторы, которые успеют наступить), затем останавливается."""
+        if self._task is None:
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + drain_timeout
+        wall_deadline = time.time() + drain_timeout
+        while loop.time() < deadline:
+            if not self._inflight and not self._claiming and not await self._has_due(wall_deadline):
+                break
+            self.wake()
+            await asyncio.sleep(0.05)
+        self._stopping = True
+        self.wake()
+        await self._task
+        self._task = None
+        ids = list(self._inflight)
+        pending = list(self._inflight.values())
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if ids:
+            # прерванные отправки вернутся в очередь при следующем запуске
+            async with db_write() as db:
+                await db.executemany(
+                    "UPDATE outbox SET status='pending', next_at=? WHERE id=? AND status='sending'",
+                    [(time.time(), i) for i in ids]
+                )
+
+    async def _has_due(self, before: float) -> bool:
+        async with db_read() as db:
+            async with db.execute(
+                "SELECT 1 FROM outbox WHERE status='pending' AND bot_id IS ? AND next_at<=? LIMIT 1",
+                (self.bot_id, before)
+            ) as cur:
+                return await cur.fetchone() is not None
+
+    async def _next_due_in(self) -> float:
+        async with db_read() as db:
+            async with db.execute(
+                "SELECT min(next_at) FROM outbox WHERE status='pending' AND bot_id IS ?", (self.bot_id,)
+            ) as cur:
+                row = await cur.fetchone()
+        if row[0] is None:
+            return self.poll_interval
+        return min(self.poll_interval, max(0.0, row[0] - time.time()))
+
+    async def _claim(self, limit: int) -> list:
+        now = time.time()
+        async with db_write() as db:
+            async with db.execute(
+                """
+                UPDATE outbox SET status='sending', next_at=?
+                WHERE id IN (
+                    SELECT id FROM outbox WHERE status='pending' AND bot_id IS ? AND next_at<=?
+                    ORDER BY next_at, id LIMIT ?
+                )
+                RETURNING id, chat_id, text, parse_mode, reply_markup, attempts
+                """,
+                (now + OUTBOX_CLAIM_TTL, self.bot_id, now, limit)
+            ) as cur:
+                rows = await cur.fetchall()
+        return sorted(rows, key=lambda r: r["id"])
+
+    async def _run(self):
+        while not self._stopping:
+            free = self.concurrency * 4 - len(self._inflight)
+            self._claiming = True
+            try:
+                rows = await self._claim(free) if free > 0 else []
+            finally:
+                self._claiming = False
+            for row in rows:
+                task = asyncio.create_task(self._deliver(row))
+                self._inflight[row["id"]] = task
+                task.add_done_callback(lambda _t, i=row["id"]: self._inflight.pop(i, None))
+            if rows:
+                continue
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=await self._next_due_in())
+            except asyncio.TimeoutError:
+                pass
+
+    async def _wait_chat_slot(self, chat_id: int):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self._chat_next.get(chat_id, now))
+        self._chat_next[chat_id] = slot + self.per_chat_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _deliver(self, row):
+        chat_id = row["chat_id"]
+        await self._wait_chat_slot(chat_id)
+        async with self._sem:
+            await self._bucket.acquire()
+            try:
+                await self.bot.send_message(
+                    chat_id, row["text"], parse_mode=row["parse_mode"],
+                    reply_markup=_markup_from_json(row["reply_markup"], self.bot)
+                )
+            except RetryAfter as e:
+                delay = e.retry_after
+                delay = delay.total_seconds() if isinstance(delay, timedelta) else float(delay)
+                self._chat_next[chat_id] = asyncio.get_running_loop().time() + delay
+                METRICS.inc("edsbot_outbox_messages_total", outcome="retry_after")
+                await self._reschedule(row, delay, str(e), count_attempt=False)
+                return
+            except (Forbidden, BadRequest, InvalidToken) as e:
+                logger.warning("Outbox: сообщение %s в чат %s отклонено: %s", row["id"], chat_id, e)
+                METRICS.inc("edsbot_outbox_messages_total", outcome="rejected")
+                await self._fail(row, str(e))
+                return
+            except Exception as e:
+                attempts = row["attempts"] + 1
+                if attempts >= self.max_attempts:
+                    logger.warning("Outbox: сообщение %s в чат %s не отправлено: %s", row["id"], chat_id, e)
+                    METRICS.inc("edsbot_outbox_messages_total", outcome="failed")
+                    await self._fail(row, str(e))
+                else:
+                    delay = min(self.max_backoff, self.base_backoff * 2 ** (attempts - 1))
+                    METRICS.inc("edsbot_outbox_messages_total", outcome="retry")
+                    await self._reschedule(row, delay, str(e), count_attempt=True)
+                return
+        METRICS.inc("edsbot_outbox_messages_total", outcome="sent")
+        async with db_write() as db:
+            await db.execute("DELETE FROM outbox WHERE id=?", (row["id"],))
+
+    async def _reschedule(self, row, delay: float, error: str, count_attempt: bool):
+        async with db_write() as db:
+            await db.execute(
+                "UPDATE outbox SET status='pending', next_at=?, last_error=?, attempts=attempts+? WHERE id=?",
+                (time.time() + delay, error, 1 if count_attempt else 0, row["id"])
+            )
+        self.wake()
+
+    async def _fail(self, row, error: str):
+        async with db_write() as db:
+            await db.execute(
+                "UPDATE outbox SET status='failed', attempts=attempts+1, last_error=? WHERE id=?",
+                (error, row["id"])
+            )
+
+
+OUTBOX: OutboxSender | None = None
+
+async def start_outbox(bot) -> OutboxSender:
+    global OUTBOX
+    if OUTBOX is None:
+        sender = OutboxSender(bot)
+        await sender.start()
+        OUTBOX = sender
+    return OUTBOX
+
+async def stop_outbox(drain_timeout: float = 10.0):
+    global OUTBOX
+    sender, OUTBOX = OUTBOX, None
+    if sender is not None:
+        await sender.stop(drain_timeout)
+
+async def outbox_send(chat_id: int, text: str, parse_mode: str | None = None, reply_markup=None):
+    """Отдельное сообщение через outbox (одна короткая транзакция)."""
+    async with db_write() as db:
+        await outbox_enqueue(db, chat_id, text, parse_mode, reply_markup)
+    if OUTBOX is not None:
+        OUTBOX.wake()
+
 # ---- SCHEDULER ----
 
-async def send_reminders(application: Application, today_override: date | None = None):
-    """Шлёт напоминания. Можно подменить 'сегодня' через today_override для тестов."""
-    days_list = [25, 20, 15, 10, 5, 0]  # 0 = сегодня
-    today = today_override or date.today()
+def _reminder_header(diff: int) -> str:
+    if diff > 0:
+        return f"⏰ Напоминание: через {diff} дн."
+    if diff == 0:
+        return "⚠️ Истекает сегодня!"
+    return f"❗ Просрочено на {-diff} дн."
+
+def _split_message(lines: list[str], limit: int = TG_MESSAGE_LIMIT) -> list[str]:
+    """Склеивает строки в сообщения не длиннее limit символов."""
+    chunks: list[str] = []
+    buf: list[str] = []
+    size = 0
+    for line in lines:
+        while len(line) > limit:  # одиночная строка-гигант режется как есть
+            if buf:
+                chunks.append("\n".join(buf))
+                buf, size = [], 0
+            chunks.append(line[:limit])
+            line = line[limit:]
+        extra = len(line) + (1 if buf else 0)
+        if buf and size + extra > limit:
+            chunks.append("\n".join(buf))
+            buf, size = [], 0
+            extra = len(line)
+        buf.append(line)
+        size += extra
+    if buf:
+        chunks.append("\n".join(buf))
+    return chunks
+
+def build_reminder_digest(rows, today: date) -> list[str]:
+    """Одна сводка на день: блоки по сроку (0/5/…/25), внутри — по организациям."""
+    buckets: dict[int, dict[str, list[str]]] = {}
+    for r in rows:
+        exp = datetime.strptime(r["expiry"], "%Y-%m-%d").date()
+        diff = (exp - today).days
+        kind = "ЮЛ" if r["kind"] == "org" else "ФЛ"
+        line = f"[{kind}] {r['name']} — до {exp.strftime('%d.%m.%Y')}"
+        if r["note"]:
+            line += f"\n  Примечание: {safe_md(r['note'])}"
+        org = r["org"] or "Без организации"
+        buckets.setdefault(diff, {}).setdefault(org, []).append(line)
+
+    lines = [f"📋 *Напоминания на {today.strftime('%d.%m.%Y')}*"]
+    for diff in sorted(buckets):
+        lines.append("")
+        lines.append(_reminder_header(diff))
+        for org in sorted(buckets[diff], key=str.lower):
+            lines.append(f"*{safe_md(org)}*")
+            lines.extend(buckets[diff][org])
+    return _split_message(lines)
+
+def _reminder_item_text(r, today: date) -> str:
+    exp = datetime.strptime(r["expiry"], "%Y-%m-%d").date()
+    kind = "ЮЛ" if r["kind"] == "org" else "ФЛ"
+    msg = f"{_reminder_header((exp - today).days)}\n[{kind}] {r['name']}\nСрок: {exp.strftime('%d.%m.%Y')}"
+    if r["note"]:
+        msg += f"\nПримечание: {safe_md(r['note'])}"
+    return msg
+
+def _build_reminder_messages(rows, subs: list[int], today: date, mode: str | None,
+                             logged: set[tuple[int, int, int]] | None = None,
+                             offsets: dict[int, tuple[int, ...]] | None = None,
+                             ) -> list[tuple[int, str, list[tuple[int, int]]]]:
+    """Сообщения (chat_id, текст, [(signature_id, offset), ...]) для рассылки.
+
+    logged/offsets используются журналом: уже доставленное пропускается,
+    а в журнал попадают все сроки, которые покрывает сообщение.
+    """
+    def pending(r, chat_id) -> list[tuple[int, int]]:
+        if offsets is None:
+            return []
+        return [(r["id"], o) for o in offsets[r["id"]] if (r["id"], o, chat_id) not in logged]
+
+    messages: list[tuple[int, str, list[tuple[int, int]]]] = []
+    if (mode or REMIND_MODE) == "digest":
+        # подписчики с одинаковым набором недоставленного получают одну и ту же сводку
+        by_rows: dict[tuple[int, ...], list[int]] = {}
+        for chat_id in subs:
+            idx = tuple(i for i, r in enumerate(rows) if offsets is None or pending(r, chat_id))
+            if idx:
+                by_rows.setdefault(idx, []).append(chat_id)
+        for idx, chats in by_rows.items():
+            part = [rows[i] for i in idx]
+            chunks = build_reminder_digest(part, today)
+            for chat_id in chats:
+                entries = [e for r in part for e in pending(r, chat_id)]
+                for n, msg in enumerate(chunks):
+                    # журнал пишем вместе с последним куском сводки
+                    messages.append((chat_id, msg, entries if n == len(chunks) - 1 else []))
+        return messages
+
+    for r in rows:
+        msg = _reminder_item_text(r, today)
+        for chat_id in subs:
+            entries = pending(r, chat_id)
+            if offsets is None or entries:
+                messages.append((chat_id, msg, entries))
+    return messages
+
+async def _advance_reminded(db, progress: list[tuple[int, date]]):
+    # отметка только растёт: догоняющий запуск «за вчера» не откатывает её назад
+    await db.executemany(
+        "UPDATE subscriber SET reminded_until=max(coalesce(reminded_until, ''), ?) WHERE chat_id=?",
+        [(day.isoformat(), chat_id) for chat_id, day in progress]
+    )
+
+async def send_reminders(application: Application, today_override: date | None = None,
+                         mode: str | None = None):
+    """Шлёт напоминания. Можно подменить 'сегодня' через today_override для тестов.
+
+    mode: "item" — сообщение на каждую подпись, "digest" — одна сводка
+    на подписчика (по умолчанию берётся из REMIND_MODE).
+
+    Без today_override работает по журналу reminder_log: досылает всё,
+    что стало должно с прошлого успешного запуска, и не повторяет уже
+    доставленное. С today_override — разовая проверка без журнала
+    по общим смещениям REMIND_OFFSETS.
+    """
+    if today_override is None:
+        await send_due_reminders(application, date.today(), mode)
+        return
+
+    days_list = list(REMIND_OFFSETS)
+    today = today_override
     targets = {(today + timedelta(days=d)).isoformat(): d for d in days_list}
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        placeholders = ",".join([f"'{t}'" for t in targets.keys()])
-        sql = f"""
-        SELECT e.name, e.kind, s.expiry, s.note
-        FROM signature s
-        JOIN entity e ON e.id=s.entity_id
-        WHERE s.active=1 AND date(s.expiry) IN ({placeholders})
-        ORDER BY date(s.expiry) ASC, lower(e.name);
-        """
-        async with db.execute(sql) as cur:
+    async with db_read() as db:
+        async with db.execute(_reminders_sql(len(targets)), tuple(targets)) as cur:
             rows = await cur.fetchall()
 
     if not rows:
         return
 
     subs = await get_subscribers()
-    for r in rows:
-        exp = datetime.strptime(r["expiry"], "%Y-%m-%d").date()
-        diff = (exp - today).days
-        if diff not in days_list:  # safety
+    messages = _build_reminder_messages(rows, subs, today, mode)
+    await _dispatch_reminders(application, messages)
+
+async def send_due_reminders(application: Application, until: date, mode: str | None = None,
+                             chats: list[int] | None = None, today: date | None = None):
+    """Досылает чатам напоминания, срок которых наступил в (их прошлый запуск, until].
+
+    chats — подписчики одного слота доставки (по умолчанию все), today —
+    их местная дата для текста «через N дн.». День until проверяем всегда:
+    повторный запуск досылает то, что появилось после прошлого, а журнал не
+    даёт отправить дважды.
+    """
+    today = today or date.today()
+    if chats is None:
+        chats = await get_subscribers()
+    if not chats:
+        return
+    async with db_read() as db:
+        async with db.execute(
+            SQL_DUE_REMINDERS,
+            (json.dumps([(chat_id, until.isoformat()) for chat_id in chats]),
+             f"-{REMIND_CATCHUP_DAYS} days", json.dumps(REMIND_OFFSETS))
+        ) as cur:
+            found = await cur.fetchall()
+
+    # строки по чатам, с сохранением порядка «срок, имя»
+    per_chat: dict[int, tuple[list, dict[int, list[int]]]] = {}
+    for r in found:
+        rows, offsets = per_chat.setdefault(r["chat_id"], ([], {}))
+        if r["id"] not in offsets:
+            rows.append(r)
+            offsets[r["id"]] = []
+        offsets[r["id"]].append(r["offset_days"])
+
+    # чаты с одинаковым набором недоставленного получают одни и те же сообщения
+    groups: dict[tuple, tuple[list, dict[int, tuple[int, ...]], list[int]]] = {}
+    for chat_id, (rows, offsets) in per_chat.items():
+        key = tuple((sig_id, tuple(o)) for sig_id, o in offsets.items())
+        groups.setdefault(key, (rows, {k: tuple(v) for k, v in offsets.items()}, []))[2].append(chat_id)
+
+    messages: list[tuple[int, str, list[tuple[int, int]]]] = []
+    for rows, offsets, group_chats in groups.values():
+        messages += _build_reminder_messages(rows, group_chats, today, mode, set(), offsets)
+    await _dispatch_reminders(application, messages, progress=[(chat_id, until) for chat_id in chats])
+
+async def _log_reminders(db, messages):
+    await db.executemany(
+        "INSERT OR IGNORE INTO reminder_log(signature_id, offset_days, chat_id) VALUES (?,?,?)",
+        [(sig_id, o, chat_id) for chat_id, _, entries in messages for sig_id, o in entries]
+    )
+
+async def _dispatch_reminders(application: Application,
+                              messages: list[tuple[int, str, list[tuple[int, int]]]],
+                              progress: list[tuple[int, date]] | None = None):
+    """Кладёт напоминания в outbox; без запущенного отправителя шлёт сразу.
+
+    С outbox очередь, журнал и отметка о запуске пишутся одной транзакцией.
+    """
+    METRICS.inc("edsbot_reminder_runs_total")
+    METRICS.inc("edsbot_reminder_items_total", sum(len(entries) for _, _, entries in messages))
+    with METRICS.timer("edsbot_reminder_dispatch_seconds"):
+        await _dispatch_reminders_now(application, messages, progress)
+
+async def _dispatch_reminders_now(application: Application,
+                                  messages: list[tuple[int, str, list[tuple[int, int]]]],
+                                  progress: list[tuple[int, date]] | None):
+    if OUTBOX is not None:
+        async with db_write() as db:
+            await outbox_enqueue_many(
+                db, [(chat_id, msg, ParseMode.MARKDOWN) for chat_id, msg, _ in messages]
+            )
+            await _log_reminders(db, messages)
+            if progress:
+                await _advance_reminded(db, progress)
+        METRICS.inc("edsbot_reminder_messages_total", len(messages), via="outbox")
+        OUTBOX.wake()
+        return
+    for chat_id, msg, entries in messages:
+        try:
+            await application.bot.send_message(chat_id, msg, parse_mode=ParseMode.MARKDOWN)
+        except Exception:
+            logger.exception("Не удалось отправить напоминание в чат %s", chat_id)
+            METRICS.inc("edsbot_reminder_messages_total", via="failed")
             continue
-        kind = "ЮЛ" if r["kind"] == "org" else "ФЛ"
-        if diff > 0:
-            header = f"⏰ Напоминание: через {diff} дн."
-        elif diff == 0:
-            header = "⚠️ Истекает сегодня!"
+        METRICS.inc("edsbot_reminder_messages_total", via="direct")
+        if entries:
+            async with db_write() as db:
+                await _log_reminders(db, [(chat_id, msg, entries)])
+    if progress:
+        async with db_write() as db:
+            await _advance_reminded(db, progress)
+
+async def catch_up_reminders(application: Application):
+    """При старте досылает пропущенное за время простоя.
+
+    Сегодняшние напоминания считаются наступившими только после времени
+    доставки слота, по его часовому поясу.
+    """
+    for slot in await get_reminder_slots():
+        await send_slot_reminders(application, slot, _catch_up_until(slot))
+
+def _remind_time(remind_at: str | None = None) -> dt_time:
+    h, m = map(int, (remind_at or REMIND_AT).split(":"))
+    return dt_time(h, m)
+
+def _catch_up_until(slot: tuple[str, str] | None = None) -> date:
+    remind_at, tz = slot or (REMIND_AT, TZ)
+    now = datetime.now(ZoneInfo(tz))
+    if now.time() < _remind_time(remind_at):
+        return now.date() - timedelta(days=1)
+    return now.date()
+
+async def get_reminders_generation() -> str | None:
+    async with db_read() as db:
+        async with db.execute("SELECT value FROM meta WHERE key='reminders_generation'") as cur:
+            row = await cur.fetchone()
+    return row[0] if row else None
+
+async def get_reminder_slots() -> dict[tuple[str, str], tuple[int, ...]]:
+    """Слоты доставки (время, пояс) и смещения, нужные их подписчикам.
+
+    Слот по умолчанию есть всегда: в него попадают новые подписчики.
+    """
+    slots: dict[tuple[str, str], set[int]] = {(REMIND_AT, TZ): set(REMIND_OFFSETS)}
+    async with db_read() as db:
+        async with db.execute(
+            """
+            SELECT DISTINCT coalesce(st.remind_at, ?), coalesce(st.tz, ?), o.offset_days
+            FROM subscriber sub
+            LEFT JOIN subscriber_settings st ON st.chat_id=sub.chat_id
+            LEFT JOIN subscriber_offset o ON o.chat_id=sub.chat_id
+            """,
+            (REMIND_AT, TZ)
+        ) as cur:
+            for remind_at, tz, offset in await cur.fetchall():
+                slots.setdefault((remind_at, tz), set()).update(
+                    REMIND_OFFSETS if offset is None else (offset,)
+                )
+    return {slot: tuple(sorted(offsets, reverse=True)) for slot, offsets in slots.items()}
+
+async def send_slot_reminders(application: Application, slot: tuple[str, str], until: date):
+    """Одна рассылка на всех подписчиков слота: их строки — одним запросом."""
+    chats = await get_subscribers(slot)
+    today = datetime.now(ZoneInfo(slot[1])).date()
+    await send_due_reminders(application, until, chats=chats, today=today)
+
+class LeaderLease:
+    """Аренда в таблице lease: у имени в каждый момент не больше одного держателя.
+
+    Захват и продление — один UPSERT: строка переписывается, только если
+    аренда наша или истекла. Держатель продлевает её каждые ttl/3 секунд;
+    упавший процесс теряет её через ttl, и следующий продлевающий её
+    забирает. Срок — по time.time(): процессы делят одну data.db, а значит
+    и одну машину. on_acquired вызывается при получении аренды,
+    on_renewed — при каждом следующем продлении.
+    """
+
+    def __init__(self, name: str = "scheduler", *, ttl: float = LEADER_LEASE_TTL,
+                 holder: str = INSTANCE_ID,
+                 on_acquired: Callable[[], Awaitable[None]] | None = None,
+                 on_renewed: Callable[[], Awaitable[None]] | None = None):
+        self.name = name
+        self.ttl = ttl
+        self.holder = holder
+        self.on_acquired = on_acquired
+        self.on_renewed = on_renewed
+        self._valid_until = 0.0  # по монотонным часам этого процесса
+        self._task: asyncio.Task | None = None
+        self._acquired_task: asyncio.Task | None = None
+
+    @property
+    def is_leader(self) -> bool:
+        return time.monotonic() < self._valid_until
+
+    async def try_acquire(self) -> bool:
+        started = time.monotonic()
+        now = time.time()
+        async with db_write() as db:
+            async with db.execute(
+                """
+                INSERT INTO lease(name, holder, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET holder=excluded.holder, expires_at=excluded.expires_at
+                WHERE lease.holder=excluded.holder OR lease.expires_at<?
+                RETURNING holder
+                """,
+                (self.name, self.holder, now + self.ttl, now)
+            ) as cur:
+                held = await cur.fetchone() is not None
+        # отсчёт от начала запроса: не считаем себя лидером дольше, чем видят другие
+        self._valid_until = started + self.ttl if held else 0.0
+        return held
+
+    async def release(self):
+        self._valid_until = 0.0
+        async with db_write() as db:
+            await db.execute("DELETE FROM lease WHERE name=? AND holder=?", (self.name, self.holder))
+
+    async def start(self):
+        await self._beat()
+        self._task = asyncio.create_task(self._run(), name=f"lease-{self.name}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        with suppress(Exception):
+            await self.release()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            await self._beat()
+
+    async def _beat(self):
+        was = self.is_leader
+        try:
+            held = await self.try_acquire()
+        except Exception:
+            # база недоступна: лидерство истечёт само по _valid_until
+            logger.exception("Не удалось продлить аренду %s", self.name)
+            return
+        if held and not was:
+            logger.info("Аренда %s получена (%s)", self.name, self.holder)
+            if self.on_acquired is not None:
+                self._acquired_task = asyncio.create_task(self.on_acquired())
+        elif was and not held:
+            logger.warning("Аренда %s потеряна (%s)", self.name, self.holder)
+        elif held and self.on_renewed is not None:
+            try:
+                await self.on_renewed()
+            except Exception:
+                logger.exception("Обработчик продления аренды %s не удался", self.name)
+
+
+LEADER: LeaderLease | None = None
+
+
+async def start_leader(application: Application) -> LeaderLease:
+    """Запускает аренду планировщика; новый лидер досылает пропущенное,
+    а действующий подхватывает записи других процессов."""
+    global LEADER
+
+    async def on_acquired():
+        # другой процесс мог менять реестр, пока мы не были лидером
+        if REMINDERS is not None:
+            await REMINDERS.reload()
         else:
-            header = f"❗ Просрочено на {-diff} дн."
+            await catch_up_reminders(application)
+        await refresh_grp_stats()
 
-        msg = f"{header}\n[{kind}] {r['name']}\nСрок: {exp.strftime('%d.%m.%Y')}"
-        if r["note"]:
-            msg += f"\nПримечание: {safe_md(r['note'])}"
+    async def on_renewed():
+        if REMINDERS is not None:
+            await REMINDERS.sync()
+        # смена дня в счётчиках групп — на продлении, а не при чтении экрана
+        await refresh_grp_stats()
 
-        for chat_id in subs:
+    LEADER = LeaderLease(on_acquired=on_acquired, on_renewed=on_renewed)
+    await LEADER.start()
+    return LEADER
+
+
+async def stop_leader():
+    global LEADER
+    lease, LEADER = LEADER, None
+    if lease is not None:
+        await lease.stop()
+
+
+# ---- MAINTENANCE ----
+
+async def archive_signatures(retention_days: int = SIGNATURE_RETENTION_DAYS) -> int:
+    """Переносит снятые подписи старше retention_days в signature_archive."""
+    cutoff = f"-{int(retention_days)} days"
+    async with db_write() as db:
+        await db.execute(
+            """
+            INSERT INTO signature_archive(id, entity_id, expiry, note, created_at, updated_at)
+            SELECT id, entity_id, expiry, note, created_at, updated_at
+            FROM signature WHERE active=0 AND updated_at < datetime('now', ?)
+            """,
+            (cutoff,)
+        )
+        cur = await db.execute(
+            "DELETE FROM signature WHERE active=0 AND updated_at < datetime('now', ?)", (cutoff,)
+        )
+        moved = cur.rowcount
+        await db.commit()
+    if moved:
+        METRICS.inc("edsbot_signatures_archived_total", moved)
+        registry_changed()
+    return moved
+
+
+async def run_maintenance() -> dict[str, int]:
+    """Архивирует старые подписи, возвращает свободные страницы ОС и обновляет статистику планировщика.
+
+    Полного VACUUM здесь нет: он держал бы писателя на всё время
+    перестройки. Режим INCREMENTAL база получает миграцией при старте.
+    """
+    archived = await archive_signatures()
+    async with db_write() as db:
+        async with db.execute("PRAGMA freelist_count") as cur:
+            free = (await cur.fetchone())[0]
+        async with db.execute("PRAGMA incremental_vacuum") as cur:
+            await cur.fetchall()  # страница освобождается на каждом шаге
+        await db.execute("PRAGMA optimize")
+    logger.info("Обслуживание базы: в архив %s, освобождено страниц %s", archived, free)
+    return {"archived": archived, "freed_pages": free}
+
+
+async def _maintenance_loop(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        if LEADER is not None and not LEADER.is_leader:
+            continue
+        try:
+            await run_maintenance()
+        except Exception:
+            logger.exception("Обслуживание базы не удалось")
+
+
+MAINTENANCE: asyncio.Task | None = None
+
+
+async def start_maintenance(interval: float = MAINTENANCE_INTERVAL_HOURS * 3600) -> asyncio.Task:
+    """Периодическое обслуживание базы; выполняет только держатель аренды."""
+    global MAINTENANCE
+    MAINTENANCE = asyncio.create_task(_maintenance_loop(interval), name="maintenance")
+    return MAINTENANCE
+
+
+async def stop_maintenance():
+    global MAINTENANCE
+    task, MAINTENANCE = MAINTENANCE, None
+    if task is not None:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+
+
+async def scheduled_reminders(application: Application, until: date | None = None,
+                              slot: tuple[str, str] | None = None):
+    if LEADER is not None and not LEADER.is_leader:
+        logger.info("Напоминания шлёт другой процесс (%s не лидер)", INSTANCE_ID)
+        return
+    if slot is None:
+        await send_due_reminders(application, until or date.today())
+    else:
+        await send_slot_reminders(application, slot, until or datetime.now(ZoneInfo(slot[1])).date())
+
+
+class ReminderScheduler:
+    """Куча ближайших событий напоминаний вместо ежедневного прохода по реестру.
+
+    Событие — (когда, signature_id, смещение, срок, слот): срок минус
+    смещение во время доставки слота. Слот — пара (время, часовой пояс):
+    все подписчики с одинаковыми настройками получают свои напоминания
+    одной рассылкой (send_slot_reminders), а не запросом на подписчика.
+
+    В памяти только события на horizon_days вперёд; они читаются одним
+    запросом по idx_signature_active_expiry, а с каждым новым днём
+    дочитывается один день. Запись в реестр сообщает о новой подписи или
+    сроке через signature_changed; старые события подписи не удаляются
+    из кучи, а отбрасываются при извлечении, если срок у неё уже другой.
+    signature_changed видит только записи своего процесса: о чужих
+    говорит счётчик reminders_generation в meta, и sync перечитывает окно.
+    Цикл спит до ближайшего события или до полуночи ближайшего пояса.
+    """
+
+    def __init__(self, application: Application, *, horizon_days: int = REMIND_HORIZON_DAYS):
+        self.application = application
+        self.horizon_days = max(1, horizon_days)
+        self._heap: list[tuple[datetime, int, int, date, tuple[str, str]]] = []
+        self._expiry: dict[int, date] = {}  # текущий срок подписей, у которых есть события в куче
+        self._slots: dict[tuple[str, str], tuple[int, ...]] = {}
+        self._loaded_until: dict[tuple[str, str], date] = {}
+        self._catch_up: dict[tuple[str, str], date] = {}
+        self._generation: str | None = None  # reminders_generation на момент reload
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def next_event(self) -> tuple[datetime, int, int] | None:
+        while self._heap and not self._current(self._heap[0]):
+            heapq.heappop(self._heap)
+        return self._heap[0][:3] if self._heap else None
+
+    def signature_changed(self, signature_id: int, expiry: date | None):
+        """Новый срок подписи; None — подпись снята или удалена."""
+        if expiry is None:
+            self._expiry.pop(signature_id, None)
+            return
+        if not self._loaded_until:
+            return
+        self._expiry[signature_id] = expiry
+        pushed = False
+        for slot, last in self._loaded_until.items():
+            pushed |= self._push(signature_id, expiry, slot, self._today(slot), last)
+        if pushed:
+            self._wake.set()
+
+    async def reload(self, catch_up: bool = True):
+        """Перечитывает слоты и окно целиком; catch_up — заодно дослать пропущенное за простой."""
+        # счётчик — до чтения: запись, попавшая между ними, вызовет ещё один reload
+        generation = await get_reminders_generation()
+        slots = await get_reminder_slots()
+        self._heap.clear()
+        self._expiry.clear()
+        self._loaded_until.clear()
+        self._slots = slots
+        await self._load({
+            slot: (self._today(slot), self._today(slot) + timedelta(days=self.horizon_days - 1))
+            for slot in slots
+        })
+        if catch_up:
+            self._catch_up = {slot: _catch_up_until(slot) for slot in slots}
+        self._generation = generation
+        self._wake.set()
+
+    async def sync(self) -> bool:
+        """Перечитывает окно, если подписи или слоты менялись после reload.
+
+        Уже пропущенные сегодняшние события попадают в окно с прошедшим
+        временем и уходят сразу; повторов не будет благодаря reminder_log.
+        """
+        if await get_reminders_generation() == self._generation:
+            return False
+        await self.reload(catch_up=False)
+        return True
+
+    async def start(self):
+        # пропущенное досылает получивший аренду: он вызовет reload()
+        await self.reload(catch_up=False)
+        self._task = asyncio.create_task(self._run(), name="reminders")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    @staticmethod
+    def _today(slot: tuple[str, str]) -> date:
+        return datetime.now(ZoneInfo(slot[1])).date()
+
+    def _current(self, event) -> bool:
+        return self._expiry.get(event[1]) == event[3]
+
+    def _push(self, signature_id: int, expiry: date, slot: tuple[str, str], first: date, last: date) -> bool:
+        pushed = False
+        for o in self._slots.get(slot, ()):
+            day = expiry - timedelta(days=o)
+            if first <= day <= last:
+                fire_at = datetime.combine(day, _remind_time(slot[0]), ZoneInfo(slot[1]))
+                heapq.heappush(self._heap, (fire_at, signature_id, o, expiry, slot))
+                pushed = True
+        return pushed
+
+    async def _load(self, windows: dict[tuple[str, str], tuple[date, date]]):
+        targets = sorted({
+            d for slot, (first, last) in windows.items()
+            for d in _reminder_dates(first, last, self._slots.get(slot, ()))
+        })
+        async with db_read() as db:
+            async with db.execute(_reminder_events_sql(len(targets)), targets) as cur:
+                rows = await cur.fetchall()
+        for signature_id, raw in rows:
+            expiry = date.fromisoformat(raw)
+            self._expiry[signature_id] = expiry
+            for slot, (first, last) in windows.items():
+                self._push(signature_id, expiry, slot, first, last)
+        for slot, (_, last) in windows.items():
+            self._loaded_until[slot] = last
+
+    async def _extend(self):
+        windows = {}
+        for slot, loaded in self._loaded_until.items():
+            today = self._today(slot)
+            last = today + timedelta(days=self.horizon_days - 1)
+            if loaded < last:
+                windows[slot] = (max(today, loaded + timedelta(days=1)), last)
+        if not windows:
+            return
+        # у подписи, срок которой прошёл везде, событий уже не будет
+        oldest = min(self._today(slot) for slot in self._slots)
+        shortest = min(min(offsets, default=0) for offsets in self._slots.values())
+        self._expiry = {
+            sid: exp for sid, exp in self._expiry.items()
+            if exp - timedelta(days=shortest) >= oldest
+        }
+        await self._load(windows)
+
+    def _pop_due(self, now: datetime) -> dict[tuple[str, str], date]:
+        due: dict[tuple[str, str], date] = {}
+        while self._heap and self._heap[0][0] <= now:
+            event = heapq.heappop(self._heap)
+            if self._current(event):
+                slot, day = event[4], event[0].astimezone(ZoneInfo(event[4][1])).date()
+                due[slot] = max(due.get(slot, day), day)
+        return due
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
             try:
-                await application.bot.send_message(chat_id, msg, parse_mode=ParseMode.MARKDOWN)
+                await self._extend()
             except Exception:
-                pass
+                logger.exception("Не удалось дочитать события напоминаний")
+            now = datetime.now(timezone.utc)
+            due = self._pop_due(now)
+            for slot, day in self._catch_up.items():
+                due[slot] = max(due.get(slot, day), day)
+            self._catch_up = {}
+            if due:
+                for slot, until in due.items():
+                    try:
+                        await scheduled_reminders(self.application, until, slot)
+                    except Exception:
+                        logger.exception("Не удалось разослать напоминания слота %s до %s", slot, until)
+                continue
+            wake_at = min(
+                datetime.combine(self._today(slot) + timedelta(days=1), dt_time(), ZoneInfo(slot[1]))
+                for slot in self._slots
+            )
+            event = self.next_event()
+            if event is not None:
+                wake_at = min(wake_at, event[0])
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(
+                    self._wake.wait(), max(0.0, (wake_at - datetime.now(timezone.utc)).total_seconds())
+                )
 
-def schedule_daily(application: Application):
-    # Планируем отправку раз в сутки в REMIND_AT локального TZ
-    h, m = map(int, REMIND_AT.split(":"))
-    # Используем внутренний job_queue PTB
-    application.job_queue.run_daily(
-        lambda ctx: asyncio.create_task(send_reminders(application)),
-        time=datetime.now().replace(hour=h, minute=m, second=0, microsecond=0).timetz()
-    )
+
+REMINDERS: ReminderScheduler | None = None
+
+
+async def start_reminders(application: Application) -> ReminderScheduler:
+    global REMINDERS
+    REMINDERS = ReminderScheduler(application)
+    await REMINDERS.start()
+    return REMINDERS
+
+
+async def stop_reminders():
+    global REMINDERS
+    scheduler, REMINDERS = REMINDERS, None
+    if scheduler is not None:
+        await scheduler.stop()
 
 async def test_reminder_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Ручной запуск рассылки.
@@ -1301,7 +4875,7 @@ async def test_reminder_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def _dbg_msg(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         txt = update.message.text if update.message else None
-        logger.info("DBG MSG: uid=%s chat=%s text=%r",
+        logger.debug("DBG MSG: uid=%s chat=%s text=%r",
                     update.effective_user.id if update.effective_user else None,
                     update.effective_chat.id if update.effective_chat else None,
                     txt)
@@ -1311,7 +4885,7 @@ async def _dbg_msg(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def _dbg_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         data = update.callback_query.data if update.callback_query else None
-        logger.info("DBG CB: uid=%s chat=%s data=%r",
+        logger.debug("DBG CB: uid=%s chat=%s data=%r",
                     update.effective_user.id if update.effective_user else None,
                     update.effective_chat.id if update.effective_chat else None,
                     data)
@@ -1321,19 +4895,243 @@ async def _dbg_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.exception("DBG CB error: %s", e)
 
 async def _go_main(context: ContextTypes.DEFAULT_TYPE, chat_id: int):
-    """Тихо возвращает пользователя в главное меню, без лишнего текста."""
+    """Тихо возвращает пользователя в главное меню, без лишнего текста.
+
+    Шлём напрямую, как и остальные ответы обработчика: через outbox меню
+    могло бы прийти раньше или позже них. Outbox — для рассылок.
+    """
     await context.bot.send_message(chat_id, SAFE_EMPTY, reply_markup=main_menu_kbd())
     context.user_data.clear()
 
 
+# ---- HTTP SERVER / WEBHOOK ----
+
+class HttpRequest(NamedTuple):
+    method: str
+    path: str
+    headers: dict[str, str]
+    body: bytes
+    keep_alive: bool
+
+
+# обработчик маршрута: запрос -> (статус, Content-Type, тело)
+HttpHandler = Callable[[HttpRequest], Awaitable[tuple[int, str, bytes]]]
+
+
+class HttpError(Exception):
+    def __init__(self, status: int):
+        super().__init__(status)
+        self.status = status
+
+
+class HttpServer:
+    """Минимальный HTTP/1.1 сервер на asyncio.start_server.
+
+    Ровно то, что нужно вебхуку Telegram и служебным эндпоинтам: тело по
+    Content-Length, keep-alive, предел размера тела и мягкая остановка —
+    начатые запросы дорабатывают, новые соединения не принимаются.
+    """
+
+    def __init__(self, host: str, port: int, *, max_body: int = WEBHOOK_MAX_BODY,
+                 idle_timeout: float = 75.0):
+        self.host = host
+        self.port = port
+        self.max_body = max_body
+        self.idle_timeout = idle_timeout
+        self.routes: dict[str, dict[str, HttpHandler]] = {}
+        self._server: asyncio.base_events.Server | None = None
+        self._conns: set[asyncio.Task] = set()
+        self._busy: set[asyncio.Task] = set()
+        self._closing = False
+
+    def route(self, method: str, path: str, handler: HttpHandler):
+        self.routes.setdefault(path, {})[method.upper()] = handler
+
+    async def start(self):
+        self._closing = False
+        self._server = await asyncio.start_server(self._on_conn, self.host, self.port)
+        # при port=0 система выбирает свободный порт
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("HTTP-сервер слушает %s:%s", self.host, self.port)
+
+    async def stop(self, timeout: float = 10.0):
+        if self._server is None:
+            return
+        self._closing = True
+        self._server.close()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._busy and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        # остались только простаивающие keep-alive соединения (или зависшие)
+        for task in list(self._conns):
+            task.cancel()
+        if self._conns:
+            await asyncio.gather(*self._conns, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _on_conn(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._conns.add(task)
+        try:
+            while not self._closing:
+                try:
+                    req = await asyncio.wait_for(self._read_request(reader), self.idle_timeout)
+                except HttpError as e:
+                    await self._respond(writer, e.status, b"", close=True)
+                    break
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if req is None:
+                    break
+                self._busy.add(task)
+                try:
+                    status, ctype, body = await self._dispatch(req)
+                    keep = req.keep_alive and not self._closing
+                    await self._respond(writer, status, body, ctype, close=not keep)
+                finally:
+                    self._busy.discard(task)
+                if not keep:
+                    break
+        except (asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            with suppress(Exception):
+                await writer.wait_closed()
+            self._conns.discard(task)
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> HttpRequest | None:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if not e.partial:
+                return None  # клиент закрыл соединение между запросами
+            raise
+        except asyncio.LimitOverrunError:
+            raise HttpError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST)
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(":")
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding"):
+            raise HttpError(HTTPStatus.LENGTH_REQUIRED)
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST)
+        if length > self.max_body:
+            raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        body = await reader.readexactly(length) if length else b""
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection == "keep-alive" or (version == "HTTP/1.1" and connection != "close")
+        return HttpRequest(method.upper(), target.split("?", 1)[0], headers, body, keep_alive)
+
+    async def _dispatch(self, req: HttpRequest) -> tuple[int, str, bytes]:
+        methods = self.routes.get(req.path)
+        if methods is None:
+            return HTTPStatus.NOT_FOUND, "text/plain", b""
+        handler = methods.get(req.method)
+        if handler is None:
+            return HTTPStatus.METHOD_NOT_ALLOWED, "text/plain", b""
+        try:
+            return await handler(req)
+        except Exception:
+            logger.exception("Ошибка обработчика HTTP %s %s", req.method, req.path)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, "text/plain", b""
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, body: bytes,
+                       ctype: str = "text/plain", close: bool = False):
+        head = (
+            f"HTTP/1.1 {int(status)} {HTTPStatus(status).phrase}\r\n"
+            f"Content-Type: {ctype}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+
+def webhook_handler(application: Application, secret: str) -> HttpHandler:
+    """Принимает обновление от Telegram и ставит его в очередь приложения.
+
+    Отвечаем сразу после постановки в очередь: обработку ведёт Application
+    (с concurrent_updates), а Telegram не ждёт наших запросов к БД.
+    """
+    import hmac
+    expected = secret.encode()
+
+    async def handle(req: HttpRequest) -> tuple[int, str, bytes]:
+        token = req.headers.get("x-telegram-bot-api-secret-token", "").encode("latin-1")
+        if not hmac.compare_digest(token, expected):
+            return HTTPStatus.FORBIDDEN, "text/plain", b""
+        try:
+            update = Update.de_json(json.loads(req.body), application.bot)
+        except (ValueError, TypeError, KeyError):
+            update = None
+        if update is None:
+            return HTTPStatus.BAD_REQUEST, "text/plain", b""
+        await application.update_queue.put(update)
+        return HTTPStatus.OK, "text/plain", b""
+
+    return handle
+
+
+async def start_webhook(application: Application) -> HttpServer:
+    if not WEBHOOK_URL:
+        raise SystemExit("Для BOT_MODE=webhook задайте WEBHOOK_URL")
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    server = HttpServer(WEBHOOK_LISTEN, WEBHOOK_PORT)
+    server.route("POST", WEBHOOK_PATH, webhook_handler(application, secret))
+    await server.start()
+    await application.bot.set_webhook(
+        url=WEBHOOK_URL,
+        secret_token=secret,
+        allowed_updates=Update.ALL_TYPES,
+        max_connections=UPDATE_CONCURRENCY,
+        drop_pending_updates=DROP_PENDING_UPDATES,
+    )
+    return server
+
+
+async def metrics_endpoint(req: HttpRequest) -> tuple[int, str, bytes]:
+    return HTTPStatus.OK, "text/plain; version=0.0.4; charset=utf-8", METRICS.render().encode()
+
+
+async def start_metrics_server() -> HttpServer | None:
+    if not METRICS_PORT:
+        return None
+    server = HttpServer(METRICS_LISTEN, METRICS_PORT)
+    server.route("GET", "/metrics", metrics_endpoint)
+    await server.start()
+    return server
+
+
 # ====== MAIN ======
 
 def build_app() -> Application:
-    app = Application.builder().token(TOKEN).build()
+    builder = (
+        Application.builder().token(TOKEN)
+        .request(MeteredRequest(connection_pool_size=BOT_API_POOL_SIZE, pool_timeout=BOT_API_POOL_TIMEOUT))
+        .persistence(SqlitePersistence())
+    )
+    if BOT_MODE == "webhook":
+        # обновления приходят в HttpServer, Updater не нужен
+        builder = builder.updater(None).concurrent_updates(UPDATE_CONCURRENCY)
+    app = builder.build()
 
     # --- диагностические ловцы всего на свете ---
-    app.add_handler(CallbackQueryHandler(_dbg_cb), group=99)
-    app.add_handler(MessageHandler(filters.ALL, _dbg_msg), group=99)
+    app.add_handler(CallbackQueryHandler(_dbg_cb), group=99)  # он же отвечает на колбэки
+    if logger.isEnabledFor(logging.DEBUG):
+        app.add_handler(MessageHandler(filters.ALL, _dbg_msg), group=99)
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_cmd))
@@ -1344,14 +5142,25 @@ def build_app() -> Application:
     app.add_handler(CommandHandler("delete", del_entry_cmd))
     app.add_handler(CommandHandler("registry_delete", regdel_cmd))
     app.add_handler(CommandHandler("test_reminder", test_reminder_cmd))
+    app.add_handler(CommandHandler("import", import_cmd))
+    app.add_handler(CommandHandler("export", export_cmd))
+    app.add_handler(CommandHandler("find", find_cmd))
+    app.add_handler(CommandHandler("settings", settings_cmd))
+    app.add_handler(CommandHandler("stats", stats_cmd))
+    app.add_handler(CommandHandler("history", history_cmd))
 
     app.add_handler(CallbackQueryHandler(cb_router))
+    app.add_handler(InlineQueryHandler(on_inline_query))
 
     # Текстовые сообщения:
     # 1) шаги ввода внутри сценариев
     app.add_handler(MessageHandler(filters.TEXT & filters.User(user_id=list(ADMIN_IDS)), on_text_flow), group=0)
     app.add_handler(MessageHandler(filters.TEXT, on_text), group=1)
+    app.add_handler(MessageHandler(filters.Document.ALL, on_import_document))
 
+    for handlers in app.handlers.values():
+        for h in handlers:
+            h.callback = metered_handler(h.callback)
     return app
 
 import asyncio as _a
@@ -1360,33 +5169,55 @@ async def _amain():
     if not TOKEN:
         raise SystemExit("Нет токена TELEGRAM_BOT_TOKEN в .env")
 
-    # Инициализация БД
+    # Инициализация БД и пула соединений
     await init_db()
+    await open_pool()
+    await ORG_CACHE.load()
 
     app = build_app()
-    schedule_daily(app)
 
     # Инициализируем и запускаем приложение вручную (чистый async-путь для Py3.12)
     await app.initialize()
     await app.start()
+    await start_outbox(app.bot)
+    await start_reminders(app)
+    # пропущенное за простой досылает тот процесс, что получит аренду
+    await start_leader(app)
+    await start_maintenance()
+    metrics_server = await start_metrics_server()
+
+    web = None
+    if BOT_MODE == "webhook":
+        web = await start_webhook(app)
+    else:
+        # На всякий случай — сброс вебхука
+        try:
+            await app.bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
+        except Exception:
+            pass
 
-    # На всякий случай — сброс вебхука
-    try:
-        await app.bot.delete_webhook(drop_pending_updates=True)
-    except Exception:
-        pass
-
-    # Стартуем polling (это корутина в v21)
-    await app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        # Стартуем polling (это корутина в v21)
+        await app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
 
     # Держим процесс живым
     try:
         await _a.Event().wait()
     finally:
         # Корректная остановка
-        await app.updater.stop()  # на всякий — снимет long-poll
+        if web is not None:
+            # вебхук не снимаем: Telegram придержит обновления до перезапуска
+            await web.stop()
+        else:
+            await app.updater.stop()  # на всякий — снимет long-poll
+        await stop_maintenance()
+        await stop_leader()
+        await stop_reminders()
+        await stop_outbox()  # досылаем очередь, пока бот ещё жив
         await app.stop()
         await app.shutdown()
+        if metrics_server is not None:
+            await metrics_server.stop()
+        await close_pool()
 
 def main():
     # Единый вход: запускаем всю логику в одном event loop
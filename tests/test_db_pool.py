@@ -0,0 +1,79 @@
+import asyncio
+import sys
+from collections.abc import Awaitable
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import bot
+
+
+def _run(coro: Awaitable[Any]) -> Any:
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db_path(monkeypatch, tmp_path):
+    path = tmp_path / "bot.sqlite"
+    monkeypatch.setattr(bot, "DB_PATH", str(path))
+    _run(bot.init_db())
+    return str(path)
+
+
+def test_pool_applies_pragmas_to_every_connection(db_path):
+    async def scenario():
+        await bot.open_pool(readers=2)
+        try:
+            async with bot.db_write() as db:
+                async with db.execute("PRAGMA journal_mode") as cur:
+                    writer_mode = (await cur.fetchone())[0]
+            async with bot.db_read() as db1, bot.db_read() as db2:
+                modes = []
+                for db in (db1, db2):
+                    async with db.execute("PRAGMA foreign_keys") as cur:
+                        modes.append((await cur.fetchone())[0])
+            return writer_mode, modes
+        finally:
+            await bot.close_pool()
+
+    writer_mode, fk = _run(scenario())
+    assert writer_mode == "wal"
+    assert fk == [1, 1]
+    assert bot._pool is None
+
+
+def test_pool_reuses_reader_connections(db_path):
+    async def scenario():
+        pool = await bot.open_pool(readers=1)
+        try:
+            async with bot.db_read() as first:
+                pass
+            async with bot.db_read() as second:
+                pass
+            return first is second, pool.size
+        finally:
+            await bot.close_pool()
+
+    same, size = _run(scenario())
+    assert same
+    assert size == 1
+
+
+def test_pool_write_rolls_back_on_error(db_path):
+    async def scenario():
+        await bot.open_pool(readers=1)
+        try:
+            with pytest.raises(RuntimeError):
+                async with bot.db_write() as db:
+                    await db.execute("INSERT INTO subscriber(chat_id) VALUES (1)")
+                    raise RuntimeError("boom")
+            async with bot.db_write() as db:
+                await db.execute("INSERT INTO subscriber(chat_id) VALUES (2)")
+            return await bot.get_subscribers()
+        finally:
+            await bot.close_pool()
+
+    assert _run(scenario()) == [2]
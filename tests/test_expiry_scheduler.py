@@ -0,0 +1,151 @@
+import asyncio
+import sys
+from collections.abc import Awaitable
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+from typing import Any
+from zoneinfo import ZoneInfo
+
+import aiosqlite
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import bot
+from test_reminders import DummyApplication, _insert_signature, _insert_subscriber
+
+
+def _run(coro: Awaitable[Any]) -> Any:
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db_path(monkeypatch, tmp_path):
+    path = tmp_path / "bot.sqlite"
+    monkeypatch.setattr(bot, "DB_PATH", str(path))
+    _run(bot.init_db())
+    bot.METRICS.reset()
+    yield str(path)
+    bot.METRICS.reset()
+
+
+async def _entity_id(db_path: str, name: str) -> int:
+    async with aiosqlite.connect(db_path) as db:
+        async with db.execute("SELECT id FROM entity WHERE name=?", (name,)) as cur:
+            return (await cur.fetchone())[0]
+
+
+def _sql_count() -> int:
+    return sum(h.count for h in bot.METRICS._hist.get("edsbot_sql_seconds", {}).values())
+
+
+async def _wait_sent(app, n: int, timeout: float = 5.0):
+    async with asyncio.timeout(timeout):
+        while len(app.bot.sent_messages) < n:
+            await asyncio.sleep(0.01)
+
+
+def test_window_holds_only_upcoming_events(db_path, monkeypatch):
+    monkeypatch.setattr(bot, "REMIND_AT", "09:00")
+    today = date.today()
+    _run(_insert_signature(db_path, name="Скоро", kind="person", expiry=today + timedelta(days=12)))
+    _run(_insert_signature(db_path, name="Нескоро", kind="person", expiry=today + timedelta(days=90)))
+
+    async def scenario():
+        scheduler = bot.ReminderScheduler(DummyApplication(), horizon_days=5)
+        await scheduler.reload(catch_up=False)
+        return len(scheduler), scheduler.next_event()
+
+    size, (fire_at, _, offset) = _run(scenario())
+    # из смещений 25..0 в ближайшие 5 дней попадает только «за 10 дней»
+    assert (size, offset) == (1, 10)
+    assert fire_at == datetime.combine(today + timedelta(days=2), time(9, 0), ZoneInfo(bot.TZ))
+
+
+def test_changed_signatures_replace_their_events(db_path, monkeypatch):
+    monkeypatch.setattr(bot, "REMIND_AT", "09:00")
+    today = date.today()
+    _run(_insert_signature(db_path, name="Иванов", kind="person", expiry=today + timedelta(days=12)))
+    eid = _run(_entity_id(db_path, "Иванов"))
+
+    async def scenario():
+        scheduler = bot.ReminderScheduler(DummyApplication(), horizon_days=5)
+        await scheduler.reload(catch_up=False)
+        monkeypatch.setattr(bot, "REMINDERS", scheduler)
+        async with bot.db_write() as db:
+            await bot.upsert_signature(db, eid, today + timedelta(days=3), None)
+        renewed = scheduler.next_event()[2]
+        async with bot.db_write() as db:
+            async with db.execute("SELECT id FROM signature WHERE entity_id=?", (eid,)) as cur:
+                sig_id = (await cur.fetchone())[0]
+        scheduler.signature_changed(sig_id, None)
+        return renewed, scheduler.next_event()
+
+    renewed, after_delete = _run(scenario())
+    # старое событие «за 10 дней» отброшено, новый срок дал «за 0 дней»
+    assert renewed == 0
+    assert after_delete is None
+
+
+def test_events_fire_without_rescanning(db_path, monkeypatch):
+    monkeypatch.setattr(bot, "REMIND_AT", "00:00")
+    today = date.today()
+    _run(_insert_subscriber(db_path, 101))
+    _run(_insert_signature(db_path, name="Иванов", kind="person", expiry=today + timedelta(days=5)))
+    _run(_insert_signature(db_path, name="Петров", kind="person", expiry=today + timedelta(days=40)))
+    eid = _run(_entity_id(db_path, "Петров"))
+    app = DummyApplication()
+
+    async def scenario():
+        await bot.open_pool(readers=1)
+        try:
+            scheduler = await bot.start_reminders(app)
+            await scheduler.reload()  # как при получении аренды: досылает сегодняшнее
+            await _wait_sent(app, 1)
+            await asyncio.sleep(0.1)
+            idle = _sql_count()
+            await asyncio.sleep(0.3)
+            idle_queries = _sql_count() - idle
+            # продлили срок так, что напоминание положено сегодня — приходит сразу
+            async with bot.db_write() as db:
+                await bot.upsert_signature(db, eid, today, None)
+            await _wait_sent(app, 2)
+            return idle_queries
+        finally:
+            await bot.stop_reminders()
+            await bot.close_pool()
+
+    assert _run(scenario()) == 0
+    texts = [text for _, text, _ in app.bot.sent_messages]
+    assert len(texts) == 2
+    assert "Иванов" in texts[0] and "Петров" in texts[1]
+
+
+def test_leader_picks_up_writes_of_other_processes(db_path, monkeypatch):
+    monkeypatch.setattr(bot, "REMIND_AT", "09:00")
+    monkeypatch.setattr(bot, "LEADER", None)
+    today = date.today()
+    app = DummyApplication()
+
+    async def scenario():
+        scheduler = bot.ReminderScheduler(app, horizon_days=5)
+        await scheduler.reload(catch_up=False)
+        monkeypatch.setattr(bot, "REMINDERS", scheduler)
+        lease = await bot.start_leader(app)
+        try:
+            await lease._acquired_task
+            before = scheduler.next_event()
+            await lease._beat()
+            unchanged = scheduler.next_event()
+            # запись другого процесса: мимо REMINDERS этого
+            await _insert_signature(db_path, name="Иванов", kind="person",
+                                    expiry=today + timedelta(days=12))
+            await lease._beat()
+            return before, unchanged, scheduler.next_event()
+        finally:
+            await bot.stop_leader()
+
+    before, unchanged, after = _run(scenario())
+    assert before is None and unchanged is None
+    assert after[2] == 10
+    assert after[0] == datetime.combine(today + timedelta(days=2), time(9, 0), ZoneInfo(bot.TZ))
@@ -0,0 +1,79 @@
+import asyncio
+import gzip
+import json
+import sys
+from collections.abc import Awaitable
+from datetime import date
+from pathlib import Path
+from typing import Any
+
+import aiosqlite
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import bot
+from test_reminders import _insert_signature
+
+
+def _run(coro: Awaitable[Any]) -> Any:
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db_path(monkeypatch, tmp_path):
+    path = tmp_path / "bot.sqlite"
+    monkeypatch.setattr(bot, "DB_PATH", str(path))
+    _run(bot.init_db())
+    _run(_insert_signature(db_path=str(path), name="Иванов", kind="person",
+                           expiry=date(2026, 5, 1), note="токен", group="РЦНТ"))
+    return str(path)
+
+
+async def _add_history(db_path: str, name: str, expiry: str):
+    async with aiosqlite.connect(db_path) as db:
+        await db.execute(
+            "INSERT INTO signature(entity_id, expiry, active) "
+            "SELECT id, ?, 0 FROM entity WHERE name=?", (expiry, name)
+        )
+        await db.commit()
+
+
+async def _active(db_path: str) -> list[tuple]:
+    async with aiosqlite.connect(db_path) as db:
+        async with db.execute(
+            "SELECT entity_id, expiry, note FROM signature WHERE active=1 ORDER BY entity_id"
+        ) as cur:
+            return await cur.fetchall()
+
+
+def test_jsonl_gzip_export_streams_all_sections(db_path, tmp_path):
+    _run(_add_history(db_path, "Иванов", "2024-05-01"))
+    out = tmp_path / "out.jsonl.gz"
+
+    counts = _run(bot.export_registry(str(out), "jsonl", compress=True))
+
+    with gzip.open(out, "rt", encoding="utf-8") as fh:
+        records = [json.loads(line) for line in fh]
+    by_section = {s: [r for r in records if r["section"] == s] for s in counts}
+    assert {s: len(rs) for s, rs in by_section.items()} == counts
+    assert "Управление культуры / РЦНТ" in [r["group"] for r in by_section["group"]]
+    ivanov = next(r for r in by_section["entity"] if r["name"] == "Иванов")
+    assert (ivanov["group"], ivanov["expiry"], ivanov["note"], ivanov["active"]) == \
+        ("Управление культуры / РЦНТ", "2026-05-01", "токен", 1)
+    assert [(r["name"], r["expiry"], r["active"]) for r in by_section["history"]] == \
+        [("Иванов", "2024-05-01", 0)]
+
+
+def test_csv_export_imports_back_unchanged(db_path, tmp_path):
+    _run(_add_history(db_path, "Иванов", "2024-05-01"))
+    out = tmp_path / "out.csv"
+    before = _run(_active(db_path))
+
+    counts = _run(bot.export_registry(str(out), "csv"))
+    stats, errors = _run(bot.import_registry(bot.read_import_table("out.csv", out.read_bytes())))
+
+    assert errors == []
+    assert stats["rows"] == counts["entity"]
+    assert stats["created"] == 0
+    assert _run(_active(db_path)) == before
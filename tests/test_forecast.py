@@ -0,0 +1,101 @@
+import asyncio
+import sys
+from collections.abc import Awaitable
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any
+
+import aiosqlite
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import bot
+from test_reminders import _insert_signature
+
+
+def _run(coro: Awaitable[Any]) -> Any:
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db_path(monkeypatch, tmp_path):
+    path = tmp_path / "bot.sqlite"
+    monkeypatch.setattr(bot, "DB_PATH", str(path))
+    _run(bot.init_db())
+    bot.METRICS.reset()
+    yield str(path)
+    bot.METRICS.reset()
+    bot.ORG_CACHE.clear()
+
+
+def _sql_count() -> int:
+    return sum(h.count for h in bot.METRICS._hist.get("edsbot_sql_seconds", {}).values())
+
+
+def _bars(text: str) -> dict[str, int]:
+    body = text.split("```")[1]
+    counts = {}
+    for line in body.strip().splitlines():
+        label, *_, tail = line.split()
+        counts[label] = 0 if tail == "·" else int(tail)
+    return counts
+
+
+async def _expiry_day(db_path: str) -> int:
+    async with aiosqlite.connect(db_path) as db:
+        async with db.execute("SELECT expiry_day FROM signature") as cur:
+            return (await cur.fetchone())[0]
+
+
+def test_day_number_matches_generated_column(db_path):
+    day = date(2026, 3, 1)
+    _run(_insert_signature(db_path, name="Иванов", kind="person", expiry=day))
+    assert _run(_expiry_day(db_path)) == bot._day_number(day)
+
+
+def test_monthly_histogram_per_subtree(db_path):
+    today = date.today()
+    next_month = date(today.year + (today.month == 12), today.month % 12 + 1, 1)
+    _run(_insert_signature(db_path, name="Иванов", kind="person", expiry=today, group="РЦНТ"))
+    _run(_insert_signature(db_path, name="Петров", kind="person", expiry=next_month, group="ЦБС"))
+    _run(_insert_signature(db_path, name="Сидоров", kind="person", expiry=next_month, group="Школа с. Мулино"))
+    _run(_insert_signature(db_path, name="Просрочен", kind="person", expiry=today - timedelta(days=1)))
+    _run(_insert_signature(db_path, name="Нескоро", kind="person", expiry=today + timedelta(days=800)))
+
+    async def scenario():
+        culture = (await bot.resolve_scope_group("культуры"))["id"]
+        return await bot.build_forecast_view("month"), await bot.build_forecast_view("month", culture)
+
+    (everything, markup), (culture, _) = _run(scenario())
+    bars = _bars(everything)
+    assert len(bars) == bot.FORECAST_MONTHS
+    assert bars[today.strftime("%m.%Y")] == 1
+    assert bars[next_month.strftime("%m.%Y")] == 2
+    assert sum(bars.values()) == 3
+    assert "Управление культуры" in culture
+    assert sum(_bars(culture).values()) == 2
+    assert markup.inline_keyboard[0][0].callback_data == "stats:week:"
+
+
+def test_weekly_histogram_is_cached_until_write(db_path):
+    today = date.today()
+    _run(_insert_signature(db_path, name="Иванов", kind="person", expiry=today + timedelta(days=8)))
+
+    async def scenario():
+        first, _ = await bot.build_forecast_view("week")
+        queries = _sql_count()
+        again, _ = await bot.build_forecast_view("week")
+        cached = _sql_count() - queries
+        async with bot.db_read() as db:
+            async with db.execute("SELECT id FROM entity WHERE name='Иванов'") as cur:
+                eid = (await cur.fetchone())[0]
+        async with bot.db_write() as db:
+            await bot.upsert_signature(db, eid, today + timedelta(days=1), None)
+        renewed, _ = await bot.build_forecast_view("week")
+        return first, again, cached, renewed
+
+    first, again, cached, renewed = _run(scenario())
+    assert first == again and cached == 0
+    assert _bars(first)[(today + timedelta(weeks=1)).strftime("%d.%m")] == 1
+    assert _bars(renewed)[today.strftime("%d.%m")] == 1
@@ -0,0 +1,190 @@
+import asyncio
+import sys
+from collections.abc import Awaitable
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any
+
+import aiosqlite
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import bot
+from test_reminders import _insert_signature
+
+
+def _run(coro: Awaitable[Any]) -> Any:
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db_path(monkeypatch, tmp_path):
+    path = tmp_path / "bot.sqlite"
+    monkeypatch.setattr(bot, "DB_PATH", str(path))
+    monkeypatch.setattr(bot, "_grp_stats_day", None)
+    _run(bot.init_db())
+    yield str(path)
+    bot.ORG_CACHE.clear()
+
+
+async def _stats(db_path: str) -> dict[str, tuple]:
+    async with aiosqlite.connect(db_path) as db:
+        async with db.execute(
+            "SELECT g.name, s.expired, s.expiring, s.unsigned FROM grp_stats s JOIN grp g ON g.id=s.group_id"
+        ) as cur:
+            return {name: tuple(rest) for name, *rest in await cur.fetchall()}
+
+
+async def _recomputed(db_path: str, day: date) -> dict[str, tuple]:
+    """Те же счётчики, посчитанные с нуля по реестру."""
+    async with aiosqlite.connect(db_path) as db:
+        async with db.execute(
+            """
+            WITH RECURSIVE sub(root, id) AS (
+                SELECT id, id FROM grp
+                UNION ALL
+                SELECT sub.root, g.id FROM sub JOIN grp g ON g.parent_id=sub.id
+            ),
+            st AS (
+                SELECT e.group_id,
+                       (SELECT min(expiry) FROM signature s WHERE s.entity_id=e.id AND s.active=1) AS expiry
+                FROM entity e
+            )
+            SELECT g.name,
+                   count(st.group_id) FILTER (WHERE st.expiry < :day),
+                   count(st.group_id) FILTER (WHERE st.expiry >= :day AND st.expiry < date(:day, '+30 days')),
+                   count(st.group_id) FILTER (WHERE st.expiry IS NULL)
+            FROM grp g JOIN sub ON sub.root=g.id LEFT JOIN st ON st.group_id=sub.id
+            GROUP BY g.id
+            """,
+            {"day": day.isoformat()},
+        ) as cur:
+            return {name: tuple(rest) for name, *rest in await cur.fetchall()}
+
+
+async def _entity_id(name: str) -> int:
+    async with bot.db_read() as db:
+        async with db.execute("SELECT id FROM entity WHERE name=?", (name,)) as cur:
+            return (await cur.fetchone())[0]
+
+
+def test_triggers_keep_counters_in_sync(db_path):
+    today = date.today()
+    _run(_insert_signature(db_path, name="Иванов", kind="person", expiry=today - timedelta(days=1), group="РЦНТ"))
+    _run(_insert_signature(db_path, name="Петров", kind="person", expiry=today + timedelta(days=10), group="ЦБС"))
+    _run(_insert_signature(db_path, name="Сидоров", kind="person", expiry=today + timedelta(days=90),
+                           group="Школа с. Мулино"))
+    checks = [_run(_stats(db_path)) == _run(_recomputed(db_path, today))]
+    assert _run(_stats(db_path))["Управление культуры"] == (1, 1, 3)
+
+    async def edits():
+        async with bot.db_write() as db:
+            # продление просроченной подписи
+            await bot.upsert_signature(db, await _entity_id("Иванов"), today + timedelta(days=400), None)
+        async with bot.db_write() as db:
+            # перевод сотрудника в другую организацию
+            school = (await bot.resolve_scope_group("Мулино"))["id"]
+            await db.execute("UPDATE entity SET group_id=? WHERE name='Петров'", (school,))
+            await db.execute("DELETE FROM signature WHERE entity_id=?", (await _entity_id("Сидоров"),))
+            await db.commit()
+
+    _run(edits())
+    checks.append(_run(_stats(db_path)) == _run(_recomputed(db_path, today)))
+    stats = _run(_stats(db_path))
+    assert checks == [True, True]
+    assert stats["Управление культуры"] == (0, 0, 3)
+    assert stats["Управление образования"] == (0, 1, 3)
+
+
+def test_new_day_moves_crossed_signatures(db_path):
+    today = date.today()
+    _run(_insert_signature(db_path, name="Иванов", kind="person", expiry=today + timedelta(days=2), group="РЦНТ"))
+    _run(_insert_signature(db_path, name="Петров", kind="person", expiry=today + timedelta(days=33), group="РЦНТ"))
+    _run(bot.refresh_grp_stats(today))
+    assert _run(_stats(db_path))["РЦНТ"] == (0, 1, 1)
+
+    later = today + timedelta(days=5)
+    _run(bot.refresh_grp_stats(later))
+    assert _run(_stats(db_path)) == _run(_recomputed(db_path, later))
+    assert _run(_stats(db_path))["РЦНТ"] == (1, 1, 1)
+
+
+def test_browse_buttons_show_subtree_counters(db_path):
+    today = date.today()
+    _run(_insert_signature(db_path, name="Иванов", kind="person", expiry=today - timedelta(days=3), group="РЦНТ"))
+    _run(_insert_signature(db_path, name="Петров", kind="person", expiry=today + timedelta(days=3), group="ЦБС"))
+
+    text, markup = _run(bot.build_tree_view("browse", None))
+    labels = [row[0].text for row in markup.inline_keyboard]
+    assert "🏢 Управление культуры · 🔴1 🟡1 ⚪3" in labels
+    assert "🏢 Управление образования · ⚪2" in labels
+    assert bot.GRP_STATS_LEGEND in text
+
+
+def test_import_rebuilds_counters_once(db_path):
+    today = date.today()
+    _run(_insert_signature(db_path, name="Иванов", kind="person", expiry=today + timedelta(days=200), group="РЦНТ"))
+    expired = (today - timedelta(days=1)).strftime("%d.%m.%Y")
+    soon = (today + timedelta(days=5)).strftime("%d.%m.%Y")
+    table = [
+        (1, ["имя", "группа", "срок"]),
+        (2, ["Иванов", "ЦБС", expired]),
+        (3, ["Петров", "РЦНТ", soon]),
+        (4, ["Сидоров", "Школа с. Мулино", ""]),
+    ]
+    stats, errors = _run(bot.import_registry(table))
+
+    assert errors == [] and stats["rows"] == 3
+    assert _run(_stats(db_path)) == _run(_recomputed(db_path, today))
+    assert _run(_stats(db_path))["Управление культуры"] == (1, 1, 3)
+
+    async def bulk_flag():
+        async with bot.db_read() as db:
+            async with db.execute("SELECT count(*) FROM meta WHERE key='grp_stats_bulk'") as cur:
+                return (await cur.fetchone())[0]
+
+    assert _run(bulk_flag()) == 0
+
+
+def test_other_process_counter_changes_reach_cached_screens(db_path, monkeypatch):
+    monkeypatch.setattr(bot, "RENDER_SYNC_INTERVAL", 0)
+    today = date.today()
+
+    async def failing_refresh(*args, **kwargs):
+        raise AssertionError("экран дерева не должен писать в базу")
+
+    monkeypatch.setattr(bot, "refresh_grp_stats", failing_refresh)
+
+    async def scenario():
+        _, before = await bot.build_tree_view("browse", None)
+        # запись другого процесса: registry_changed этого не вызывается
+        await _insert_signature(db_path, name="Иванов", kind="person",
+                                expiry=today - timedelta(days=3), group="РЦНТ")
+        _, after = await bot.build_tree_view("browse", None)
+        return [row[0].text for row in before.inline_keyboard], [row[0].text for row in after.inline_keyboard]
+
+    before, after = _run(scenario())
+    assert "🏢 Управление культуры · ⚪3" in before
+    assert "🏢 Управление культуры · 🔴1 ⚪3" in after
+
+
+def test_leader_moves_counters_to_new_day(db_path, monkeypatch):
+    today = date.today()
+    _run(_insert_signature(db_path, name="Иванов", kind="person", expiry=today - timedelta(days=1), group="РЦНТ"))
+    _run(bot.refresh_grp_stats(today - timedelta(days=2)))
+    assert _run(_stats(db_path))["РЦНТ"] == (0, 1, 1)
+    monkeypatch.setattr(bot, "LEADER", None)
+    monkeypatch.setattr(bot, "REMINDERS", None)
+    monkeypatch.setattr(bot, "catch_up_reminders", lambda application: asyncio.sleep(0))
+
+    async def scenario():
+        lease = await bot.start_leader(None)
+        try:
+            await lease._acquired_task
+        finally:
+            await bot.stop_leader()
+
+    _run(scenario())
+    assert _run(_stats(db_path))["РЦНТ"] == (1, 0, 1)
+    assert _run(_stats(db_path)) == _run(_recomputed(db_path, today))
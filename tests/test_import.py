@@ -0,0 +1,188 @@
+import asyncio
+import io
+import sys
+import zipfile
+from collections.abc import Awaitable
+from datetime import date
+from pathlib import Path
+from typing import Any
+from xml.sax.saxutils import escape
+
+import aiosqlite
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import bot
+from test_reminders import _insert_signature
+
+
+def _run(coro: Awaitable[Any]) -> Any:
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db_path(monkeypatch, tmp_path):
+    path = tmp_path / "bot.sqlite"
+    monkeypatch.setattr(bot, "DB_PATH", str(path))
+    _run(bot.init_db())
+    yield str(path)
+    bot.ORG_CACHE.clear()
+
+
+def _xlsx(rows: list[list[str | int]]) -> bytes:
+    """Минимальная книга: строки через sharedStrings, числа как есть."""
+    shared: list[str] = []
+    sheet_rows = []
+    for r, row in enumerate(rows, start=1):
+        cells = []
+        for c, value in enumerate(row):
+            ref = f"{chr(ord('A') + c)}{r}"
+            if isinstance(value, int):
+                cells.append(f'<c r="{ref}"><v>{value}</v></c>')
+            else:
+                shared.append(value)
+                cells.append(f'<c r="{ref}" t="s"><v>{len(shared) - 1}</v></c>')
+        sheet_rows.append(f'<row r="{r}">{"".join(cells)}</row>')
+    ns = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("xl/worksheets/sheet1.xml",
+                    f'<worksheet {ns}><sheetData>{"".join(sheet_rows)}</sheetData></worksheet>')
+        zf.writestr("xl/sharedStrings.xml",
+                    f'<sst {ns}>' + "".join(f"<si><t>{escape(s)}</t></si>" for s in shared) + "</sst>")
+    return buf.getvalue()
+
+
+async def _signatures(db_path: str) -> dict[str, tuple]:
+    async with aiosqlite.connect(db_path) as db:
+        async with db.execute("""
+            SELECT e.name, e.kind, g.name, s.expiry, s.note
+            FROM entity e
+            LEFT JOIN grp g ON g.id = e.group_id
+            LEFT JOIN signature s ON s.entity_id = e.id AND s.active = 1
+        """) as cur:
+            return {r[0]: r[1:] for r in await cur.fetchall()}
+
+
+def test_csv_import_upserts_registry_and_signatures(db_path):
+    _run(_insert_signature(db_path, name="Иванов", kind="person", expiry=date(2025, 1, 1)))
+
+    async def seed_log():
+        async with aiosqlite.connect(db_path) as db:
+            await db.execute(
+                "INSERT INTO reminder_log(signature_id, offset_days, chat_id, sent_at) "
+                "SELECT id, 5, 1, '2024-12-27' FROM signature"
+            )
+            await db.commit()
+
+    _run(seed_log())
+    data = (
+        "Группа;Имя;Тип;Срок;Примечание\n"
+        "Управление культуры / РЦНТ;Иванов;ФЛ;31.12.2026;продлено\n"
+        "ЦБС;Петров;;2026-03-01;\n"
+        "Администрация района;ООО Ромашка;ЮЛ;;\n"
+        ";;;;\n"
+    ).encode("utf-8-sig")
+
+    stats, errors = _run(bot.import_registry(bot.read_import_table("reg.csv", data)))
+
+    assert errors == []
+    assert stats == {"rows": 3, "created": 2, "updated": 1,
+                     "signatures_added": 1, "signatures_updated": 1}
+    rows = _run(_signatures(db_path))
+    assert rows["Иванов"] == ("person", "РЦНТ", "2026-12-31", "продлено")
+    assert rows["Петров"] == ("person", "ЦБС", "2026-03-01", None)
+    assert rows["ООО Ромашка"] == ("org", "Администрация района", None, None)
+
+    async def log_rows():
+        async with aiosqlite.connect(db_path) as db:
+            async with db.execute("SELECT count(*) FROM reminder_log") as cur:
+                return (await cur.fetchone())[0]
+
+    assert _run(log_rows()) == 0
+
+
+def test_invalid_rows_are_reported_and_nothing_is_written(db_path):
+    data = (
+        "name,group,kind,expiry\n"
+        "Сидоров,РЦНТ,ФЛ,01.02.2026\n"
+        ",РЦНТ,ФЛ,01.02.2026\n"
+        "Козлов,Нет такой,ФЛ,\n"
+        "Орлов,Управление образования/РЦНТ,ФЛ,\n"
+        "Сидоров,ЦБС,ФЛ,\n"
+        "Волков,ЦБС,робот,\n"
+        "Зайцев,ЦБС,ФЛ,32.13.2026\n"
+    ).encode("cp1251")
+    before = _run(_signatures(db_path))
+
+    stats, errors = _run(bot.import_registry(bot.read_import_table("reg.csv", data)))
+
+    assert stats is None
+    assert [line for line, _ in errors] == [3, 4, 5, 6, 7, 8]
+    assert "Нет такой" in errors[1][1]
+    assert "строке 2" in errors[3][1]
+    assert _run(_signatures(db_path)) == before
+    report = bot.build_import_report(stats, errors)
+    assert report[0].startswith("❌ Импорт не выполнен, ошибок: 6")
+
+
+def test_xlsx_import_reads_shared_strings_and_serial_dates(db_path):
+    data = _xlsx([
+        ["имя", "группа", "срок", "примечание"],
+        ["Смирнова", "Школа с. Мулино", 46387, "токен <2>"],
+    ])
+
+    stats, errors = _run(bot.import_registry(bot.read_import_table("Реестр.XLSX", data)))
+
+    assert errors == []
+    assert stats["signatures_added"] == 1
+    assert _run(_signatures(db_path))["Смирнова"] == ("person", "Школа с. Мулино", "2026-12-31", "токен <2>")
+
+
+def test_digit_only_dates_are_serials_only_in_xlsx_numbers(db_path):
+    csv_data = (
+        "имя;срок\n"
+        "Иванов;20260115\n"
+        "Петров;01152026\n"
+    ).encode("utf-8")
+    _, csv_errors = _run(bot.import_registry(bot.read_import_table("reg.csv", csv_data)))
+    xlsx_data = _xlsx([["имя", "срок"], ["Сидоров", 20260115]])
+    stats, xlsx_errors = _run(bot.import_registry(bot.read_import_table("reg.xlsx", xlsx_data)))
+
+    # компактная дата в CSV — обычная дата, а не серийный номер
+    assert csv_errors == [(3, "неверная дата «01152026»")]
+    # слишком большой серийный номер — ошибка строки, а не падение импорта
+    assert stats is None
+    assert xlsx_errors == [(2, "неверная дата «20260115»")]
+    assert bot._import_date("20260115") == date(2026, 1, 15)
+
+
+def test_import_refreshes_org_cache(db_path):
+    async def scenario():
+        await bot.ORG_CACHE.load()
+        gid = (await bot.list_groups(None))[0]["id"]
+        await bot.list_group_persons(gid)
+        name = bot.ORG_CACHE.group(gid)["name"]
+        table = [(1, ["имя", "группа"]), (2, ["Новиков", name])]
+        await bot.import_registry(table)
+        return [p["name"] for p in await bot.list_group_persons(gid)]
+
+    assert _run(scenario()) == ["Новиков"]
+
+
+def test_header_without_name_is_rejected(db_path):
+    with pytest.raises(ValueError):
+        _run(bot.import_registry([(1, ["группа", "срок"]), (2, ["РЦНТ", "01.01.2026"])]))
+
+
+def test_reimport_without_kind_keeps_existing_kind(db_path):
+    _run(_insert_signature(db_path, name="ООО Ромашка", kind="org", expiry=date(2025, 1, 1)))
+    table = [(1, ["имя", "срок"]), (2, ["ООО Ромашка", "31.12.2026"]), (3, ["Новиков", "01.03.2026"])]
+
+    stats, errors = _run(bot.import_registry(table))
+
+    assert errors == [] and stats["created"] == 1
+    rows = _run(_signatures(db_path))
+    assert rows["ООО Ромашка"] == ("org", None, "2026-12-31", None)
+    assert rows["Новиков"] == ("person", None, "2026-03-01", None)
@@ -0,0 +1,103 @@
+import asyncio
+import sys
+from collections.abc import Awaitable
+from datetime import date, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import bot
+from test_reminders import _insert_signature
+
+
+class FakeInlineQuery:
+    def __init__(self, user_id: int, query: str) -> None:
+        self.from_user = SimpleNamespace(id=user_id)
+        self.query = query
+        self.answers: list[tuple[list, dict]] = []
+
+    async def answer(self, results, **kwargs):
+        self.answers.append((list(results), kwargs))
+
+
+def _run(coro: Awaitable[Any]) -> Any:
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db_path(monkeypatch, tmp_path):
+    path = tmp_path / "bot.sqlite"
+    monkeypatch.setattr(bot, "DB_PATH", str(path))
+    monkeypatch.setattr(bot, "ADMIN_IDS", {42})
+    _run(bot.init_db())
+    _run(_insert_signature(str(path), name="Иванов Пётр", kind="person",
+                           expiry=date.today() + timedelta(days=3), note="токен"))
+    yield str(path)
+    bot.INLINE_CACHE.clear()
+
+
+def _ask(user_id: int, query: str) -> FakeInlineQuery:
+    iq = FakeInlineQuery(user_id, query)
+    _run(bot.on_inline_query(SimpleNamespace(inline_query=iq), None))
+    return iq
+
+
+def test_inline_query_returns_signature_rows_for_admins(db_path):
+    iq = _ask(42, "  иВАНОВ ")
+
+    (results, kwargs), = iq.answers
+    assert kwargs == {"cache_time": bot.INLINE_CACHE_TIME, "is_personal": True}
+    assert [r.title for r in results] == ["[ФЛ] Иванов Пётр"]
+    assert results[0].description.endswith("через 3 дн.")
+    assert "Примечание: токен" in results[0].input_message_content.message_text
+
+
+def test_inline_query_ignores_non_admins(db_path, monkeypatch):
+    assert _ask(7, "иванов").answers[0][0] == []
+    monkeypatch.setattr(bot, "ADMIN_IDS", set())
+    assert _ask(42, "иванов").answers[0][0] == []
+
+
+def test_empty_inline_query_lists_upcoming(db_path):
+    results = _ask(42, "").answers[0][0]
+    assert [r.title for r in results] == ["[ФЛ] Иванов Пётр"]
+
+
+def test_inline_cache_is_invalidated_by_writes(db_path, monkeypatch):
+    calls = []
+    search = bot.search_entities
+
+    async def counting_search(*args, **kwargs):
+        calls.append(args)
+        return await search(*args, **kwargs)
+
+    monkeypatch.setattr(bot, "search_entities", counting_search)
+    _ask(42, "Иванов")
+    first = _ask(42, "иванов  ").answers[0][0]
+    assert len(calls) == 1
+
+    async def renew():
+        async with bot.db_write() as db:
+            await bot.upsert_signature(db, int(first[0].id), date(2030, 1, 31), None)
+
+    _run(renew())
+    renewed = _ask(42, "иванов").answers[0][0]
+    assert len(calls) == 2
+    assert renewed[0].description.startswith("до 31.01.2030")
+
+
+def test_ttl_cache_expires_and_evicts(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(bot.time, "monotonic", lambda: now[0])
+    cache = bot.TtlCache(ttl=10, maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    now[0] += 11
+    assert cache.get("a") is None
@@ -0,0 +1,124 @@
+import asyncio
+import sqlite3
+import subprocess
+import sys
+import time
+from collections.abc import Awaitable
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+import bot
+from test_reminders import DummyApplication, _insert_signature, _insert_subscriber
+
+# Отдельный процесс бота: держит аренду с коротким сроком, пока его не убьют
+WORKER = """
+import asyncio, sys
+sys.path.insert(0, sys.argv[1])
+import bot
+bot.DB_PATH = sys.argv[2]
+
+async def main():
+    await bot.open_pool(readers=1)
+    lease = bot.LeaderLease(ttl=1.0, holder=sys.argv[3])
+    await lease.start()
+    print("started", flush=True)
+    await asyncio.Event().wait()
+
+asyncio.run(main())
+"""
+
+
+def _run(coro: Awaitable[Any]) -> Any:
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db_path(monkeypatch, tmp_path):
+    path = tmp_path / "bot.sqlite"
+    monkeypatch.setattr(bot, "DB_PATH", str(path))
+    _run(bot.init_db())
+    return str(path)
+
+
+def _holder(db_path: str) -> str | None:
+    with sqlite3.connect(db_path, timeout=5) as db:
+        row = db.execute("SELECT holder FROM lease WHERE name='scheduler'").fetchone()
+    return row[0] if row else None
+
+
+def _wait_for_holder(db_path: str, holder: str, timeout: float) -> float:
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        if _holder(db_path) == holder:
+            return time.monotonic() - started
+        time.sleep(0.05)
+    raise AssertionError(f"{holder} не получил аренду за {timeout} с, держит {_holder(db_path)}")
+
+
+def _spawn(db_path: str, holder: str) -> subprocess.Popen:
+    proc = subprocess.Popen([sys.executable, "-c", WORKER, str(ROOT), db_path, holder],
+                            stdout=subprocess.PIPE, text=True)
+    assert proc.stdout.readline().strip() == "started"
+    return proc
+
+
+def test_only_one_holder_until_it_expires(db_path):
+    async def scenario():
+        a = bot.LeaderLease(ttl=0.3, holder="a")
+        b = bot.LeaderLease(ttl=0.3, holder="b")
+        steps = [await a.try_acquire(), await b.try_acquire(), await a.try_acquire()]
+        await asyncio.sleep(0.4)  # «a» перестал продлевать
+        steps += [await b.try_acquire(), await a.try_acquire()]
+        return steps, a.is_leader, b.is_leader
+
+    steps, a_leads, b_leads = _run(scenario())
+    assert steps == [True, False, True, True, False]
+    assert (a_leads, b_leads) == (False, True)
+
+
+def test_follower_skips_scheduled_reminders(db_path, monkeypatch):
+    _run(_insert_subscriber(db_path, 101))
+    _run(_insert_signature(db_path, name="Иванов", kind="person",
+                           expiry=date.today() + timedelta(days=5)))
+    app = DummyApplication()
+
+    async def scenario():
+        leader = bot.LeaderLease(holder="other")
+        await leader.try_acquire()
+        monkeypatch.setattr(bot, "LEADER", bot.LeaderLease(holder="me"))
+        await bot.LEADER.try_acquire()
+        await bot.scheduled_reminders(app)
+        skipped = list(app.bot.sent_messages)
+        await leader.release()
+        await bot.LEADER.try_acquire()
+        await bot.scheduled_reminders(app)
+        return skipped
+
+    assert _run(scenario()) == []
+    assert [chat_id for chat_id, _, _ in app.bot.sent_messages] == [101]
+
+
+def test_second_process_takes_over_when_leader_dies(db_path):
+    first = _spawn(db_path, "first")
+    second = None
+    try:
+        _wait_for_holder(db_path, "first", timeout=5)
+        second = _spawn(db_path, "second")
+        time.sleep(2.5)  # несколько сроков аренды: живой лидер её не отдаёт
+        assert _holder(db_path) == "first"
+
+        first.kill()
+        first.wait()
+        # срок 1 с и продление раз в 1/3 с — новый лидер в пределах пары секунд
+        assert _wait_for_holder(db_path, "second", timeout=5) < 2.5
+    finally:
+        for proc in (first, second):
+            if proc is not None and proc.poll() is None:
+                proc.kill()
+                proc.wait()
@@ -0,0 +1,157 @@
+import asyncio
+import sys
+from collections.abc import Awaitable
+from datetime import date
+from pathlib import Path
+from typing import Any
+
+import httpx
+import pytest
+from telegram.error import NetworkError
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import bot
+from test_reminders import DummyApplication, _insert_signature
+
+
+def _run(coro: Awaitable[Any]) -> Any:
+    return asyncio.run(coro)
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    bot.METRICS.reset()
+    yield
+    bot.METRICS.reset()
+
+
+@pytest.fixture
+def db_path(monkeypatch, tmp_path):
+    path = tmp_path / "bot.sqlite"
+    monkeypatch.setattr(bot, "DB_PATH", str(path))
+    _run(bot.init_db())
+    return str(path)
+
+
+def test_histogram_renders_cumulative_buckets():
+    bot.METRICS.observe("edsbot_handler_seconds", 0.003, handler="on_text")
+    bot.METRICS.observe("edsbot_handler_seconds", 0.2, handler="on_text")
+    bot.METRICS.observe("edsbot_handler_seconds", 30, handler="on_text")
+    bot.METRICS.inc("edsbot_bot_api_errors_total", method="sendMessage", code='4"03')
+
+    lines = bot.METRICS.render().splitlines()
+
+    assert "# TYPE edsbot_handler_seconds histogram" in lines
+    assert 'edsbot_handler_seconds_bucket{handler="on_text",le="0.005"} 1' in lines
+    assert 'edsbot_handler_seconds_bucket{handler="on_text",le="0.25"} 2' in lines
+    assert 'edsbot_handler_seconds_bucket{handler="on_text",le="10.0"} 2' in lines
+    assert 'edsbot_handler_seconds_bucket{handler="on_text",le="+Inf"} 3' in lines
+    assert 'edsbot_handler_seconds_count{handler="on_text"} 3' in lines
+    assert 'edsbot_bot_api_errors_total{method="sendMessage",code="4\\"03"} 1' in lines
+    # пустые метрики не выводятся
+    assert not any("edsbot_sql_seconds" in line for line in lines)
+
+
+def test_metered_handler_counts_errors():
+    async def on_text(update, context):
+        raise RuntimeError("boom")
+
+    wrapped = bot.metered_handler(on_text)
+    with pytest.raises(RuntimeError):
+        _run(wrapped(None, None))
+
+    assert wrapped.__name__ == "on_text"
+    assert bot.METRICS.counter("edsbot_handler_errors_total", handler="on_text") == 1
+    assert bot.METRICS.histogram("edsbot_handler_seconds", handler="on_text").count == 1
+
+
+def test_sql_statements_are_timed_by_normalized_text(db_path):
+    async def scenario():
+        await bot.open_pool(readers=1)
+        try:
+            async with bot.db_read() as db:
+                for ids in ((1,), (1, 2, 3)):
+                    marks = ",".join("?" * len(ids))
+                    async with db.execute(f"SELECT id FROM grp\n  WHERE id IN ({marks})", ids) as cur:
+                        await cur.fetchall()
+                with pytest.raises(Exception):
+                    await db.execute("SELECT nope FROM grp")
+        finally:
+            await bot.close_pool()
+
+    _run(scenario())
+
+    hist = bot.METRICS.histogram("edsbot_sql_seconds", statement="SELECT id FROM grp WHERE id IN (?…)")
+    assert hist is not None and hist.count == 2
+    assert bot.METRICS.counter("edsbot_sql_errors_total", statement="SELECT nope FROM grp") == 1
+
+
+def test_bot_api_requests_are_labelled_by_method(monkeypatch):
+    replies = iter([(200, b"{}"), (429, b"{}"), NetworkError("reset")])
+
+    async def fake_do_request(self, url, method, request_data=None, **kwargs):
+        reply = next(replies)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    monkeypatch.setattr(bot.HTTPXRequest, "do_request", fake_do_request)
+    request = bot.MeteredRequest()
+    url = "https://api.telegram.org/bot123:SECRET/sendMessage"
+
+    async def scenario():
+        await request.do_request(url, "POST")
+        await request.do_request(url, "POST")
+        with pytest.raises(NetworkError):
+            await request.do_request(url, "POST")
+
+    _run(scenario())
+
+    assert bot.METRICS.histogram("edsbot_bot_api_seconds", method="sendMessage").count == 3
+    assert bot.METRICS.counter("edsbot_bot_api_errors_total", method="sendMessage", code="429") == 1
+    assert bot.METRICS.counter("edsbot_bot_api_errors_total", method="sendMessage",
+                               code="NetworkError") == 1
+    assert "SECRET" not in bot.METRICS.render()
+
+
+def test_reminder_fanout_is_counted(db_path):
+    for name in ("Иванов", "Петров"):
+        _run(_insert_signature(db_path, name=name, kind="person", expiry=date(2026, 5, 1)))
+    messages = [(1, "a", [(1, 5), (2, 5)]), (2, "b", [(1, 5)])]
+    _run(bot._dispatch_reminders(DummyApplication(), messages))
+
+    assert bot.METRICS.counter("edsbot_reminder_runs_total") == 1
+    assert bot.METRICS.counter("edsbot_reminder_items_total") == 3
+    assert bot.METRICS.counter("edsbot_reminder_messages_total", via="direct") == 2
+
+
+def test_metrics_endpoint_serves_text_format(monkeypatch):
+    monkeypatch.setattr(bot, "METRICS_PORT", 0)
+    assert _run(bot.start_metrics_server()) is None
+
+    bot.METRICS.observe("edsbot_tree_action_seconds", 0.01, mode="browse", action="enter")
+
+    async def scenario():
+        server = bot.HttpServer("127.0.0.1", 0)
+        server.route("GET", "/metrics", bot.metrics_endpoint)
+        await server.start()
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{server.port}") as client:
+                return await client.get("/metrics")
+        finally:
+            await server.stop(timeout=1)
+
+    resp = _run(scenario())
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'edsbot_tree_action_seconds_count{mode="browse",action="enter"} 1' in resp.text
+
+
+def test_bot_api_request_keeps_a_connection_pool(monkeypatch):
+    monkeypatch.setattr(bot, "TOKEN", "123:TEST")
+    request = bot.build_app().bot.request
+
+    assert isinstance(request, bot.MeteredRequest)
+    assert request._client_kwargs["limits"].max_connections == bot.BOT_API_POOL_SIZE
+    assert bot.BOT_API_POOL_SIZE >= bot.OUTBOX_CONCURRENCY + bot.UPDATE_CONCURRENCY
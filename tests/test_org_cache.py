@@ -0,0 +1,116 @@
+import asyncio
+import sys
+from collections.abc import Awaitable
+from pathlib import Path
+from typing import Any
+
+import aiosqlite
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import bot
+
+
+def _run(coro: Awaitable[Any]) -> Any:
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db_path(monkeypatch, tmp_path):
+    path = tmp_path / "bot.sqlite"
+    monkeypatch.setattr(bot, "DB_PATH", str(path))
+    _run(bot.init_db())
+    yield str(path)
+    bot.ORG_CACHE.clear()
+
+
+async def _group_id(db_path: str, name: str) -> int:
+    async with aiosqlite.connect(db_path) as db:
+        async with db.execute("SELECT id FROM grp WHERE name=?", (name,)) as cur:
+            return (await cur.fetchone())[0]
+
+
+def test_cache_serves_tree_from_memory(db_path):
+    gid = _run(_group_id(db_path, "Управление культуры"))
+
+    async def scenario():
+        await bot.ORG_CACHE.load()
+        # после загрузки база больше не нужна для навигации
+        async with aiosqlite.connect(db_path) as db:
+            await db.execute("DELETE FROM entity")
+            await db.execute("UPDATE grp SET name = name || '?'")
+            await db.commit()
+        return (
+            [g["name"] for g in await bot.list_groups(gid)],
+            (await bot.get_group(gid))["name"],
+            (await bot.get_group_legal_entity(gid))["name"],
+        )
+
+    children, name, legal = _run(scenario())
+    assert children == ["РЦНТ", "ЦБС"]
+    assert name == "Управление культуры"
+    assert legal == "Управление культуры"
+
+
+def test_org_structure_change_reaches_loaded_cache(db_path, monkeypatch):
+    parent = _run(_group_id(db_path, "Управление образования"))
+    structure = {**bot.ORG_STRUCTURE, "Управление образования": {"Детский сад": {}, "Школа с. Мулино": {}}}
+    monkeypatch.setattr(bot, "ORG_STRUCTURE", structure)
+
+    async def scenario():
+        await bot.ORG_CACHE.load()
+        generation = bot.RENDER_CACHE.generation
+        await bot.init_db()
+        return [g["name"] for g in await bot.list_groups(parent)], bot.RENDER_CACHE.generation > generation
+
+    children, bumped = _run(scenario())
+    assert children == ["Детский сад", "Школа с. Мулино"]
+    assert bumped
+
+
+def test_rolled_back_org_structure_stays_out_of_cache(db_path, monkeypatch):
+    parent = _run(_group_id(db_path, "Управление образования"))
+    structure = {**bot.ORG_STRUCTURE, "Управление образования": {"Детский сад": {}, "Школа с. Мулино": {}}}
+    monkeypatch.setattr(bot, "ORG_STRUCTURE", structure)
+
+    async def failing_entity(db, group_id, name):
+        raise RuntimeError("запись не удалась")
+
+    monkeypatch.setattr(bot, "ensure_org_entity", failing_entity)
+
+    async def scenario():
+        await bot.ORG_CACHE.load()
+        with pytest.raises(RuntimeError):
+            await bot.init_db()
+        cached = [g["name"] for g in await bot.list_groups(parent)]
+        async with aiosqlite.connect(db_path) as db:
+            async with db.execute("SELECT count(*) FROM grp WHERE name='Детский сад'") as cur:
+                stored = (await cur.fetchone())[0]
+        return cached, stored
+
+    assert _run(scenario()) == (["Школа с. Мулино"], 0)
+
+
+def test_person_lists_are_updated_in_place_and_bounded(db_path, monkeypatch):
+    gid = _run(_group_id(db_path, "РЦНТ"))
+    monkeypatch.setattr(bot, "ORG_CACHE", bot.OrgCache(max_person_lists=1))
+
+    async def scenario():
+        await bot.ORG_CACHE.load()
+        async with bot.db_write() as db:
+            for name in ("Петров", "Иванов"):
+                await db.execute(
+                    "INSERT INTO entity(name, kind, group_id) VALUES (?, 'person', ?)", (name, gid)
+                )
+        first = [p["name"] for p in await bot.list_group_persons(gid)]
+        bot.ORG_CACHE.entity_added(100, "Сидоров", "person", gid)
+        second = [p["name"] for p in await bot.list_group_persons(gid)]
+        bot.ORG_CACHE.entity_removed(100, "person", gid)
+        await bot.list_group_persons(gid + 1)
+        return first, second, bot.ORG_CACHE.persons(gid)
+
+    first, second, evicted = _run(scenario())
+    assert first == ["Иванов", "Петров"]
+    assert second == ["Иванов", "Петров", "Сидоров"]
+    assert evicted is None
@@ -0,0 +1,183 @@
+import asyncio
+import sys
+from collections.abc import Awaitable
+from datetime import date, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+import aiosqlite
+import pytest
+from telegram.error import Forbidden, NetworkError, RetryAfter
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import bot
+from test_reminders import DummyApplication, _insert_signature, _insert_subscriber
+
+
+class FakeBot:
+    """Записывает отправки и по сценарию выбрасывает ошибки Bot API."""
+
+    def __init__(self, failures: dict[int, list[Exception]] | None = None) -> None:
+        self.failures = failures or {}
+        self.sent: list[tuple[int, str, float]] = []
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+
+    async def send_message(self, chat_id, text, parse_mode=None, reply_markup=None):
+        self.calls += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(0.01)
+            queue = self.failures.get(chat_id)
+            if queue:
+                raise queue.pop(0)
+            self.sent.append((chat_id, text, asyncio.get_running_loop().time()))
+        finally:
+            self.active -= 1
+
+
+def _run(coro: Awaitable[Any]) -> Any:
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db_path(monkeypatch, tmp_path):
+    path = tmp_path / "bot.sqlite"
+    monkeypatch.setattr(bot, "DB_PATH", str(path))
+    _run(bot.init_db())
+    return str(path)
+
+
+async def _outbox_rows(db_path: str) -> list[tuple]:
+    async with aiosqlite.connect(db_path) as db:
+        async with db.execute("SELECT chat_id, status, attempts FROM outbox ORDER BY id") as cur:
+            return await cur.fetchall()
+
+
+async def _send_all(fake: FakeBot, messages: list[tuple[int, str]], **kwargs) -> None:
+    sender = bot.OutboxSender(fake, **kwargs)
+    await sender.start()
+    for chat_id, text in messages:
+        await bot.outbox_send(chat_id, text)
+    sender.wake()
+    await sender.stop(drain_timeout=5)
+
+
+def test_sender_delivers_with_bounded_concurrency(db_path):
+    fake = FakeBot()
+    messages = [(chat_id, f"msg {chat_id}") for chat_id in range(1, 21)]
+
+    _run(_send_all(fake, messages, rate=1000, per_chat_rate=100, concurrency=3))
+
+    assert sorted(chat_id for chat_id, _, _ in fake.sent) == list(range(1, 21))
+    assert fake.max_active <= 3
+    assert _run(_outbox_rows(db_path)) == []
+
+
+def test_sender_respects_per_chat_rate(db_path):
+    fake = FakeBot()
+    messages = [(7, f"msg {i}") for i in range(3)]
+
+    _run(_send_all(fake, messages, rate=1000, per_chat_rate=10, concurrency=3))
+
+    assert [text for _, text, _ in fake.sent] == ["msg 0", "msg 1", "msg 2"]
+    stamps = [ts for _, _, ts in fake.sent]
+    assert all(b - a >= 0.09 for a, b in zip(stamps, stamps[1:]))
+
+
+def test_sender_honours_retry_after_and_backs_off(db_path):
+    fake = FakeBot({
+        1: [RetryAfter(0)],
+        2: [NetworkError("blip"), NetworkError("blip")],
+        3: [Forbidden("bot was blocked by the user")],
+    })
+
+    _run(_send_all(fake, [(1, "a"), (2, "b"), (3, "c")],
+                   rate=1000, per_chat_rate=100, base_backoff=0.01))
+
+    assert sorted(chat_id for chat_id, _, _ in fake.sent) == [1, 2]
+    assert fake.calls == 6
+    # заблокировавший бота чат остаётся в outbox для разбора
+    assert _run(_outbox_rows(db_path)) == [(3, "failed", 1)]
+
+
+def test_sender_gives_up_after_max_attempts(db_path):
+    fake = FakeBot({5: [NetworkError("down")] * 3})
+
+    _run(_send_all(fake, [(5, "x")], rate=1000, per_chat_rate=100,
+                   base_backoff=0.01, max_attempts=3))
+
+    assert fake.sent == []
+    assert _run(_outbox_rows(db_path)) == [(5, "failed", 3)]
+
+
+def test_send_reminders_enqueues_when_sender_runs(db_path, monkeypatch):
+    _run(_insert_subscriber(db_path, 11))
+    _run(_insert_subscriber(db_path, 12))
+    _run(_insert_signature(db_path, name="ООО Ромашка", kind="org",
+                           expiry=date.today() + timedelta(days=5)))
+    fake = FakeBot()
+
+    async def scenario():
+        sender = bot.OutboxSender(fake, rate=1000, per_chat_rate=100)
+        await sender.start()
+        monkeypatch.setattr(bot, "OUTBOX", sender)
+        app = DummyApplication()
+        await bot.send_reminders(app)
+        queued = await _outbox_rows(db_path)
+        await sender.stop(drain_timeout=5)
+        return app, queued
+
+    app, queued = _run(scenario())
+    assert app.bot.sent_messages == []
+    assert [chat_id for chat_id, _, _ in queued] == [11, 12]
+    assert sorted(chat_id for chat_id, _, _ in fake.sent) == [11, 12]
+
+
+def test_senders_only_take_their_own_bot_rows(db_path, monkeypatch):
+    ours, theirs = FakeBot(), FakeBot()
+    ours.token, theirs.token = "111:aaa", "222:bbb"
+
+    async def scenario():
+        other = bot.OutboxSender(theirs, rate=1000, per_chat_rate=100)
+        monkeypatch.setattr(bot, "OUTBOX", other)
+        await bot.outbox_send(1, "от второго бота")
+        monkeypatch.setattr(bot, "OUTBOX", None)
+        await bot.outbox_send(2, "до запуска отправителя")
+        sender = bot.OutboxSender(ours, rate=1000, per_chat_rate=100)
+        await sender.start()
+        sender.wake()
+        await sender.stop(drain_timeout=2)
+        return await _outbox_rows(db_path)
+
+    left = _run(scenario())
+    assert [chat_id for chat_id, _, _ in ours.sent] == [2]
+    assert left == [(1, "pending", 0)]
+
+
+def test_markup_roundtrip():
+    markup = bot.main_menu_kbd()
+    assert bot._markup_from_json(bot._markup_to_json(markup)) == markup
+
+
+def test_interactive_replies_bypass_the_queue(db_path, monkeypatch):
+    fake = FakeBot()
+
+    async def scenario():
+        sender = bot.OutboxSender(fake, rate=1000, per_chat_rate=100)
+        await sender.start()
+        monkeypatch.setattr(bot, "OUTBOX", sender)
+        try:
+            context = SimpleNamespace(bot=fake, user_data={"awaiting": "expiry"})
+            await bot._go_main(context, 7)
+            return context.user_data, await _outbox_rows(db_path)
+        finally:
+            await sender.stop(drain_timeout=5)
+
+    user_data, queued = _run(scenario())
+    assert [chat_id for chat_id, _, _ in fake.sent] == [7]
+    assert queued == [] and user_data == {}
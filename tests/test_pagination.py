@@ -0,0 +1,157 @@
+import asyncio
+import sys
+from collections.abc import Awaitable
+from datetime import date, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+import aiosqlite
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import bot
+
+
+def _run(coro: Awaitable[Any]) -> Any:
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db_path(monkeypatch, tmp_path):
+    path = tmp_path / "bot.sqlite"
+    monkeypatch.setattr(bot, "DB_PATH", str(path))
+    _run(bot.init_db())
+    return str(path)
+
+
+async def _seed_people(db_path: str, count: int, note: str | None = None) -> None:
+    async with aiosqlite.connect(db_path) as db:
+        for i in range(count):
+            cur = await db.execute(
+                "INSERT INTO entity(name, kind) VALUES (?, 'person')", (f"Person {i:03}",)
+            )
+            await db.execute(
+                "INSERT INTO signature(entity_id, expiry, note) VALUES (?,?,?)",
+                (cur.lastrowid, (date.today() + timedelta(days=i % 40)).isoformat(), note),
+            )
+        await db.commit()
+
+
+def _cursor(markup, label: str) -> tuple[str, int] | None:
+    if markup is None:
+        return None
+    for button in markup.inline_keyboard[0]:
+        if label in button.text:
+            _, _, _, direction, cursor = button.callback_data.split("|")
+            return direction, int(cursor)
+    return None
+
+
+def _org_names(structure: dict) -> list[str]:
+    return [n for name, children in structure.items() for n in [name, *_org_names(children)]]
+
+
+def _names(text: str) -> list[str]:
+    return [line.split("] ", 1)[1].split(" — ")[0] for line in text.splitlines() if line.startswith("[")]
+
+
+def test_all_pages_walk_forward_and_back(db_path):
+    _run(_seed_people(db_path, 60))
+
+    async def scenario():
+        pages = []
+        text, markup = await bot.build_all_page(size=25)
+        pages.append(_names(text))
+        while (nxt := _cursor(markup, "Следующие")) is not None:
+            text, markup = await bot.build_all_page(*nxt, size=25)
+            pages.append(_names(text))
+        back = []
+        while (prev := _cursor(markup, "Предыдущие")) is not None:
+            text, markup = await bot.build_all_page(*prev, size=25)
+            back.append(_names(text))
+        return pages, back
+
+    pages, back = _run(scenario())
+    flat = [name for page in pages for name in page]
+    orgs = _org_names(bot.ORG_STRUCTURE)
+    # сначала ЮЛ из ORG_STRUCTURE, затем ФЛ
+    assert [len(p) for p in pages] == [25, 25, 10 + len(orgs)]
+    assert flat[:len(orgs)] == sorted(orgs, key=bot._sql_lower)
+    assert flat[len(orgs):] == [f"Person {i:03}" for i in range(60)]
+    assert back == [pages[1], pages[0]]
+
+
+def test_upcoming_pages_keep_expiry_order(db_path):
+    _run(_seed_people(db_path, 45))
+
+    async def scenario():
+        text, markup = await bot.build_upcoming_page(10)
+        first = text
+        seen = _names(text)
+        while (nxt := _cursor(markup, "Следующие")) is not None:
+            text, markup = await bot.build_upcoming_page(10, *nxt)
+            seen += _names(text)
+        return first, seen
+
+    first, seen = _run(scenario())
+    assert first.startswith("*Ближайшие 10:*")
+    assert len(seen) == 45 and len(set(seen)) == 45
+    expected = sorted((i % 40, i) for i in range(45))
+    assert seen == [f"Person {i:03}" for _, i in expected]
+
+
+def test_page_fits_message_limit(db_path):
+    _run(_seed_people(db_path, 30, note="x" * 400))
+
+    async def scenario():
+        return await bot.build_all_page(size=30)
+
+    text, markup = _run(scenario())
+    assert len(text) <= 4096
+    assert _cursor(markup, "Следующие") is not None
+
+
+def test_missing_cursor_falls_back_to_first_page(db_path):
+    _run(_seed_people(db_path, 5))
+
+    async def scenario():
+        return await bot.build_all_page("n", 10_000, size=25)
+
+    text, _ = _run(scenario())
+    assert "Person 000" in text
+
+
+class FakeQuery:
+    def __init__(self, data: str):
+        self.data = data
+        self.answers: list[str | None] = []
+        self.edits: list[str] = []
+
+    async def answer(self, text=None, **kwargs):
+        self.answers.append(text)
+
+    async def edit_message_text(self, text, **kwargs):
+        self.edits.append(text)
+
+
+@pytest.mark.parametrize("data", ["page|all|25|x|1", "page|up|25||1", "page|all|25|n", "page|all|z|n|1"])
+def test_malformed_page_button_is_reported_stale(db_path, data):
+    _run(_seed_people(db_path, 5))
+    q = FakeQuery(data)
+
+    _run(bot.cb_page(SimpleNamespace(callback_query=q), SimpleNamespace()))
+
+    assert q.answers == ["Кнопка устарела, откройте раздел заново"]
+    assert q.edits == []
+
+
+def test_page_button_edits_message(db_path):
+    _run(_seed_people(db_path, 5))
+    q = FakeQuery("page|all|2|n|1")
+
+    _run(bot.cb_page(SimpleNamespace(callback_query=q), SimpleNamespace()))
+
+    assert q.answers == [None]
+    assert len(q.edits) == 1 and q.edits[0].startswith("*Список всех:*")
@@ -0,0 +1,96 @@
+import asyncio
+import sys
+from collections.abc import Awaitable
+from datetime import date
+from pathlib import Path
+from typing import Any
+
+import aiosqlite
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import bot
+
+
+def _run(coro: Awaitable[Any]) -> Any:
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db_path(monkeypatch, tmp_path):
+    path = tmp_path / "bot.sqlite"
+    monkeypatch.setattr(bot, "DB_PATH", str(path))
+    _run(bot.init_db())
+    return str(path)
+
+
+async def _rows(db_path: str) -> dict[int, str]:
+    async with aiosqlite.connect(db_path) as db:
+        async with db.execute("SELECT user_id, data FROM user_state") as cur:
+            return dict(await cur.fetchall())
+
+
+def _upserts() -> int:
+    return sum(
+        hist.count
+        for labels, hist in bot.METRICS._hist.get("edsbot_sql_seconds", {}).items()
+        if dict(labels)["statement"].startswith("INSERT INTO user_state")
+    )
+
+
+def test_state_round_trips_dates_and_tree_path():
+    state = {"awaiting": "note", "flow": "upd", "entity_id": 7, "expiry": date(2026, 12, 31),
+             "tree": {"mode": "sign_update", "path": [(1, "РЦНТ")], "message_id": 55}}
+
+    text = bot.dump_state(state)
+    restored = bot.load_state(text)
+
+    assert "РЦНТ" in text and ": " not in text
+    assert restored["expiry"] == date(2026, 12, 31)
+    gid, name = restored["tree"]["path"][-1]
+    assert (gid, name) == (1, "РЦНТ")
+
+
+def test_updates_are_batched_and_restored_after_restart(db_path):
+    async def first_run():
+        await bot.open_pool(readers=1)
+        try:
+            p = bot.SqlitePersistence()
+            assert await p.get_user_data() == {}
+            bot.METRICS.reset()
+            await asyncio.gather(
+                p.update_user_data(1, {"awaiting": "expiry", "entity_id": 3}),
+                p.update_user_data(2, {"awaiting": "note", "expiry": date(2026, 1, 2)}),
+                p.update_user_data(3, {}),
+            )
+            await p.flush()
+            # оба пользователя ушли одним executemany
+            assert _upserts() == 1
+            # неизменившееся состояние повторно не ставится в очередь
+            await p.update_user_data(1, {"awaiting": "expiry", "entity_id": 3})
+            assert p._pending == {}
+            # очищенный user_data удаляет строку
+            await p.update_user_data(2, {})
+            await p.flush()
+        finally:
+            await bot.close_pool()
+
+    async def second_run():
+        p = bot.SqlitePersistence()
+        return await p.get_user_data()
+
+    _run(first_run())
+    assert set(_run(_rows(db_path))) == {1}
+    assert _run(second_run()) == {1: {"awaiting": "expiry", "entity_id": 3}}
+
+
+def test_unreadable_rows_are_skipped(db_path):
+    async def scenario():
+        async with aiosqlite.connect(db_path) as db:
+            await db.executemany("INSERT INTO user_state(user_id, data) VALUES (?, ?)",
+                                 [(1, "{broken"), (2, '{"flow":"add"}')])
+            await db.commit()
+        return await bot.SqlitePersistence().get_user_data()
+
+    assert _run(scenario()) == {2: {"flow": "add"}}
@@ -0,0 +1,171 @@
+import asyncio
+import sys
+from collections.abc import Awaitable
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import bot
+from test_reminders import DummyApplication, _insert_subscriber
+
+
+def _run(coro: Awaitable[Any]) -> Any:
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db_path(monkeypatch, tmp_path):
+    path = tmp_path / "bot.sqlite"
+    monkeypatch.setattr(bot, "DB_PATH", str(path))
+    _run(bot.init_db())
+    return str(path)
+
+
+async def _explain(db, sql: str, args: tuple = ()) -> list[str]:
+    async with db.execute("EXPLAIN QUERY PLAN " + sql, args) as cur:
+        return [r[3] for r in await cur.fetchall()]
+
+
+def _assert_no_scan(plan: list[str]):
+    assert plan, "empty plan"
+    scans = [step for step in plan if step.startswith("SCAN")]
+    assert not scans, plan
+
+
+def test_migrations_set_user_version(db_path):
+    async def scenario():
+        async with bot.db_read() as db:
+            return await bot.get_schema_version(db)
+
+    assert _run(scenario()) == bot.MIGRATIONS[-1][0]
+
+
+def test_upcoming_query_uses_partial_expiry_index(db_path):
+    async def scenario():
+        async with bot.db_read() as db:
+            return await _explain(db, bot.SQL_UPCOMING, (date.today().isoformat(), 10))
+
+    plan = _run(scenario())
+    _assert_no_scan(plan)
+    assert any("idx_signature_active_expiry" in step for step in plan)
+
+
+def test_reminders_query_uses_partial_expiry_index(db_path):
+    targets = tuple((date.today() + timedelta(days=d)).isoformat() for d in (25, 20, 15, 10, 5, 0))
+
+    async def scenario():
+        async with bot.db_read() as db:
+            return await _explain(db, bot._reminders_sql(len(targets)), targets)
+
+    plan = _run(scenario())
+    _assert_no_scan(plan)
+    assert any("idx_signature_active_expiry" in step for step in plan)
+
+
+def test_reminder_events_query_uses_partial_expiry_index(db_path):
+    targets = bot._reminder_dates(date.today(), date.today() + timedelta(days=6))
+
+    async def scenario():
+        async with bot.db_read() as db:
+            return await _explain(db, bot._reminder_events_sql(len(targets)), tuple(targets))
+
+    plan = _run(scenario())
+    _assert_no_scan(plan)
+    assert any("idx_signature_active_expiry" in step for step in plan)
+
+
+def test_due_reminders_query_seeks_signatures_and_scope(db_path):
+    async def scenario():
+        async with bot.db_read() as db:
+            return await _explain(db, bot.SQL_DUE_REMINDERS,
+                                  ('[[1, "2026-01-01"]]', "-7 days", "[25, 0]"))
+
+    plan = _run(scenario())
+    assert any(step.startswith("SEARCH s USING INDEX idx_signature_active_expiry") for step in plan), plan
+    assert any(step.startswith("SEARCH c USING PRIMARY KEY") for step in plan), plan
+    assert any(step.startswith("SEARCH l USING PRIMARY KEY") for step in plan), plan
+
+
+def _expected_scans(sql: str) -> set[str]:
+    """Таблицы, которые запрос читает целиком по построению; у остальных — ни одной."""
+    # в трассировке параметры уже подставлены: запрос узнаём по тексту до первого из них
+    if sql.startswith(bot.SQL_DUE_REMINDERS.split("?")[0]):
+        # входной список (чат, день) и окна/смещения, выведенные из него
+        return {"json_each", "d", "w", "f", "offs"}
+    if sql == "SELECT chat_id FROM subscriber":
+        # все получатели рассылки
+        return {"subscriber"}
+    return set()
+
+
+def test_hot_path_helpers_never_scan(db_path):
+    """Каждый SELECT, который выполняют помощники дерева и напоминаний, идёт по индексу."""
+
+    _run(_insert_subscriber(db_path, 101))
+
+    async def scenario():
+        await bot.open_pool(readers=1)
+        try:
+            statements: list[str] = []
+            async with bot.db_read() as db:
+                await db.set_trace_callback(statements.append)
+            await bot.list_groups(None)
+            await bot.list_groups(1)
+            await bot.get_group(1)
+            await bot.get_group_legal_entity(1)
+            await bot.list_group_persons(1)
+            await bot.list_persons_with_signatures(1)
+            await bot.get_entity_with_signature(1)
+            await bot.build_lastN_text(10)
+            await bot.send_reminders(DummyApplication())
+            async with bot.db_read() as db:
+                await db.set_trace_callback(None)
+                return [
+                    (sql, await _explain(db, sql))
+                    for sql in statements if sql.lstrip().upper().startswith(("SELECT", "WITH"))
+                ]
+        finally:
+            await bot.close_pool()
+
+    plans = _run(scenario())
+    assert len(plans) >= 10
+    for sql, plan in plans:
+        allowed = _expected_scans(sql)
+        scans = [step for step in plan if step.startswith("SCAN") and step.split()[1] not in allowed]
+        assert not scans, (sql, plan)
+
+
+@pytest.mark.parametrize("view, args", [("all", ()), ("up", ("2025-01-01",))])
+@pytest.mark.parametrize("direction", ["n", "p"])
+def test_keyset_pages_seek_by_index(db_path, view, args, direction):
+    key = (0, "a", 1) if view == "all" else ("2025-01-01", 1)
+
+    async def scenario():
+        async with bot.db_read() as db:
+            return await _explain(db, bot._page_sql(view, direction), (*args, *key, 26))
+
+    plan = _run(scenario())
+    _assert_no_scan(plan)
+
+
+@pytest.mark.parametrize("step", ["week", "month"])
+@pytest.mark.parametrize("scoped", [False, True])
+def test_forecast_query_seeks_expiry_day_index(db_path, step, scoped):
+    today = bot._day_number(date.today())
+
+    async def scenario():
+        async with bot.db_read() as db:
+            return await _explain(db, bot._forecast_sql(step, scoped),
+                                  {"today": today, "until": today + 365, "scope": 1})
+
+    plan = _run(scenario())
+    _assert_no_scan(plan)
+    if scoped:
+        # по разделу планировщик идёт от поддерева: замыкание → сущности → подписи
+        assert any(line.startswith("SEARCH c USING PRIMARY KEY") for line in plan), plan
+    else:
+        assert any("idx_signature_active_expiry_day" in line for line in plan), plan
@@ -52,9 +52,16 @@ async def _insert_signature(
     kind: str,
     expiry: date,
     note: str | None = None,
+    group: str | None = None,
 ) -> None:
     async with aiosqlite.connect(db_path) as db:
-        cur = await db.execute("INSERT INTO entity(name, kind) VALUES (?, ?)", (name, kind))
+        group_id = None
+        if group is not None:
+            async with db.execute("SELECT id FROM grp WHERE name=?", (group,)) as cur:
+                group_id = (await cur.fetchone())[0]
+        cur = await db.execute(
+            "INSERT INTO entity(name, kind, group_id) VALUES (?, ?, ?)", (name, kind, group_id)
+        )
         entity_id = cur.lastrowid
         await db.execute(
             "INSERT INTO signature(entity_id, expiry, note, active) VALUES (?,?,?,1)",
@@ -144,3 +151,105 @@ def test_send_reminders_orders_by_expiry(db_path):
     assert len(messages) == 2
     assert "через 10 дн." in messages[0]
     assert "через 25 дн." in messages[1]
+
+
+def test_digest_sends_one_message_per_subscriber(db_path):
+    for chat_id in (501, 502, 503):
+        _run(_insert_subscriber(db_path, chat_id))
+    today = date.today()
+    _run(_insert_signature(db_path, name="Иванов", kind="person", expiry=today, group="РЦНТ"))
+    _run(_insert_signature(
+        db_path, name="Петров", kind="person", expiry=today + timedelta(days=5), group="РЦНТ"
+    ))
+    _run(_insert_signature(
+        db_path, name="Сидоров", kind="person", expiry=today + timedelta(days=5), group="ЦБС"
+    ))
+    _run(_insert_signature(db_path, name="ООО Лайм", kind="org", expiry=today + timedelta(days=25)))
+    app = DummyApplication()
+
+    _run(bot.send_reminders(app, mode="digest"))
+
+    assert len(app.bot.sent_messages) == 3
+    assert sorted(chat_id for chat_id, _, _ in app.bot.sent_messages) == [501, 502, 503]
+    text = app.bot.sent_messages[0][1]
+    assert text.index("Истекает сегодня") < text.index("через 5 дн.") < text.index("через 25 дн.")
+    assert text.index("*РЦНТ*") < text.index("Петров") < text.index("*ЦБС*") < text.index("Сидоров")
+    assert "*Без организации*" in text
+
+
+def test_digest_splits_at_telegram_limit(db_path):
+    _run(_insert_subscriber(db_path, 601))
+    _run(_insert_subscriber(db_path, 602))
+    expiry = date.today() + timedelta(days=10)
+    note = "длинное примечание " * 10
+    for i in range(60):
+        _run(_insert_signature(db_path, name=f"Сотрудник {i:03}", kind="person", expiry=expiry, note=note))
+    app = DummyApplication()
+
+    _run(bot.send_reminders(app, mode="digest"))
+
+    texts = [text for chat_id, text, _ in app.bot.sent_messages if chat_id == 601]
+    assert len(texts) == 4
+    assert len(app.bot.sent_messages) == 2 * len(texts)
+    assert all(len(text) <= 4096 for text in texts)
+    assert sum(text.count("Сотрудник") for text in texts) == 60
+
+
+async def _set_last_run(db_path: str, day: date) -> None:
+    async with aiosqlite.connect(db_path) as db:
+        await db.execute("UPDATE subscriber SET reminded_until=?", (day.isoformat(),))
+        await db.commit()
+
+
+async def _reminder_log(db_path: str) -> list[tuple]:
+    async with aiosqlite.connect(db_path) as db:
+        async with db.execute("SELECT signature_id, offset_days, chat_id FROM reminder_log") as cur:
+            return await cur.fetchall()
+
+
+def test_send_reminders_is_idempotent_across_runs(db_path):
+    _run(_insert_subscriber(db_path, 701))
+    _run(_insert_signature(db_path, name="ООО Ромашка", kind="org", expiry=date.today() + timedelta(days=5)))
+    app = DummyApplication()
+
+    _run(bot.send_reminders(app))
+    _run(bot.send_reminders(app))
+
+    assert len(app.bot.sent_messages) == 1
+    assert _run(_reminder_log(db_path)) == [(1, 5, 701)]
+
+
+def test_send_reminders_catches_up_after_downtime(db_path):
+    _run(_insert_subscriber(db_path, 702))
+    today = date.today()
+    # 5-дневное напоминание было должно позавчера, пока бот лежал
+    _run(_insert_signature(db_path, name="ИП Иванов", kind="person", expiry=today + timedelta(days=3)))
+    # а это должно было уйти ещё до прошлого запуска — его не трогаем
+    _run(_insert_signature(db_path, name="ИП Петров", kind="person", expiry=today + timedelta(days=1)))
+    _run(_set_last_run(db_path, today - timedelta(days=3)))
+    app = DummyApplication()
+
+    _run(bot.send_reminders(app))
+    _run(bot.send_reminders(app))
+
+    assert len(app.bot.sent_messages) == 1
+    _, text, _ = app.bot.sent_messages[0]
+    assert "через 3 дн." in text
+    assert "[ФЛ] ИП Иванов" in text
+
+
+def test_renewal_resets_reminder_log(db_path):
+    _run(_insert_subscriber(db_path, 703))
+    _run(_insert_signature(db_path, name="ООО Ромашка", kind="org", expiry=date.today() + timedelta(days=10)))
+    app = DummyApplication()
+    _run(bot.send_reminders(app))
+
+    async def renew():
+        async with bot.db_write() as db:
+            await bot.upsert_signature(db, 1, date.today() + timedelta(days=10), "новая")
+
+    _run(renew())
+    _run(bot.send_reminders(app))
+
+    assert len(app.bot.sent_messages) == 2
+    assert "новая" in app.bot.sent_messages[1][1]
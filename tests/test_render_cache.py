@@ -0,0 +1,78 @@
+import asyncio
+import sys
+from collections.abc import Awaitable
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import bot
+from test_reminders import _insert_signature
+
+
+def _run(coro: Awaitable[Any]) -> Any:
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db_path(monkeypatch, tmp_path):
+    path = tmp_path / "bot.sqlite"
+    monkeypatch.setattr(bot, "DB_PATH", str(path))
+    _run(bot.init_db())
+    bot.METRICS.reset()
+    yield str(path)
+    bot.METRICS.reset()
+
+
+def _sql_count() -> int:
+    return sum(h.count for h in bot.METRICS._hist.get("edsbot_sql_seconds", {}).values())
+
+
+def _cache(view: str, result: str) -> float:
+    return bot.METRICS.counter("edsbot_render_cache_total", view=view, result=result)
+
+
+def test_repeated_views_skip_sqlite(db_path):
+    soon = date.today() + timedelta(days=3)
+    _run(_insert_signature(db_path, name="Иванов", kind="person", expiry=soon))
+
+    async def scenario():
+        await bot.open_pool(readers=1)
+        try:
+            first = await bot.build_lastN_text(10)
+            await bot.build_tree_view("browse", None)
+            queries = _sql_count()
+            again = await bot.build_lastN_text(10)
+            await bot.build_tree_view("browse", None)
+            return first, again, queries, _sql_count()
+        finally:
+            await bot.close_pool()
+
+    first, again, before, after = _run(scenario())
+    assert first == again and "Иванов" in first
+    assert after == before
+    assert (_cache("up", "miss"), _cache("up", "hit")) == (1, 1)
+    assert (_cache("tree", "miss"), _cache("tree", "hit")) == (1, 1)
+
+
+def test_writes_bump_generation(db_path):
+    soon = date.today() + timedelta(days=3)
+    _run(_insert_signature(db_path, name="Иванов", kind="person", expiry=soon))
+
+    async def scenario():
+        first = await bot.build_all_text()
+        generation = bot.RENDER_CACHE.generation
+        async with bot.db_read() as db:
+            async with db.execute("SELECT id FROM entity WHERE name='Иванов'") as cur:
+                eid = (await cur.fetchone())[0]
+        async with bot.db_write() as db:
+            await bot.upsert_signature(db, eid, soon, "продлена")
+        return first, generation, await bot.build_all_text()
+
+    first, generation, second = _run(scenario())
+    assert bot.RENDER_CACHE.generation == generation + 1
+    assert "продлена" not in first and "продлена" in second
+    assert _cache("all", "hit") == 0
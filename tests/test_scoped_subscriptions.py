@@ -0,0 +1,113 @@
+import asyncio
+import sys
+from collections.abc import Awaitable
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any
+
+import aiosqlite
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import bot
+from test_reminders import DummyApplication, _insert_signature, _insert_subscriber
+
+
+def _run(coro: Awaitable[Any]) -> Any:
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db_path(monkeypatch, tmp_path):
+    path = tmp_path / "bot.sqlite"
+    monkeypatch.setattr(bot, "DB_PATH", str(path))
+    _run(bot.init_db())
+    yield str(path)
+    bot.ORG_CACHE.clear()
+
+
+async def _closure_matches_hierarchy(db_path: str) -> bool:
+    async with aiosqlite.connect(db_path) as db:
+        async with db.execute(
+            """
+            WITH RECURSIVE t(a, d, depth) AS (
+                SELECT id, id, 0 FROM grp
+                UNION ALL
+                SELECT t.a, g.id, t.depth + 1 FROM t JOIN grp g ON g.parent_id=t.d
+            )
+            SELECT a, d, depth FROM t
+            """
+        ) as cur:
+            expected = set(await cur.fetchall())
+        async with db.execute("SELECT ancestor_id, descendant_id, depth FROM grp_closure") as cur:
+            return set(await cur.fetchall()) == expected
+
+
+async def _group_id(name: str) -> int:
+    async with bot.db_read() as db:
+        async with db.execute("SELECT id FROM grp WHERE name=?", (name,)) as cur:
+            return (await cur.fetchone())[0]
+
+
+def test_closure_follows_tree_edits(db_path):
+    async def scenario():
+        checks = [await _closure_matches_hierarchy(db_path)]
+        culture = await _group_id("Управление культуры")
+        async with bot.db_write() as db:
+            club = await bot.ensure_group(db, "Клуб", await _group_id("РЦНТ"))
+            await bot.ensure_group(db, "Кружок", club)
+            await db.commit()
+        checks.append(await _closure_matches_hierarchy(db_path))
+        # ветку «Клуб» переносим под «Управление образования»
+        async with bot.db_write() as db:
+            await bot.ensure_group(db, "Клуб", await _group_id("Управление образования"))
+            await db.commit()
+        checks.append(await _closure_matches_hierarchy(db_path))
+        async with bot.db_write() as db:
+            await db.execute("DELETE FROM grp WHERE id=?", (club,))
+            await db.commit()
+        checks.append(await _closure_matches_hierarchy(db_path))
+        async with bot.db_read() as db:
+            async with db.execute(
+                "SELECT count(*) FROM grp_closure WHERE ancestor_id=?", (culture,)
+            ) as cur:
+                return checks, (await cur.fetchone())[0]
+
+    checks, culture_size = _run(scenario())
+    assert checks == [True, True, True, True]
+    assert culture_size == 3  # сама группа, РЦНТ и ЦБС
+
+
+def test_scoped_chat_gets_only_its_branch(db_path):
+    for chat_id in (101, 102):
+        _run(_insert_subscriber(db_path, chat_id))
+    soon = date.today() + timedelta(days=5)
+    _run(_insert_signature(db_path, name="Иванов", kind="person", expiry=soon, group="РЦНТ"))
+    _run(_insert_signature(db_path, name="Петров", kind="person", expiry=soon, group="Школа с. Мулино"))
+    _run(_insert_signature(db_path, name="ООО Лайм", kind="org", expiry=soon))
+
+    async def scenario():
+        group = await bot.resolve_scope_group("культуры")
+        await bot.save_subscriber_settings(102, scope_group_id=group["id"])
+        return await bot.get_subscriber_settings(102)
+
+    settings = _run(scenario())
+    assert settings["scope"][1] == "Управление культуры"
+
+    app = DummyApplication()
+    _run(bot.send_reminders(app))
+
+    by_chat: dict[int, list[str]] = {}
+    for chat_id, text, _ in app.bot.sent_messages:
+        by_chat.setdefault(chat_id, []).append(text.split("\n")[1])
+    assert sorted(by_chat[101]) == ["[ФЛ] Иванов", "[ФЛ] Петров", "[ЮЛ] ООО Лайм"]
+    assert by_chat[102] == ["[ФЛ] Иванов"]
+
+
+def test_scope_lookup_asks_to_disambiguate(db_path):
+    with pytest.raises(ValueError, match="Подходит несколько"):
+        _run(bot.resolve_scope_group("Управление"))
+    with pytest.raises(ValueError, match="нет"):
+        _run(bot.resolve_scope_group("Министерство"))
+    assert _run(bot.resolve_scope_group("цбс"))["name"] == "ЦБС"
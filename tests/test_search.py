@@ -0,0 +1,114 @@
+import asyncio
+import sys
+from collections.abc import Awaitable
+from pathlib import Path
+from typing import Any
+
+import aiosqlite
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import bot
+
+
+def _run(coro: Awaitable[Any]) -> Any:
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db_path(monkeypatch, tmp_path):
+    path = tmp_path / "bot.sqlite"
+    monkeypatch.setattr(bot, "DB_PATH", str(path))
+    _run(bot.init_db())
+    _run(_seed(str(path), ["Иванов Сергей", "Петрова Анна", "Сидоров Петр", "Ивлева Ольга", "ООО Петрострой"]))
+    return str(path)
+
+
+async def _seed(db_path: str, names: list[str]):
+    async with aiosqlite.connect(db_path) as db:
+        await db.executemany(
+            "INSERT INTO entity(name, kind) VALUES (?, ?)",
+            [(n, "org" if n.startswith("ООО") else "person") for n in names],
+        )
+        await db.commit()
+
+
+def _names(rows) -> list[str]:
+    return [r["name"] for r in rows]
+
+
+def test_search_is_case_insensitive_and_ranks_prefix_first(db_path):
+    rows = _run(bot.search_entities("пЕТР"))
+    assert _names(rows)[0] == "Петрова Анна"
+    assert set(_names(rows)) == {"Петрова Анна", "Сидоров Петр", "ООО Петрострой"}
+
+
+def test_search_words_match_in_any_order(db_path):
+    assert _names(_run(bot.search_entities("анна петров"))) == ["Петрова Анна"]
+    assert _names(_run(bot.search_entities("петр ан"))) == ["Петрова Анна"]
+
+
+def test_short_query_matches_name_prefix(db_path):
+    assert _names(_run(bot.search_entities("ив"))) == ["Иванов Сергей", "Ивлева Ольга"]
+    assert _run(bot.search_entities("ов")) == []
+
+
+def test_search_filters_by_kind(db_path):
+    assert _names(_run(bot.search_entities("петр", kinds=("org",)))) == ["ООО Петрострой"]
+
+
+def test_index_follows_entity_changes(db_path):
+    async def scenario():
+        async with bot.db_write() as db:
+            await db.execute("UPDATE entity SET name='Иванова Мария' WHERE name='Иванов Сергей'")
+            await db.execute("DELETE FROM entity WHERE name='Петрова Анна'")
+        await bot.import_registry([(1, ["имя"]), (2, ["Кузнецов Петр"])])
+        return (
+            _names(await bot.search_entities("сергей")),
+            _names(await bot.search_entities("мария")),
+            _names(await bot.search_entities("петр", kinds=("person",))),
+        )
+
+    old, new, persons = _run(scenario())
+    assert old == []
+    assert new == ["Иванова Мария"]
+    assert sorted(persons) == ["Кузнецов Петр", "Сидоров Петр"]
+
+
+def test_results_jump_to_select_action(db_path):
+    text, markup = _run(bot.build_search_results("sign_update", "сидор"))
+    rows = markup.inline_keyboard
+    assert rows[0][0].text == "👤 Сидоров Петр"
+    mode, action, _, arg = bot.parse_tree_callback(rows[0][0].callback_data, {})
+    assert (mode, action) == ("sign_update", "select")
+    assert _run(bot.get_entity_with_signature(int(arg, 36)))["name"] == "Сидоров Петр"
+
+
+def test_short_query_seeks_name_index(db_path):
+    async def scenario():
+        statements: list[str] = []
+        await bot.open_pool(readers=1)
+        try:
+            async with bot.db_read() as db:
+                await db.set_trace_callback(statements.append)
+            await bot.search_entities("ив")
+            async with bot.db_read() as db:
+                await db.set_trace_callback(None)
+                async with db.execute("EXPLAIN QUERY PLAN " + statements[-1]) as cur:
+                    return [r[3] for r in await cur.fetchall()]
+        finally:
+            await bot.close_pool()
+
+    plan = _run(scenario())
+    assert not [step for step in plan if step.startswith("SCAN e USING")], plan
+    assert any("sqlite_autoindex_entity_1 (name>? AND name<?)" in step for step in plan), plan
+
+
+def test_prefix_match_survives_candidate_limit(db_path):
+    noise = [f"Алексей Иванович {i:03d}" for i in range(bot.SEARCH_CANDIDATES + 50)]
+    _run(_seed(db_path, noise + ["Иванишин Олег"]))
+    rows = _run(bot.search_entities("иванишин"))
+    assert _names(rows) == ["Иванишин Олег"]
+    rows = _run(bot.search_entities("иван"))
+    assert set(_names(rows)[:2]) == {"Иванишин Олег", "Иванов Сергей"}
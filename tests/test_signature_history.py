@@ -0,0 +1,114 @@
+import asyncio
+import sqlite3
+import sys
+from collections.abc import Awaitable
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any
+
+import aiosqlite
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import bot
+from test_reminders import _insert_signature
+
+
+def _run(coro: Awaitable[Any]) -> Any:
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db_path(monkeypatch, tmp_path):
+    path = tmp_path / "bot.sqlite"
+    monkeypatch.setattr(bot, "DB_PATH", str(path))
+    _run(bot.init_db())
+    yield str(path)
+    bot.ORG_CACHE.clear()
+
+
+async def _entity_id(name: str) -> int:
+    async with bot.db_read() as db:
+        async with db.execute("SELECT id FROM entity WHERE name=?", (name,)) as cur:
+            return (await cur.fetchone())[0]
+
+
+async def _renew_and_delete(name: str, expiries: list[date]):
+    eid = await _entity_id(name)
+    for expiry in expiries:
+        async with bot.db_write() as db:
+            await bot.upsert_signature(db, eid, expiry, None)
+    async with bot.db_write() as db:
+        await db.execute("UPDATE signature SET active=0, updated_at=datetime('now') WHERE entity_id=?", (eid,))
+        await db.commit()
+    return eid
+
+
+def _rows(db_path: str, sql: str) -> list[tuple]:
+    with sqlite3.connect(db_path) as db:
+        return db.execute(sql).fetchall()
+
+
+def test_every_change_appends_to_history(db_path):
+    today = date.today()
+    _run(_insert_signature(db_path, name="Иванов", kind="person", expiry=today))
+    _run(_renew_and_delete("Иванов", [today + timedelta(days=365), today + timedelta(days=365)]))
+
+    events = _rows(db_path, "SELECT event, expiry FROM signature_history ORDER BY id")
+    # повторное продление тем же сроком ничего не меняет — и в журнал не попадает
+    assert events == [("created", today.isoformat()),
+                      ("renewed", (today + timedelta(days=365)).isoformat()),
+                      ("deleted", (today + timedelta(days=365)).isoformat())]
+    with sqlite3.connect(db_path) as db, pytest.raises(sqlite3.IntegrityError):
+        db.execute("UPDATE signature_history SET expiry='2000-01-01'")
+
+
+def test_old_inactive_signatures_move_to_archive(db_path, tmp_path):
+    today = date.today()
+    _run(_insert_signature(db_path, name="Иванов", kind="person", expiry=today))
+    _run(_insert_signature(db_path, name="Петров", kind="person", expiry=today))
+    _run(_renew_and_delete("Иванов", []))
+    _run(_renew_and_delete("Петров", []))
+    with sqlite3.connect(db_path) as db:
+        db.execute("UPDATE signature SET updated_at=datetime('now', '-200 days') "
+                   "WHERE entity_id=(SELECT id FROM entity WHERE name='Иванов')")
+
+    assert _run(bot.archive_signatures(retention_days=90)) == 1
+    assert _rows(db_path, "SELECT count(*) FROM signature WHERE active=0") == [(1,)]
+    assert _rows(db_path, "SELECT e.name FROM signature_archive a JOIN entity e ON e.id=a.entity_id") == [("Иванов",)]
+
+    text = _run(bot.build_history_text(_run(_entity_id("Иванов"))))
+    assert "*Прежние подписи:*" in text and f"до {today.strftime('%d.%m.%Y')}" in text
+    assert "снята" in text
+
+    counts = _run(bot.export_registry(str(tmp_path / "out.csv")))
+    assert counts["history"] == 2
+
+
+def test_migration_switches_old_database_to_incremental_vacuum(db_path):
+    with sqlite3.connect(db_path) as db:
+        db.execute("PRAGMA auto_vacuum = NONE")
+        db.execute("VACUUM")
+        db.execute("PRAGMA user_version = 15")
+        assert db.execute("PRAGMA auto_vacuum").fetchone() == (0,)
+
+    _run(bot.init_db())
+
+    assert _rows(db_path, "PRAGMA auto_vacuum") == [(2,)]
+    assert _rows(db_path, "PRAGMA user_version") == [(bot.MIGRATIONS[-1][0],)]
+
+
+def test_maintenance_never_runs_full_vacuum(db_path):
+    with sqlite3.connect(db_path) as db:
+        db.execute("PRAGMA auto_vacuum = NONE")
+        db.execute("VACUUM")
+
+    result = _run(bot.run_maintenance())
+
+    assert result["archived"] == 0
+    assert _rows(db_path, "PRAGMA auto_vacuum") == [(0,)]
+
+
+def test_new_database_uses_incremental_vacuum(db_path):
+    assert _rows(db_path, "PRAGMA auto_vacuum") == [(2,)]
@@ -0,0 +1,81 @@
+import asyncio
+import sqlite3
+import subprocess
+import sys
+from collections.abc import Awaitable
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+import bot
+
+
+def _run(coro: Awaitable[Any]) -> Any:
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db_path(monkeypatch, tmp_path):
+    path = tmp_path / "bot.sqlite"
+    monkeypatch.setattr(bot, "DB_PATH", str(path))
+    _run(bot.init_db())
+    bot.METRICS.reset()
+    yield str(path)
+    bot.METRICS.reset()
+
+
+def _statements() -> list[str]:
+    return [
+        dict(labels)["statement"]
+        for labels in bot.METRICS._hist.get("edsbot_sql_seconds", {})
+        if not dict(labels)["statement"].startswith("PRAGMA")
+    ]
+
+
+def test_restart_on_current_schema_only_reads(db_path):
+    _run(bot.init_db())
+    statements = _statements()
+    assert len(statements) == 1 and statements[0].startswith("SELECT value FROM meta"), statements
+
+
+def test_changed_org_structure_is_synced_once(db_path, monkeypatch):
+    structure = {**bot.ORG_STRUCTURE, "Финансовое управление": {}}
+    monkeypatch.setattr(bot, "ORG_STRUCTURE", structure)
+    _run(bot.init_db())
+    with sqlite3.connect(db_path) as db:
+        assert db.execute("SELECT count(*) FROM grp WHERE name='Финансовое управление'").fetchone() == (1,)
+    bot.METRICS.reset()
+    _run(bot.init_db())
+    assert not any(s.startswith(("INSERT", "UPDATE")) for s in _statements())
+
+
+def test_database_from_before_migrations_is_upgraded(monkeypatch, tmp_path):
+    path = tmp_path / "legacy.sqlite"
+    with sqlite3.connect(path) as db:
+        db.executescript("""
+            CREATE TABLE subscriber (chat_id INTEGER PRIMARY KEY);
+            CREATE TABLE entity (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE,
+                                 kind TEXT NOT NULL CHECK(kind IN ('org','person')), group_id INTEGER NULL);
+            CREATE TABLE signature (id INTEGER PRIMARY KEY AUTOINCREMENT, entity_id INTEGER NOT NULL,
+                                    expiry TEXT NOT NULL, note TEXT, active INTEGER NOT NULL DEFAULT 1,
+                                    created_at TEXT NOT NULL DEFAULT (datetime('now')),
+                                    updated_at TEXT NOT NULL DEFAULT (datetime('now')));
+            CREATE TABLE grp (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE, parent_id INTEGER NULL);
+            INSERT INTO entity(name, kind) VALUES ('Иванов', 'person');
+            INSERT INTO signature(entity_id, expiry) VALUES (1, '2030-01-01');
+        """)
+    monkeypatch.setattr(bot, "DB_PATH", str(path))
+    _run(bot.init_db())
+    with sqlite3.connect(path) as db:
+        assert db.execute("PRAGMA user_version").fetchone() == (bot.MIGRATIONS[-1][0],)
+        assert db.execute("SELECT event FROM signature_history").fetchall() == [("created",)]
+
+
+def test_import_skips_optional_modules():
+    code = "import sys, bot; print(sorted(m for m in ('dateutil', 'xml.etree.ElementTree') if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "[]"
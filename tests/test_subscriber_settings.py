@@ -0,0 +1,94 @@
+import asyncio
+import sys
+from collections.abc import Awaitable
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import bot
+from test_reminders import DummyApplication, _insert_signature, _insert_subscriber
+
+
+def _run(coro: Awaitable[Any]) -> Any:
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db_path(monkeypatch, tmp_path):
+    path = tmp_path / "bot.sqlite"
+    monkeypatch.setattr(bot, "DB_PATH", str(path))
+    _run(bot.init_db())
+    bot.METRICS.reset()
+    yield str(path)
+    bot.METRICS.reset()
+
+
+def _due_queries() -> int:
+    return sum(
+        hist.count
+        for labels, hist in bot.METRICS._hist.get("edsbot_sql_seconds", {}).items()
+        if dict(labels)["statement"].startswith("WITH due")
+    )
+
+
+def test_settings_input_is_validated():
+    assert bot.parse_offsets("30, 7;0 7") == (30, 7, 0)
+    assert bot.parse_remind_time("8.05") == "08:05"
+    assert bot.parse_timezone("Asia/Almaty") == "Asia/Almaty"
+    for parse, bad in ((bot.parse_offsets, "10, -1"), (bot.parse_offsets, ""),
+                       (bot.parse_remind_time, "24:00"), (bot.parse_timezone, "Mars/Olympus")):
+        with pytest.raises(ValueError):
+            parse(bad)
+
+
+def test_each_subscriber_gets_own_offsets_from_one_query(db_path):
+    for chat_id in (101, 102, 103):
+        _run(_insert_subscriber(db_path, chat_id))
+    today = date.today()
+    _run(_insert_signature(db_path, name="Иванов", kind="person", expiry=today + timedelta(days=5)))
+    _run(_insert_signature(db_path, name="Петров", kind="person", expiry=today + timedelta(days=7)))
+    _run(bot.save_subscriber_settings(102, offsets=(7,)))
+    _run(bot.save_subscriber_settings(103, offsets=(7,)))
+    app = DummyApplication()
+
+    _run(bot.send_reminders(app))
+
+    sent = sorted((chat_id, text.split("\n")[1]) for chat_id, text, _ in app.bot.sent_messages)
+    assert sent == [(101, "[ФЛ] Иванов"), (102, "[ФЛ] Петров"), (103, "[ФЛ] Петров")]
+    assert _due_queries() == 1
+    # прогресс отмечен у каждого чата
+    _run(bot.send_reminders(app))
+    assert len(app.bot.sent_messages) == 3
+
+
+def test_subscribers_are_bucketed_by_delivery_slot(db_path):
+    for chat_id in (201, 202, 203):
+        _run(_insert_subscriber(db_path, chat_id))
+    _run(bot.save_subscriber_settings(202, remind_at="07:30", tz="Asia/Almaty", offsets=(3,)))
+    _run(bot.save_subscriber_settings(203, remind_at="07:30", tz="Asia/Almaty"))
+    _run(_insert_signature(db_path, name="Иванов", kind="person", expiry=date.today() + timedelta(days=5)))
+
+    slots = _run(bot.get_reminder_slots())
+    almaty = ("07:30", "Asia/Almaty")
+    assert slots == {(bot.REMIND_AT, bot.TZ): bot.REMIND_OFFSETS,
+                     almaty: tuple(sorted({3, *bot.REMIND_OFFSETS}, reverse=True))}
+    assert _run(bot.get_subscribers(almaty)) == [202, 203]
+
+    app = DummyApplication()
+    _run(bot.send_slot_reminders(app, almaty, date.today()))
+    # у 202 только «за 3 дня» — совпадений нет; 201 в другом слоте
+    assert [chat_id for chat_id, _, _ in app.bot.sent_messages] == [203]
+
+
+def test_settings_view_marks_defaults_and_reset(db_path):
+    _run(bot.save_subscriber_settings(301, tz="Asia/Tokyo"))
+    text, _ = _run(bot.build_settings_view(301))
+    assert "Часовой пояс: Asia/Tokyo\n" in text + "\n"
+    assert f"Время: {bot.REMIND_AT} _(по умолчанию)_" in text
+
+    _run(bot.save_subscriber_settings(301, reset=True))
+    assert _run(bot.get_subscriber_settings(301))["own"] == {"offsets": False, "remind_at": False, "tz": False}
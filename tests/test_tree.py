@@ -0,0 +1,119 @@
+import asyncio
+import sys
+from collections.abc import Awaitable
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+import aiosqlite
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import bot
+
+
+def _run(coro: Awaitable[Any]) -> Any:
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db_path(monkeypatch, tmp_path):
+    path = tmp_path / "bot.sqlite"
+    monkeypatch.setattr(bot, "DB_PATH", str(path))
+    _run(bot.init_db())
+    yield str(path)
+    bot.ORG_CACHE.clear()
+
+
+async def _group_id(db_path: str, name: str) -> int:
+    async with aiosqlite.connect(db_path) as db:
+        async with db.execute("SELECT id FROM grp WHERE name=?", (name,)) as cur:
+            return (await cur.fetchone())[0]
+
+
+class FakeQuery:
+    def __init__(self, data: str):
+        self.data = data
+        self.edits: list[tuple[str, Any]] = []
+        self.answers: list[str | None] = []
+
+    async def answer(self, text=None, **kwargs):
+        self.answers.append(text)
+
+    async def edit_message_text(self, text, reply_markup=None, **kwargs):
+        self.edits.append((text, reply_markup))
+
+
+async def _click(data: str, user_data: dict | None = None) -> FakeQuery:
+    q = FakeQuery(data)
+    context = SimpleNamespace(user_data={} if user_data is None else user_data)
+    mode, action, group_id, arg = bot.parse_tree_callback(data, context.user_data)
+    await bot.tree_handle_callback(SimpleNamespace(callback_query=q), context, mode, action, group_id, arg)
+    return q
+
+
+def _button(markup, prefix: str):
+    return next(b for row in markup.inline_keyboard for b in row if b.text.startswith(prefix))
+
+
+def test_tokens_are_compact_and_round_trip():
+    for mode in bot.TREE_MODES:
+        for action in bot.TREE_ACTIONS:
+            token = bot._tree_cb(mode, action, 36 ** 6, bot._b36(2 ** 40))
+            assert len(token.encode()) <= 64
+            assert bot.parse_tree_callback(token, {}) == (mode, action, 36 ** 6, bot._b36(2 ** 40))
+    assert bot.parse_tree_callback(bot._tree_cb("browse", "up"), {}) == ("browse", "up", None, "")
+    assert bot.parse_tree_callback("t:zz::", {}) is None
+    assert bot.parse_tree_callback("t:be:@@:", {}) is None
+
+
+def test_navigation_needs_no_user_state(db_path):
+    parent = _run(_group_id(db_path, "Управление культуры"))
+    child = _run(_group_id(db_path, "РЦНТ"))
+
+    async def scenario():
+        await bot.ORG_CACHE.load()
+        # «войти» в дочернюю организацию с пустым user_data — как после перезапуска
+        q = await _click(bot._tree_cb("sign_update", "enter", child))
+        text, markup = q.edits[-1]
+        back = _button(markup, "⬅️")
+        q_up = await _click(back.callback_data)
+        return text, back.callback_data, q_up.edits[-1][0]
+
+    text, back, up_text = _run(scenario())
+    assert "Управление культуры / РЦНТ" in text
+    assert bot.parse_tree_callback(back, {})[2] == parent
+    assert "Текущая организация: Управление культуры" in up_text
+    assert "РЦНТ" not in up_text
+
+
+def test_legacy_callbacks_still_work(db_path):
+    parent = _run(_group_id(db_path, "Управление культуры"))
+    child = _run(_group_id(db_path, "РЦНТ"))
+    state = {"tree": {"mode": "browse", "path": [[parent, "Управление культуры"], [child, "РЦНТ"]]}}
+
+    assert bot.parse_tree_callback(f"tree|browse|enter|{child}", {}) == ("browse", "enter", child, "")
+    assert bot.parse_tree_callback("tree|browse|up|_", state) == ("browse", "up", parent, "")
+    assert bot.parse_tree_callback("tree|browse|up|_", {}) == ("browse", "up", None, "")
+    assert bot.parse_tree_callback("tree|browse|show|employees", state) == \
+        ("browse", "show", child, "employees")
+    assert bot.parse_tree_callback("tree|sign_update|select|40", {}) == ("sign_update", "select", None, "14")
+    assert bot.parse_tree_callback("tree|nope|enter|1", {}) is None
+
+    q = _run(_click(f"tree|browse|enter|{child}"))
+    assert "Управление культуры / РЦНТ" in q.edits[-1][0]
+
+
+def test_add_without_existing_group_is_rejected(db_path):
+    async def scenario():
+        user_data: dict = {}
+        no_group = await _click(bot._tree_cb("reg_add_person", "add"), user_data)
+        deleted = await _click(bot._tree_cb("reg_add_person", "add", 10_000), user_data)
+        return no_group, deleted, user_data
+
+    no_group, deleted, user_data = _run(scenario())
+    for q in (no_group, deleted):
+        assert q.answers[-1] == "Организация не найдена"
+        assert q.edits == []
+    assert "awaiting" not in user_data
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import sys
+from collections.abc import Awaitable
+from pathlib import Path
+from typing import Any
+
+import httpx
+import pytest
+from telegram.ext import Application
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import bot
+
+SECRET = "s3cret-token"
+UPDATE = json.loads((Path(__file__).parent / "data" / "update_message.json").read_text("utf-8"))
+
+
+def _run(coro: Awaitable[Any]) -> Any:
+    return asyncio.run(coro)
+
+
+async def _with_server(scenario, **routes):
+    app = Application.builder().token("123456:TEST").updater(None).build()
+    server = bot.HttpServer("127.0.0.1", 0)
+    server.route("POST", "/hook", bot.webhook_handler(app, SECRET))
+    for path, handler in routes.items():
+        server.route("POST", f"/{path}", handler)
+    await server.start()
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{server.port}") as client:
+            return await scenario(client, app, server)
+    finally:
+        await server.stop(timeout=1)
+
+
+def test_recorded_update_is_queued():
+    async def scenario(client, app, server):
+        resp = await client.post("/hook", json=UPDATE,
+                                 headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})
+        return resp.status_code, app.update_queue.get_nowait()
+
+    status, update = _run(_with_server(scenario))
+    assert status == 200
+    assert update.update_id == UPDATE["update_id"]
+    assert update.message.text == "/next"
+    assert update.effective_user.id == 42
+
+
+def test_rejects_bad_secret_and_malformed_requests():
+    async def scenario(client, app, server):
+        server.max_body = 4096
+        codes = [
+            (await client.post("/hook", json=UPDATE)).status_code,
+            (await client.post("/hook", json=UPDATE,
+                               headers={"X-Telegram-Bot-Api-Secret-Token": "nope"})).status_code,
+            (await client.post("/hook", content=b"{not json",
+                               headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})).status_code,
+            (await client.post("/other", json=UPDATE)).status_code,
+            (await client.get("/hook")).status_code,
+            (await client.post("/hook", content=b"x" * 5000)).status_code,
+        ]
+        return codes, app.update_queue.qsize()
+
+    codes, queued = _run(_with_server(scenario))
+    assert codes == [403, 403, 400, 404, 405, 413]
+    assert queued == 0
+
+
+def test_keep_alive_serves_many_requests_concurrently():
+    async def scenario(client, app, server):
+        updates = [{**UPDATE, "update_id": UPDATE["update_id"] + i} for i in range(20)]
+        responses = await asyncio.gather(*(
+            client.post("/hook", json=u, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})
+            for u in updates
+        ))
+        return [r.status_code for r in responses], app.update_queue.qsize()
+
+    codes, queued = _run(_with_server(scenario))
+    assert codes == [200] * 20
+    assert queued == 20
+
+
+def test_stop_lets_inflight_requests_finish():
+    async def scenario(client, app, server):
+        entered = asyncio.Event()
+
+        async def slow(req):
+            entered.set()
+            await asyncio.sleep(0.2)
+            return 200, "text/plain", b"done"
+
+        server.route("POST", "/slow", slow)
+        pending = asyncio.create_task(client.post("/slow"))
+        await entered.wait()
+        await server.stop(timeout=5)
+        resp = await pending
+        with pytest.raises(httpx.ConnectError):
+            await httpx.AsyncClient().post(f"http://127.0.0.1:{server.port}/slow")
+        return resp.status_code, resp.content
+
+    assert _run(_with_server(scenario)) == (200, b"done")